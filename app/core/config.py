@@ -26,6 +26,54 @@ class Settings(BaseSettings):
     # 文件存储
     UPLOAD_DIR: str = "static"
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # 断点续传会话无活动多久后过期（秒）
+    UPLOAD_SESSION_SWEEP_INTERVAL: int = 3600  # 清理所有用户过期上传会话、回收未引用存储文件的间隔（秒）
+    WORKING_MAX_EDGE: int = 2048  # 工作副本长边像素，生成与评分都基于工作副本
+    DERIVATIVE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # 缩略图磁盘缓存总大小上限
+    RENDER_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 生成图按需渲染结果的磁盘缓存总大小上限
+    RENDER_JPEG_QUALITY: int = 88  # 生成图 JPEG 编码质量（无法无损裁剪时）
+    RENDER_JPEG_PROGRESSIVE: bool = True  # 生成图 JPEG 使用渐进式编码
+    RENDER_JPEG_OPTIMIZE: bool = True  # 生成图 JPEG 优化哈夫曼表
+    RENDER_PREWARM_COUNT: int = 3  # 生成后立即预渲染的得分最高的候选图数，其余在首次请求时渲染
+    
+    # 评分模型（ONNX，CPU 推理），不配置或无法加载时使用启发式构图评分
+    SCORE_MODEL_PATH: Optional[str] = None
+    SCORE_MODEL_INPUT_SIZE: int = 224  # 模型输入边长
+    SCORE_BATCH_SIZE: int = 32  # 单次推理最多合并的图片数
+    SCORE_BATCH_WINDOW_MS: int = 10  # 第一张图片到达后最多等待多久再推理
+    SCORE_INTRA_OP_THREADS: int = 2  # 推理使用的线程数
+    
+    SCORE_CACHE_PATH: Optional[str] = None  # 评分缓存 SQLite 文件，默认 UPLOAD_DIR/cache/scores.sqlite3
+    SCORE_CACHE_MEMORY_ENTRIES: int = 20000  # 内存中保留的评分缓存条目数
+    SCORE_CACHE_MAX_ROWS: int = 200000  # 评分缓存 SQLite 文件最多保留的条目数，超出时删除最久未使用的
+    
+    # 后台执行器
+    IMAGE_PROCESS_WORKERS: int = 2  # 图像CPU处理进程数
+    IMAGE_QUEUE_SIZE: int = 32  # 图像进程池最多排队任务数
+    IO_THREAD_WORKERS: int = 16  # 阻塞数据库/文件操作线程数
+    IO_QUEUE_SIZE: int = 128  # IO线程池最多排队任务数
+    GENERATION_WORKERS: int = 2  # 同时执行的生成任务数
+    GENERATION_QUEUE_SIZE: int = 64  # 最多排队的生成任务数
+    SCHEDULER_USER_CONCURRENCY: int = 1  # 每个用户同时执行的生成/评分任务数
+    SCHEDULER_MAX_QUEUED: int = 64  # 生成/评分任务总排队上限，超过返回 429
+    SCHEDULER_USER_QUEUE_LIMIT: int = 8  # 每个用户最多排队的生成/评分任务数
+    SCHEDULER_SHUTDOWN_TIMEOUT: int = 30  # 关闭时等待排队和执行中的生成/评分任务完成的最长时间（秒）
+    ENCODE_WORKERS: int = 2  # 生成图编码进程数
+    ENCODE_QUEUE_SIZE: int = 64  # 编码进程池最多排队任务数
+    GENERATION_STREAMING: bool = True  # 生成任务逐张 裁剪->编码->评分->入库，结果边生成边可查
+    GENERATION_PIPELINE_QUEUE_SIZE: int = 4  # 流式生成各阶段之间的队列长度
+    GENERATION_SCORE_BATCH: int = 4  # 流式生成时每次一起评分的候选图数，同一批只解码一次源图
+    GENERATION_CACHE_SIZE: int = 4096  # 内存中缓存的候选裁剪结果数
+    
+    # 进度事件（SSE）
+    EVENT_REPLAY_SIZE: int = 50  # 每个主题保留供补发的最近事件数
+    EVENT_MAX_TOPICS: int = 10000  # 最多保留事件的主题数
+    EVENT_QUEUE_SIZE: int = 100  # 每个连接最多缓冲的未发送事件数
+    EVENT_STREAM_KEEPALIVE: int = 15  # 没有事件时发送心跳的间隔（秒）
+    EVENT_STREAM_TIMEOUT: int = 600  # 单个事件流最长保持时间（秒），之后客户端自动重连
+    
+    # 任务状态
+    JOB_HOT_SET_SIZE: int = 10000  # 内存中保留的最近任务数，更早的任务从数据库查询
     
     # 项目根目录
     @property
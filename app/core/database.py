@@ -2,10 +2,13 @@
 数据库连接和初始化模块
 """
 import os
+import threading
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence
 from contextlib import contextmanager
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -34,6 +37,137 @@ def get_db():
     finally:
         session.close()
 
+# 自增ID分配方式缓存：(innodb_autoinc_lock_mode, auto_increment_increment)
+_autoinc_settings: Optional[tuple[int, int]] = None
+_autoinc_lock = threading.Lock()
+
+# 数据库服务器时钟偏差缓存：(测量时的 monotonic 时间, 偏差)
+CLOCK_OFFSET_TTL = 600
+_clock_offset: Optional[tuple[float, timedelta]] = None
+_clock_lock = threading.Lock()
+
+def _supports_returning(db) -> bool:
+    """当前数据库方言是否支持 INSERT ... RETURNING"""
+    return bool(getattr(db.get_bind().dialect, "full_returning", False))
+
+def _consecutive_id_step(db) -> Optional[int]:
+    """多行 INSERT 得到连续自增ID时返回步长，否则返回 None
+
+    InnoDB 在 innodb_autoinc_lock_mode 为 0 或 1 时保证单条多行 INSERT 的ID连续，
+    为 2（交错模式）时不保证。
+    """
+    global _autoinc_settings
+    if db.get_bind().dialect.name != "mysql":
+        return None
+    if _autoinc_settings is None:
+        with _autoinc_lock:
+            if _autoinc_settings is None:
+                row = db.execute(text(
+                    "SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment"
+                )).fetchone()
+                _autoinc_settings = (int(row[0]), int(row[1]))
+    lock_mode, increment = _autoinc_settings
+    return increment if lock_mode in (0, 1) else None
+
+def _server_clock_offset(db) -> timedelta:
+    """数据库服务器时钟相对应用时钟的偏差（含时区差），每 CLOCK_OFFSET_TTL 秒测量一次"""
+    global _clock_offset
+    if _clock_offset is None or time.monotonic() - _clock_offset[0] > CLOCK_OFFSET_TTL:
+        with _clock_lock:
+            if _clock_offset is None or time.monotonic() - _clock_offset[0] > CLOCK_OFFSET_TTL:
+                precise = db.get_bind().dialect.name == "mysql"
+                before = datetime.now()
+                server_now = db.execute(text("SELECT CURRENT_TIMESTAMP(6)" if precise else "SELECT CURRENT_TIMESTAMP")).scalar()
+                after = datetime.now()
+                if isinstance(server_now, str):
+                    server_now = datetime.fromisoformat(server_now)
+                _clock_offset = (time.monotonic(), server_now - (before + (after - before) / 2))
+    return _clock_offset[1]
+
+def _server_created_at(db) -> datetime:
+    """列默认值 CURRENT_TIMESTAMP 在此刻写入的值（TIMESTAMP 列精确到秒），由缓存的时钟偏差推算，不查询数据库"""
+    return (datetime.now() + _server_clock_offset(db)).replace(microsecond=0)
+
+def insert_row(db, table: str, values: dict) -> tuple[int, datetime]:
+    """插入一行，返回自增ID和创建时间，不再回查
+
+    created_at 由列默认值 CURRENT_TIMESTAMP 在 INSERT 中按数据库服务器时钟填充：
+    支持 RETURNING 的数据库在同一条语句中返回；MySQL 没有 RETURNING，ID 使用 lastrowid，
+    创建时间按缓存的服务器时钟偏差推算（偏差误差为毫秒级，恰在整秒边界插入时可能与存储值相差 1 秒）。
+    """
+    columns = ", ".join(values)
+    placeholders = ", ".join(f":{column}" for column in values)
+    sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+    if _supports_returning(db):
+        row = db.execute(text(f"{sql} RETURNING id, created_at"), values).fetchone()
+        return row[0], row[1]
+    
+    result = db.execute(text(sql), values)
+    return result.lastrowid, _server_created_at(db)
+
+def insert_rows(
+    db,
+    table: str,
+    rows: Sequence[dict],
+    key_column: Optional[str] = None,
+) -> list[tuple[int, datetime]]:
+    """用一条多行 INSERT 插入多行，按输入顺序返回 (自增ID, 创建时间)，created_at 由列默认值填充
+
+    自增ID保证连续（innodb_autoinc_lock_mode 为 0 或 1）时由首个ID推算，创建时间同 insert_row 推算；
+    否则若提供了唯一的 key_column，用一次 IN 查询取回ID和创建时间；都不满足时逐行插入。
+    MySQL 8 默认的 innodb_autoinc_lock_mode=2 不保证单条语句内的ID连续，每批多一次 IN 查询；
+    需要省去这次查询时可把该参数设为 1。
+    """
+    if not rows:
+        return []
+    
+    step = _consecutive_id_step(db)
+    if step is None and key_column is None:
+        return [insert_row(db, table, row) for row in rows]
+    
+    columns = list(rows[0])
+    params = {}
+    value_groups = []
+    for index, row in enumerate(rows):
+        value_groups.append("(" + ", ".join(f":{column}_{index}" for column in columns) + ")")
+        for column in columns:
+            params[f"{column}_{index}"] = row[column]
+    result = db.execute(
+        text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join(value_groups)}"),
+        params
+    )
+    
+    if step is not None:
+        first_id = result.lastrowid
+        created_at = _server_created_at(db)
+        return [(first_id + index * step, created_at) for index in range(len(rows))]
+    
+    keys = [row[key_column] for row in rows]
+    fetched = db.execute(
+        text(f"SELECT id, created_at, {key_column} FROM {table} WHERE {key_column} IN :keys")
+        .bindparams(bindparam("keys", expanding=True)),
+        {"keys": keys}
+    ).fetchall()
+    inserted = {row[2]: (row[0], row[1]) for row in fetched}
+    return [inserted[row[key_column]] for row in rows]
+
+def insert_many(db, table: str, rows: Sequence[dict], skip_duplicates: bool = False) -> int:
+    """不需要返回ID的批量插入，返回影响的行数
+
+    以 executemany 执行，pymysql 会把它改写成一条多行 INSERT；
+    created_at 由列默认值 CURRENT_TIMESTAMP 填充；
+    skip_duplicates 为 True 时追加 ON DUPLICATE KEY UPDATE id = id，只跳过与唯一键冲突的行，
+    其他数据错误照常抛出（INSERT IGNORE 会把它们也降级为警告）。
+    """
+    if not rows:
+        return 0
+    columns = list(rows[0])
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(f':{column}' for column in columns)})"
+    if skip_duplicates:
+        sql += " ON DUPLICATE KEY UPDATE id = id"
+    result = db.execute(text(sql), rows)
+    return result.rowcount
+
 def create_database_if_not_exists():
     """如果数据库不存在则创建"""
     try:
@@ -88,6 +222,9 @@ def init_database():
                     mime_type VARCHAR(100) NOT NULL,
                     width INT,
                     height INT,
+                    content_hash CHAR(64),
+                    working_path VARCHAR(500),
+                    working_hash CHAR(64),
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
@@ -100,6 +237,8 @@ def init_database():
                     original_image_id INT NOT NULL,
                     filename VARCHAR(255) NOT NULL,
                     file_path VARCHAR(500) NOT NULL,
+                    content_hash CHAR(64),
+                    render_params TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (original_image_id) REFERENCES images(id) ON DELETE CASCADE
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
@@ -119,6 +258,48 @@ def init_database():
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """))
             
+            # 5. 创建内容寻址存储表（引用计数）
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    content_hash CHAR(64) PRIMARY KEY,
+                    file_path VARCHAR(500) NOT NULL,
+                    file_size BIGINT NOT NULL,
+                    ref_count INT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """))
+            
+            # 6. 创建用户序号计数器表
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS user_sequences (
+                    user_id INT NOT NULL,
+                    seq_name VARCHAR(50) NOT NULL,
+                    last_value BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, seq_name),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """))
+            
+            # 7. 创建后台任务状态表
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id CHAR(32) PRIMARY KEY,
+                    kind VARCHAR(20) NOT NULL,
+                    user_id INT,
+                    status VARCHAR(20) NOT NULL,
+                    stage VARCHAR(50),
+                    progress INT NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    version INT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """))
+            
+            # 为旧表补充新增的列
+            add_missing_columns(conn)
+            
             # 创建索引
             create_indexes(conn)
             
@@ -128,6 +309,35 @@ def init_database():
         print(f"❌ 数据库初始化失败: {e}")
         raise
 
+def add_missing_columns(conn):
+    """为已存在的旧表补充新增的列"""
+    columns = [
+        ("images", "content_hash", "CHAR(64)"),
+        ("generated_images", "content_hash", "CHAR(64)"),
+        ("images", "working_path", "VARCHAR(500)"),
+        ("images", "working_hash", "CHAR(64)"),
+        ("generated_images", "render_params", "TEXT"),
+    ]
+    
+    for table_name, column_name, definition in columns:
+        try:
+            # 检查列是否已存在
+            check_sql = f"""
+                SELECT COUNT(*) 
+                FROM information_schema.columns 
+                WHERE table_schema = DATABASE() 
+                AND table_name = '{table_name}' 
+                AND column_name = '{column_name}'
+            """
+            result = conn.execute(text(check_sql)).fetchone()
+            
+            if result[0] == 0:
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"))
+                print(f"✅ 添加列: {table_name}.{column_name}")
+                
+        except Exception as e:
+            print(f"⚠️ 添加列 {table_name}.{column_name} 时出错: {e}")
+
 def create_indexes(conn):
     """创建数据库索引"""
     indexes = [
@@ -135,8 +345,10 @@ def create_indexes(conn):
         ("idx_users_username", "users", "username"),
         ("idx_images_user_id", "images", "user_id"),
         ("idx_images_created_at", "images", "created_at"),
+        ("idx_images_filename", "images", "filename"),
         ("idx_generated_images_original_id", "generated_images", "original_image_id"),
         ("idx_generated_images_created_at", "generated_images", "created_at"),
+        ("idx_generated_images_filename", "generated_images", "filename"),
         ("idx_image_evaluations_generated_id", "image_evaluations", "generated_image_id"),
         ("idx_image_evaluations_score", "image_evaluations", "overall_score"),
         ("idx_image_evaluations_created_at", "image_evaluations", "created_at")
@@ -172,7 +384,8 @@ def create_storage_directories():
         "static/avatars",
         "static/original", 
         "static/results",
-        "static/temp"
+        "static/temp",
+        "static/blobs"
     ]
     
     for directory in directories:
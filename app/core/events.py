@@ -0,0 +1,147 @@
+"""
+进程内事件发布订阅
+生成、评分服务在工作线程中发布进度事件，SSE 连接在事件循环中订阅；
+每个主题保留最近的若干事件，后到的订阅者（或带 Last-Event-ID 重连的客户端）先收到补发的事件。
+只在本进程内传递，多进程部署时客户端需连接到执行任务的进程，或回退到轮询
+"""
+import asyncio
+import itertools
+import json
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Optional
+
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class Event:
+    id: int
+    topic: str
+    event: str
+    data: dict
+
+    def to_sse(self) -> str:
+        """编码为 SSE 消息"""
+        payload = json.dumps(self.data, ensure_ascii=False, default=str)
+        return f"id: {self.id}\nevent: {self.event}\ndata: {payload}\n\n"
+
+
+def image_topic(original_image_id: int) -> str:
+    return f"image:{original_image_id}"
+
+
+def job_topic(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, event: Event) -> None:
+        """在事件循环线程中调用；客户端跟不上时丢弃最旧的事件"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class EventBus:
+    """按主题分发事件，publish 可在任意线程调用"""
+
+    def __init__(self, replay_size: int, max_topics: int, queue_size: int):
+        self.replay_size = replay_size
+        self.max_topics = max_topics
+        self.queue_size = queue_size
+        self._ids = itertools.count(1)
+        self._history: "OrderedDict[str, deque[Event]]" = OrderedDict()
+        self._subscribers: dict[str, set[_Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, topic: str, event: str, data: dict) -> Event:
+        with self._lock:
+            message = Event(next(self._ids), topic, event, data)
+            history = self._history.get(topic)
+            if history is None:
+                history = self._history[topic] = deque(maxlen=self.replay_size)
+            history.append(message)
+            self._history.move_to_end(topic)
+            while len(self._history) > self.max_topics:
+                self._history.popitem(last=False)
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, message)
+            except RuntimeError:
+                # 订阅者的事件循环已关闭
+                self._unsubscribe(topic, subscriber)
+        return message
+
+    def publish_many(self, topics: list[str], event: str, data: dict) -> None:
+        for topic in topics:
+            self.publish(topic, event, data)
+
+    def _unsubscribe(self, topic: str, subscriber: _Subscriber) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    async def subscribe(
+        self,
+        topic: str,
+        last_event_id: Optional[int] = None,
+        keepalive: Optional[float] = None,
+    ) -> AsyncIterator[Optional[Event]]:
+        """订阅主题：先补发 last_event_id 之后（未指定时为全部）保留的事件，再持续产出新事件；
+        keepalive 秒内没有事件时产出 None，供调用方发送心跳或检查连接
+        """
+        subscriber = _Subscriber(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscriber)
+            backlog = [e for e in self._history.get(topic, ()) if last_event_id is None or e.id > last_event_id]
+        try:
+            sent = last_event_id or 0
+            for event in backlog:
+                sent = event.id
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event.id <= sent:
+                    continue  # 订阅与补发之间发布的事件可能重复
+                sent = event.id
+                yield event
+        finally:
+            self._unsubscribe(topic, subscriber)
+
+
+def publish_after_commit(session, topics: list[str], event: str, data: dict) -> None:
+    """事件在会话提交后发布，回滚则丢弃，订阅者不会看到未提交的数据"""
+    from sqlalchemy import event as sa_event
+
+    pending = session.info.get("pending_events")
+    if pending is None:
+        pending = session.info["pending_events"] = []
+
+        def flush(committed_session) -> None:
+            events, committed_session.info["pending_events"] = committed_session.info.get("pending_events", []), []
+            for item in events:
+                event_bus.publish_many(*item)
+
+        def discard(rolled_back_session, *_: Any) -> None:
+            rolled_back_session.info["pending_events"] = []
+
+        sa_event.listen(session, "after_commit", flush)
+        sa_event.listen(session, "after_rollback", discard)
+    pending.append((topics, event, data))
+
+
+event_bus = EventBus(settings.EVENT_REPLAY_SIZE, settings.EVENT_MAX_TOPICS, settings.EVENT_QUEUE_SIZE)
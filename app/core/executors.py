@@ -0,0 +1,157 @@
+"""
+后台执行器
+CPU 密集的图像处理（解码、哈希、缩放、裁剪、评分）放进进程池，生成图编码使用单独的进程池，
+阻塞的数据库/文件操作放进线程池，整条生成流水线作为后台任务放进单独的线程池；
+都限制排队数量，队列满时返回 503，
+避免一张慢图片或一波突发请求拖住事件循环上的所有请求
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+
+
+class BoundedExecutor:
+    """限制 执行中+排队 任务总数的执行器包装，底层执行器在首次提交时创建"""
+
+    def __init__(self, name: str, factory: Callable[[], Executor], max_workers: int, queue_size: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.capacity = max_workers + queue_size
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """执行中和排队中的任务数"""
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._factory()
+            return self._executor
+
+    def _discard_broken(self, executor: Executor) -> None:
+        """子进程异常退出后进程池不可再用，丢弃它以便下次提交时重建"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future: Optional[Future] = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        """提交任务，队列已满时抛出 503"""
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="服务器繁忙，请稍后重试",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            try:
+                future = executor.submit(fn, *args, **kwargs)
+            except BrokenExecutor:
+                self._discard_broken(executor)
+                future = self._get_executor().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """在执行器中运行任务并在事件循环中等待结果"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """关闭底层执行器，之后再次提交会重新创建"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _create_process_pool() -> Executor:
+    # 使用 spawn 启动子进程，避免 fork 继承数据库连接和事件循环状态
+    return ProcessPoolExecutor(
+        max_workers=settings.IMAGE_PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def _create_encode_pool() -> Executor:
+    return ProcessPoolExecutor(
+        max_workers=settings.ENCODE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def _create_thread_pool() -> Executor:
+    return ThreadPoolExecutor(
+        max_workers=settings.IO_THREAD_WORKERS,
+        thread_name_prefix="visionmorph-io",
+    )
+
+
+def _create_generation_pool() -> Executor:
+    return ThreadPoolExecutor(
+        max_workers=settings.GENERATION_WORKERS,
+        thread_name_prefix="visionmorph-generate",
+    )
+
+
+# 图像CPU处理进程池：任务函数必须是可被 pickle 的模块级函数
+image_executor = BoundedExecutor(
+    "image", _create_process_pool, settings.IMAGE_PROCESS_WORKERS, settings.IMAGE_QUEUE_SIZE
+)
+
+# 生成图编码进程池：一次生成的多张候选图并行编码，不占用候选搜索和缩略图的进程
+encode_executor = BoundedExecutor(
+    "encode", _create_encode_pool, settings.ENCODE_WORKERS, settings.ENCODE_QUEUE_SIZE
+)
+
+# 阻塞的数据库和文件操作线程池
+io_executor = BoundedExecutor(
+    "io", _create_thread_pool, settings.IO_THREAD_WORKERS, settings.IO_QUEUE_SIZE
+)
+
+# 后台生成与评分任务线程池（由公平调度器提交），与请求处理使用的 IO 线程池分开
+generation_executor = BoundedExecutor(
+    "generate", _create_generation_pool, settings.GENERATION_WORKERS, settings.GENERATION_QUEUE_SIZE
+)
+
+
+async def run_in_process(fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """在图像进程池中执行CPU密集任务"""
+    return await image_executor.run(fn, *args, **kwargs)
+
+
+async def run_in_thread(fn: Callable, *args: Any, **kwargs: Any) -> Any:
+    """在IO线程池中执行阻塞调用"""
+    return await io_executor.run(fn, *args, **kwargs)
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """关闭所有执行器
+
+    先等待执行中和已排队的生成任务完成（它们还会用到进程池和IO线程池），
+    IO线程池最后关闭，任务的最终状态得以写入数据库。
+    """
+    generation_executor.shutdown(wait=wait)
+    image_executor.shutdown(wait=wait)
+    encode_executor.shutdown(wait=wait)
+    io_executor.shutdown(wait=wait)
@@ -0,0 +1,333 @@
+"""
+图像处理工具
+上传探测、缩略图等需要解码图片的公共函数，保持为模块级函数以便在进程池中执行
+"""
+import hashlib
+import io
+import math
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+import imagehash
+from PIL import Image as PILImage
+from PIL import ImageCms, ImageOps, JpegImagePlugin
+
+EXIF_ORIENTATION_TAG = 0x0112
+PHASH_HASH_SIZE = 8
+PHASH_HIGHFREQ_FACTOR = 4
+PHASH_IMAGE_SIZE = PHASH_HASH_SIZE * PHASH_HIGHFREQ_FACTOR  # pHash 实际使用的边长（32px）
+
+WORKING_COPY_QUALITY = 90  # 工作副本 JPEG 质量
+SRGB_PROFILE = ImageCms.createProfile("sRGB")
+
+# 缩略图输出格式：PIL 格式名和编码参数
+DERIVATIVE_ENCODERS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+JPEGTRAN_PATH = shutil.which("jpegtran")  # 未安装时生成图裁剪总是重新编码
+JPEG_MCU_SIZES = {0: (8, 8), 1: (16, 8), 2: (16, 16)}  # 色度抽样（4:4:4 / 4:2:2 / 4:2:0） -> MCU 宽高
+
+
+@dataclass
+class EncodeResult:
+    """一次编码的结果：写入字节数、耗时，以及是否走了无损裁剪"""
+    bytes_written: int
+    encode_seconds: float
+    lossless: bool = False
+
+
+@dataclass
+class ImageProbe:
+    """图片探测结果：一次打开得到的尺寸、格式、EXIF方向和感知哈希"""
+    width: int = 0
+    height: int = 0
+    format: Optional[str] = None
+    mime_type: Optional[str] = None
+    orientation: int = 1  # EXIF Orientation，1 表示无需旋转
+    phash: Optional[int] = None  # 64位感知哈希
+
+
+@dataclass
+class WorkingCopy:
+    """工作副本：摆正方向、转换为 sRGB 并限制长边后的 JPEG
+
+    temp_path 为 None 表示原图已满足要求，直接以原图作为工作副本。
+    """
+    temp_path: Optional[str]
+    content_hash: Optional[str] = None
+    file_size: int = 0
+    width: int = 0
+    height: int = 0
+
+
+def phash_of_image(image: PILImage.Image) -> int:
+    """计算已打开图片的感知哈希
+
+    JPEG 通过 draft 模式在 DCT 阶段直接缩小解码（最多 1/8），
+    只解出 pHash 需要的灰度小图，避免完整解码大图。
+    """
+    image.draft("L", (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    hash_value = imagehash.phash(image, hash_size=PHASH_HASH_SIZE, highfreq_factor=PHASH_HIGHFREQ_FACTOR)
+    return int(str(hash_value), 16)
+
+
+def compute_phash(file_path: str) -> int:
+    """计算图片文件的64位感知哈希，以整数形式返回"""
+    with PILImage.open(file_path) as image:
+        return phash_of_image(image)
+
+
+def probe_image(file_path: str) -> ImageProbe:
+    """打开图片一次，得到尺寸、格式、EXIF方向和感知哈希
+
+    尺寸、格式和 EXIF 都来自文件头，不需要解码像素；
+    无法识别的文件返回尺寸为 (0, 0)、哈希为 None 的探测结果。
+    """
+    probe = ImageProbe()
+    try:
+        with PILImage.open(file_path) as image:
+            probe.width, probe.height = image.size
+            probe.format = image.format
+            probe.mime_type = image.get_format_mimetype()
+            try:
+                probe.orientation = int(image.getexif().get(EXIF_ORIENTATION_TAG, 1))
+            except Exception:
+                probe.orientation = 1
+            probe.phash = phash_of_image(image)
+    except Exception as e:
+        print(f"⚠️ 无法解析图片 {file_path}: {e}")
+    return probe
+
+
+def save_atomic(image: PILImage.Image, dest_path: str, fmt: str, **overrides) -> int:
+    """按 DERIVATIVE_ENCODERS 中的格式编码，先写临时文件再替换，返回写入的字节数
+
+    overrides 覆盖默认编码参数（quality、progressive、optimize 等）。
+    """
+    pil_format, options = DERIVATIVE_ENCODERS[fmt]
+    options = {**options, **overrides}
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    temp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        image.save(temp_path, pil_format, **options)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.path.getsize(dest_path)
+
+
+def render_derivative(source_path: str, dest_path: str, max_edge: int, fmt: str) -> int:
+    """生成长边不超过 max_edge 的缩略图并原子地写入 dest_path，返回写入的字节数
+
+    JPEG 先用 draft 模式按目标尺寸缩小解码，再按 EXIF 方向摆正后缩放；
+    原图本身小于目标尺寸时不放大。
+    """
+    with PILImage.open(source_path) as image:
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # WebP 可保留透明通道，JPEG 需要去掉
+            image = image.convert("RGBA" if fmt == "webp" and "A" in image.getbands() else "RGB")
+        image.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+        return save_atomic(image, dest_path, fmt)
+
+
+def to_srgb(image: PILImage.Image) -> PILImage.Image:
+    """按内嵌 ICC 配置文件转换到 sRGB，并去掉透明通道（铺白底），返回 RGB 或 L 图像"""
+    icc_profile = image.info.get("icc_profile")
+    if icc_profile and image.mode in ("RGB", "RGBA", "CMYK", "L"):
+        try:
+            source_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+            output_mode = "RGBA" if image.mode == "RGBA" else "RGB"
+            image = ImageCms.profileToProfile(image, source_profile, SRGB_PROFILE, outputMode=output_mode)
+        except (ImageCms.PyCMSError, OSError) as e:
+            print(f"⚠️ ICC 配置文件无法使用，按 sRGB 处理: {e}")
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = PILImage.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image
+
+
+def make_working_copy(source_path: str, max_edge: int) -> Optional[WorkingCopy]:
+    """生成原图的工作副本，写在原图旁边的临时文件中；无法解码时返回 None
+
+    原图已是长边不超过 max_edge、无需旋转、无 ICC 配置的 RGB/灰度 JPEG 时不重新编码。
+    """
+    try:
+        with PILImage.open(source_path) as image:
+            orientation = int(image.getexif().get(EXIF_ORIENTATION_TAG, 1))
+            if (
+                image.format == "JPEG"
+                and max(image.size) <= max_edge
+                and orientation == 1
+                and not image.info.get("icc_profile")
+                and image.mode in ("RGB", "L")
+            ):
+                return WorkingCopy(temp_path=None, width=image.width, height=image.height)
+
+            # JPEG 按目标尺寸缩小解码，后续的方向、色彩转换都在小图上进行；
+            # 保持原色彩空间，内嵌的 ICC 配置文件才能正确对应
+            image.draft(image.mode, (max_edge, max_edge))
+            image = ImageOps.exif_transpose(image)
+            image = to_srgb(image)
+            image.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+
+            temp_path = f"{source_path}.{uuid.uuid4().hex}.work"
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=WORKING_COPY_QUALITY, optimize=True)
+            data = buffer.getvalue()
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            return WorkingCopy(
+                temp_path=temp_path,
+                content_hash=hashlib.sha256(data).hexdigest(),
+                file_size=len(data),
+                width=image.width,
+                height=image.height,
+            )
+    except Exception as e:
+        print(f"⚠️ 无法生成工作副本 {source_path}: {e}")
+        return None
+
+
+def prepare_upload(file_path: str, max_edge: int) -> tuple[ImageProbe, Optional[WorkingCopy]]:
+    """上传入库前的图像处理：探测信息并生成工作副本，在同一个进程池任务中完成"""
+    probe = probe_image(file_path)
+    if probe.width == 0:
+        return probe, None
+    return probe, make_working_copy(file_path, max_edge)
+
+
+def _crop_pixels(box: tuple[float, float, float, float], width: int, height: int) -> tuple[int, int, int, int]:
+    """相对裁剪框换算为像素坐标，保证至少 1 像素"""
+    left, top, right, bottom = box
+    x0, y0 = round(left * width), round(top * height)
+    return x0, y0, max(round(right * width), x0 + 1), max(round(bottom * height), y0 + 1)
+
+
+def _lossless_mcu_size(image: PILImage.Image) -> Optional[tuple[int, int]]:
+    """可以无损裁剪的 JPEG 返回 MCU 宽高：无需旋转、无 ICC 配置（已是 sRGB）的 RGB/灰度 JPEG，例如工作副本"""
+    if (
+        image.format != "JPEG"
+        or image.mode not in ("RGB", "L")
+        or image.info.get("icc_profile")
+        or int(image.getexif().get(EXIF_ORIENTATION_TAG, 1)) != 1
+    ):
+        return None
+    return JPEG_MCU_SIZES.get(JpegImagePlugin.get_sampling(image) if image.mode == "RGB" else 0, (16, 16))
+
+
+def snap_boxes_to_jpeg_grid(
+    source_path: str, boxes: list[tuple[float, float, float, float]]
+) -> list[tuple[float, float, float, float]]:
+    """把裁剪框的左上角向外对齐到源图的 MCU 网格，右下角不变，使这些裁剪可以用 jpegtran 无损裁剪
+
+    在生成记录之前调用，记录的裁剪框即最终输出的范围，无论是否安装 jpegtran 渲染结果都相同；
+    源图不适合无损裁剪时原样返回。
+    """
+    with PILImage.open(source_path) as image:
+        mcu_size = _lossless_mcu_size(image)
+        width, height = image.size
+    if mcu_size is None:
+        return list(boxes)
+    mcu_width, mcu_height = mcu_size
+    snapped = []
+    for box in boxes:
+        x0, y0, _, _ = _crop_pixels(box, width, height)
+        snapped.append(((x0 - x0 % mcu_width) / width, (y0 - y0 % mcu_height) / height, box[2], box[3]))
+    return snapped
+
+
+def lossless_jpeg_crop(
+    source_path: str,
+    box: tuple[float, float, float, float],
+    dest_path: str,
+    progressive: bool = True,
+    optimize: bool = True,
+) -> Optional[int]:
+    """用 jpegtran 直接裁剪 JPEG 的 DCT 系数，不解码也不重新编码，返回写入的字节数
+
+    只在裁剪框左上角正好落在 MCU 边界上时使用（见 snap_boxes_to_jpeg_grid），输出与重新编码的裁剪范围完全一致；
+    源图不适用、裁剪框未对齐或 jpegtran 不可用时返回 None。
+    """
+    if JPEGTRAN_PATH is None:
+        return None
+    with PILImage.open(source_path) as image:
+        mcu_size = _lossless_mcu_size(image)
+        if mcu_size is None:
+            return None
+        x0, y0, x1, y1 = _crop_pixels(box, *image.size)
+    if x0 % mcu_size[0] or y0 % mcu_size[1]:
+        return None
+
+    command = [JPEGTRAN_PATH, "-copy", "none", "-crop", f"{x1 - x0}x{y1 - y0}+{x0}+{y0}"]
+    if optimize:
+        command.append("-optimize")
+    if progressive:
+        command.append("-progressive")
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    temp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        subprocess.run(command + ["-outfile", temp_path, source_path], check=True, capture_output=True, timeout=30)
+        os.replace(temp_path, dest_path)
+    except (OSError, subprocess.SubprocessError) as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        print(f"⚠️ jpegtran 无损裁剪失败，改为重新编码: {e}")
+        return None
+    return os.path.getsize(dest_path)
+
+
+def render_crop(
+    source_path: str,
+    box: tuple[float, float, float, float],
+    dest_path: str,
+    fmt: str,
+    max_edge: Optional[int] = None,
+    encoder_options: Optional[dict] = None,
+) -> EncodeResult:
+    """按相对坐标 box=(左, 上, 右, 下)（0-1，相对摆正后的源图）裁剪并原子地写入 dest_path
+
+    原尺寸 JPEG 输出优先用 jpegtran 无损裁剪；指定 max_edge 时结果长边不超过该值，
+    JPEG 源图会按需要的分辨率缩小解码。encoder_options 覆盖默认编码参数。
+    """
+    encoder_options = encoder_options or {}
+    started = time.perf_counter()
+    if fmt == "jpg" and not max_edge:
+        written = lossless_jpeg_crop(
+            source_path, box, dest_path,
+            progressive=encoder_options.get("progressive", True),
+            optimize=encoder_options.get("optimize", True),
+        )
+        if written is not None:
+            return EncodeResult(written, time.perf_counter() - started, lossless=True)
+
+    left, top, right, bottom = box
+    with PILImage.open(source_path) as image:
+        if max_edge:
+            image.draft(image.mode, (
+                math.ceil(max_edge / max(right - left, 1e-3)),
+                math.ceil(max_edge / max(bottom - top, 1e-3)),
+            ))
+        image = ImageOps.exif_transpose(image)
+        image = image.crop(_crop_pixels(box, *image.size))
+        image = to_srgb(image)
+        if max_edge:
+            image.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+        written = save_atomic(image, dest_path, fmt, **encoder_options)
+    return EncodeResult(written, time.perf_counter() - started)
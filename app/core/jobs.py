@@ -0,0 +1,203 @@
+"""
+任务状态登记
+按不透明的任务ID记录上传、生成等后台任务的阶段与进度：
+内存中保留最近的任务（热集合），创建与结束时异步写入 jobs 表，
+其他进程或热集合淘汰后按主键回查，查询不涉及业务表
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+
+JOB_PENDING = "pending"
+JOB_PROCESSING = "processing"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class JobState:
+    """任务状态"""
+    job_id: str
+    kind: str
+    user_id: Optional[int] = None
+    status: str = JOB_PENDING
+    stage: Optional[str] = None
+    progress: int = 0  # 0-100
+    message: Optional[str] = None
+    result: dict = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    version: int = 0  # 每次变化递增，写库时旧版本不会覆盖新版本
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+
+class JobRegistry:
+    """某一类任务的状态登记，stages 按顺序给出各阶段对应的进度，最后一个阶段即完成"""
+
+    def __init__(self, kind: str, stages: dict[str, int], hot_size: Optional[int] = None):
+        self.kind = kind
+        self.stages = stages
+        self.final_stage = list(stages)[-1]
+        self.hot_size = hot_size or settings.JOB_HOT_SET_SIZE
+        self._jobs: "OrderedDict[str, JobState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[JobState], None]] = []
+
+    def add_listener(self, callback: Callable[[JobState], None]) -> None:
+        """任务状态每次变化后以快照调用 callback（在发生变化的线程中）"""
+        self._listeners.append(callback)
+
+    def _notify(self, snapshot: JobState) -> None:
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"⚠️ 任务状态通知失败 {snapshot.job_id}: {e}")
+
+    def _remember(self, state: JobState) -> None:
+        self._jobs[state.job_id] = state
+        self._jobs.move_to_end(state.job_id)
+        while len(self._jobs) > self.hot_size:
+            self._jobs.popitem(last=False)
+
+    def create(self, user_id: Optional[int] = None, job_id: Optional[str] = None, **result: Any) -> JobState:
+        """登记一个新任务"""
+        state = JobState(job_id=job_id or uuid.uuid4().hex, kind=self.kind, user_id=user_id, result=dict(result))
+        with self._lock:
+            self._remember(state)
+            snapshot = replace(state, result=dict(state.result))
+        self._persist_async(snapshot)
+        self._notify(snapshot)
+        return snapshot
+
+    def _update(self, job_id: str, persist: bool, **changes: Any) -> Optional[JobState]:
+        result = changes.pop("result", None)
+        loaded = None
+        with self._lock:
+            known = job_id in self._jobs
+        if not known:
+            # 任务在其他进程创建或已被淘汰：从已保存的记录继续，保留所属用户、结果和版本号，
+            # 之后写库的版本总是高于库中的版本
+            try:
+                loaded = self._load(job_id)
+            except Exception as e:
+                print(f"⚠️ 读取任务状态失败 {job_id}: {e}")
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                state = loaded or JobState(job_id=job_id, kind=self.kind)
+            for key, value in changes.items():
+                setattr(state, key, value)
+            if result:
+                state.result.update(result)
+            state.updated_at = time.time()
+            state.version += 1
+            self._remember(state)
+            snapshot = replace(state, result=dict(state.result))
+        if persist:
+            self._persist_async(snapshot)
+        self._notify(snapshot)
+        return snapshot
+
+    def advance(self, job_id: str, stage: str, **result: Any) -> Optional[JobState]:
+        """进入某个阶段，最后一个阶段即标记为完成"""
+        finished = stage == self.final_stage
+        return self._update(
+            job_id,
+            persist=finished,
+            stage=stage,
+            progress=self.stages[stage],
+            status=JOB_COMPLETED if finished else JOB_PROCESSING,
+            result=result,
+        )
+
+    def report(self, job_id: str, progress: int, **result: Any) -> Optional[JobState]:
+        """阶段内的进度更新，只更新内存中的状态"""
+        return self._update(job_id, persist=False, progress=progress, status=JOB_PROCESSING, result=result)
+
+    def fail(self, job_id: str, message: str) -> Optional[JobState]:
+        """标记任务失败"""
+        return self._update(job_id, persist=True, status=JOB_FAILED, message=message)
+
+    def get(self, job_id: str) -> Optional[JobState]:
+        """查询任务状态：先查内存热集合，没有再按主键查数据库"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is not None:
+                return replace(state, result=dict(state.result))
+        return self._load(job_id)
+
+    def _load(self, job_id: str) -> Optional[JobState]:
+        session = SessionLocal()
+        try:
+            row = session.execute(text("""
+                SELECT job_id, kind, user_id, status, stage, progress, message, result, version
+                FROM jobs WHERE job_id = :job_id AND kind = :kind
+            """), {"job_id": job_id, "kind": self.kind}).fetchone()
+        finally:
+            session.close()
+        if row is None:
+            return None
+        return JobState(
+            job_id=row[0],
+            kind=row[1],
+            user_id=row[2],
+            status=row[3],
+            stage=row[4],
+            progress=row[5],
+            message=row[6],
+            result=json.loads(row[7]) if row[7] else {},
+            version=row[8],
+        )
+
+    def _persist(self, state: JobState) -> None:
+        """写入或更新任务记录，只有版本更新时才覆盖"""
+        session = SessionLocal()
+        try:
+            session.execute(text("""
+                INSERT INTO jobs (job_id, kind, user_id, status, stage, progress, message, result, version)
+                VALUES (:job_id, :kind, :user_id, :status, :stage, :progress, :message, :result, :version)
+                ON DUPLICATE KEY UPDATE
+                    user_id = COALESCE(user_id, VALUES(user_id)),
+                    status = IF(VALUES(version) > version, VALUES(status), status),
+                    stage = IF(VALUES(version) > version, VALUES(stage), stage),
+                    progress = IF(VALUES(version) > version, VALUES(progress), progress),
+                    message = IF(VALUES(version) > version, VALUES(message), message),
+                    result = IF(VALUES(version) > version, VALUES(result), result),
+                    version = GREATEST(VALUES(version), version)
+            """), {
+                "job_id": state.job_id,
+                "kind": state.kind,
+                "user_id": state.user_id,
+                "status": state.status,
+                "stage": state.stage,
+                "progress": state.progress,
+                "message": state.message,
+                "result": json.dumps(state.result, ensure_ascii=False, default=str),
+                "version": state.version,
+            })
+            session.commit()
+        except Exception as e:
+            print(f"⚠️ 保存任务状态失败 {state.job_id}: {e}")
+        finally:
+            session.close()
+
+    def _persist_async(self, state: JobState) -> None:
+        """在IO线程池中写库，不阻塞调用方"""
+        from app.core.executors import io_executor
+        try:
+            io_executor.submit(self._persist, state)
+        except Exception as e:
+            print(f"⚠️ 任务状态未能写入数据库 {state.job_id}: {e}")
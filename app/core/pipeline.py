@@ -0,0 +1,67 @@
+"""
+流式流水线
+把逐项处理拆成若干阶段，每个阶段一个线程，相邻阶段之间用有界队列连接：
+某一项在前一阶段完成后立即进入下一阶段，不必等整批结束；
+下游变慢时队列填满，上游随之阻塞，内存中同时在途的项数有上限
+"""
+import queue
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+_END = object()  # 流结束标记
+
+
+class StreamingPipeline:
+    """按顺序连接的多个阶段，stage 返回 None 表示丢弃该项，最后一个阶段的返回值被忽略"""
+
+    def __init__(self, name: str, stages: list[Callable[[Any], Any]], queue_size: int):
+        self.name = name
+        self.stages = stages
+        self.queue_size = queue_size
+        self._error: Optional[BaseException] = None
+        self._failed = threading.Event()
+
+    def _run_stage(self, stage: Callable, inbox: queue.Queue, outbox: Optional[queue.Queue]) -> None:
+        while True:
+            item = inbox.get()
+            if item is _END:
+                break
+            if self._failed.is_set():
+                continue  # 已失败，只消费剩余项让上游退出
+            try:
+                result = stage(item)
+            except BaseException as e:
+                if self._error is None:
+                    self._error = e
+                self._failed.set()
+                continue
+            if outbox is not None and result is not None:
+                outbox.put(result)
+        if outbox is not None:
+            outbox.put(_END)
+
+    def run(self, source: Iterable) -> None:
+        """把 source 中的项逐个送入流水线，等待全部阶段处理完；任一阶段抛出异常时其余项被丢弃并重新抛出"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(stage, queues[index], queues[index + 1] if index + 1 < len(queues) else None),
+                name=f"{self.name}-stage-{index}",
+                daemon=True,
+            )
+            for index, stage in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in source:
+                if self._failed.is_set():
+                    break
+                queues[0].put(item)
+        finally:
+            queues[0].put(_END)
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,224 @@
+"""
+生成与评分的公平调度
+所有生成、评分任务先进入调度器：每个用户单独排队，按加权公平排队（WFQ）的虚拟完成时间
+挑选下一个任务，每个用户同时执行的任务数有上限，单个用户大量提交只会排在自己的队列里；
+总排队数或单个用户排队数达到上限时直接拒绝（429 + Retry-After），
+并统计任务从提交到开始执行的等待时间，用于按真实负载评估容量
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.executors import BoundedExecutor, generation_executor
+
+WAIT_SAMPLE_SIZE = 1000  # 计算等待时间分位数使用的最近样本数
+
+
+@dataclass
+class _Task:
+    user_id: int
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    future: Future
+    finish_tag: float  # WFQ 虚拟完成时间，越小越先执行
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _UserQueue:
+    tasks: "deque[_Task]" = field(default_factory=deque)
+    running: int = 0
+    last_tag: float = 0.0
+
+
+class FairScheduler:
+    """按用户加权公平排队的调度器，把选中的任务交给底层执行器执行"""
+
+    def __init__(
+        self,
+        executor: BoundedExecutor,
+        user_concurrency: int,
+        max_queued: int,
+        user_queue_limit: int,
+    ):
+        self.executor = executor
+        self.max_running = executor.max_workers
+        self.user_concurrency = user_concurrency
+        self.max_queued = max_queued
+        self.user_queue_limit = user_queue_limit
+        self._users: dict[int, _UserQueue] = {}
+        # 已移除队列、但最后的虚拟完成时间仍超前于当前虚拟时间的用户，虚拟时间追上后删除
+        self._idle_tags: dict[int, float] = {}
+        self._weights: dict[int, float] = {}
+        self._virtual_time = 0.0
+        self._queued = 0
+        self._running = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # 统计
+        self._waits: "deque[float]" = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._service_times: "deque[float]" = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._dispatched = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def set_weight(self, user_id: int, weight: float) -> None:
+        """设置用户权重（默认 1），权重为 2 的用户获得两倍的执行份额"""
+        with self._cond:
+            self._weights[user_id] = max(weight, 1e-3)
+
+    def _retry_after(self) -> int:
+        """按最近的平均执行时间估计排队清空所需秒数"""
+        if not self._service_times:
+            return 1
+        average = sum(self._service_times) / len(self._service_times)
+        return max(1, math.ceil(average * (self._queued + 1) / self.max_running))
+
+    def _reject(self, detail: str) -> HTTPException:
+        self._rejected += 1
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(self._retry_after())},
+        )
+
+    def submit(self, user_id: int, fn: Callable, *args: Any, cost: float = 1.0, **kwargs: Any) -> Future:
+        """提交任务，排队已满时抛出 429"""
+        with self._cond:
+            if self._closed:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="服务正在关闭")
+            queue = self._users.get(user_id)
+            if self._queued >= self.max_queued:
+                raise self._reject("系统繁忙，请稍后重试")
+            if queue is not None and len(queue.tasks) >= self.user_queue_limit:
+                raise self._reject("您提交的任务过多，请等待已有任务完成")
+            if queue is None:
+                # 只为被接受的任务建立用户队列，被拒绝的用户不在调度表中留下空队列
+                queue = self._users[user_id] = _UserQueue(last_tag=self._idle_tags.pop(user_id, 0.0))
+
+            # 用户空闲后重新开始排队时从当前虚拟时间起算，不能攒下份额
+            start = max(self._virtual_time, queue.last_tag)
+            queue.last_tag = start + cost / self._weights.get(user_id, 1.0)
+            task = _Task(user_id, fn, args, kwargs, Future(), queue.last_tag)
+            queue.tasks.append(task)
+            self._queued += 1
+            self._dispatch()
+        return task.future
+
+    async def run(self, user_id: int, fn: Callable, *args: Any, cost: float = 1.0, **kwargs: Any) -> Any:
+        """提交任务并在事件循环中等待结果"""
+        return await asyncio.wrap_future(self.submit(user_id, fn, *args, cost=cost, **kwargs))
+
+    def _dispatch(self) -> None:
+        """在持有锁时调用：只要还有空闲执行槽，就取虚拟完成时间最小且未达并发上限的用户的队首任务"""
+        while self._running < self.max_running:
+            candidates = [
+                queue for queue in self._users.values()
+                if queue.tasks and queue.running < self.user_concurrency
+            ]
+            if not candidates:
+                return
+            queue = min(candidates, key=lambda q: q.tasks[0].finish_tag)
+            task = queue.tasks.popleft()
+            self._queued -= 1
+            if not task.future.set_running_or_notify_cancel():
+                self._reap(task.user_id, queue)
+                continue
+            self._advance_virtual_time(task.finish_tag)
+            queue.running += 1
+            self._running += 1
+
+            wait = time.monotonic() - task.enqueued_at
+            self._waits.append(wait)
+            self._dispatched += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            try:
+                self.executor.submit(self._execute, task)
+            except BaseException as e:
+                self._finish(task, 0.0)
+                task.future.set_exception(e)
+
+    def _advance_virtual_time(self, tag: float) -> None:
+        """在持有锁时调用：虚拟时间只前进，前进后删除已被追上的空闲用户记录"""
+        if tag <= self._virtual_time:
+            return
+        self._virtual_time = tag
+        if self._idle_tags:
+            self._idle_tags = {user_id: last_tag for user_id, last_tag in self._idle_tags.items() if last_tag > tag}
+
+    def _execute(self, task: _Task) -> None:
+        started = time.monotonic()
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+        except BaseException as e:
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            with self._cond:
+                self._finish(task, time.monotonic() - started)
+                self._dispatch()
+
+    def _finish(self, task: _Task, service_time: float) -> None:
+        queue = self._users[task.user_id]
+        queue.running -= 1
+        self._running -= 1
+        if service_time:
+            self._service_times.append(service_time)
+        self._reap(task.user_id, queue)
+        self._cond.notify_all()
+
+    def _reap(self, user_id: int, queue: _UserQueue) -> None:
+        """在持有锁时调用：移除空闲用户的队列，虚拟完成时间仍超前的另行记录，重新提交时接着计算，不能借此插队"""
+        if queue.tasks or queue.running:
+            return
+        del self._users[user_id]
+        if queue.last_tag > self._virtual_time:
+            self._idle_tags[user_id] = queue.last_tag
+
+    def stats(self) -> dict:
+        """排队、执行中的任务数和等待时间统计（秒）"""
+        with self._cond:
+            waits = sorted(self._waits)
+            percentile = lambda p: round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+            return {
+                "queued": self._queued,
+                "running": self._running,
+                "max_queued": self.max_queued,
+                "max_running": self.max_running,
+                "active_users": len(self._users),
+                "dispatched": self._dispatched,
+                "rejected": self._rejected,
+                "wait_avg": round(self._total_wait / self._dispatched, 4) if self._dispatched else 0.0,
+                "wait_p50": percentile(0.5),
+                "wait_p95": percentile(0.95),
+                "wait_max": round(self._max_wait, 4),
+            }
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None) -> bool:
+        """不再接受新任务；wait 为 True 时最多等待 timeout 秒，直到已排队和执行中的任务完成，返回是否已全部完成"""
+        with self._cond:
+            self._closed = True
+            if not wait:
+                return self._queued == 0 and self._running == 0
+            return self._cond.wait_for(lambda: self._queued == 0 and self._running == 0, timeout)
+
+
+# 生成与评分任务共用的调度器，在生成线程池中执行
+pipeline_scheduler = FairScheduler(
+    generation_executor,
+    user_concurrency=settings.SCHEDULER_USER_CONCURRENCY,
+    max_queued=settings.SCHEDULER_MAX_QUEUED,
+    user_queue_limit=settings.SCHEDULER_USER_QUEUE_LIMIT,
+)
@@ -17,6 +17,7 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds
 
 # JWT认证方案
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
@@ -70,11 +71,8 @@ def verify_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """获取当前用户"""
+def _user_from_token(token: str, db: Session) -> User:
+    """由访问令牌得到用户，令牌无效时抛出 401"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无效的认证凭据",
@@ -82,7 +80,6 @@ def get_current_user(
     )
     
     try:
-        token = credentials.credentials
         payload = verify_token(token)
         if payload is None:
             raise credentials_exception
@@ -114,6 +111,28 @@ def get_current_user(
         created_at=user.created_at
     )
 
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> User:
+    """获取当前用户"""
+    return _user_from_token(credentials.credentials, db)
+
+def get_stream_user(
+    access_token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+) -> User:
+    """事件流的当前用户：浏览器 EventSource 不能设置请求头，也接受 access_token 查询参数"""
+    token = credentials.credentials if credentials else access_token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="未提供认证凭据",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return _user_from_token(token, db)
+
 def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """获取当前活跃用户"""
     return current_user
@@ -0,0 +1,58 @@
+"""
+用户序号分配
+每个用户每类序号在 user_sequences 表中有一行计数器，通过行级原子递增分配，
+一次可以取得一段连续序号，不再对用户全部历史记录执行 COUNT(*)
+"""
+from sqlalchemy import text
+
+from app.core.database import SessionLocal
+
+# 首次为用户分配某类序号时用已有记录数初始化计数器，与旧的 COUNT(*) 编号保持连续
+SEQUENCE_SEED_QUERIES = {
+    "images": """
+        SELECT COUNT(*) FROM images WHERE user_id = :user_id
+    """,
+    "generated_images": """
+        SELECT COUNT(*) FROM generated_images gi
+        JOIN images i ON gi.original_image_id = i.id
+        WHERE i.user_id = :user_id
+    """,
+}
+
+
+def allocate_sequence_block(user_id: int, seq_name: str, count: int = 1) -> range:
+    """原子地为用户分配 count 个连续序号，返回序号区间
+
+    在独立的短事务中执行，计数器行锁只持有一条 UPDATE 的时间。
+    """
+    if seq_name not in SEQUENCE_SEED_QUERIES:
+        raise ValueError(f"未知的序号类型: {seq_name}")
+    if count < 1:
+        raise ValueError("分配数量必须大于0")
+
+    params = {"user_id": user_id, "seq_name": seq_name, "count": count}
+    increment = text("""
+        UPDATE user_sequences SET last_value = LAST_INSERT_ID(last_value + :count)
+        WHERE user_id = :user_id AND seq_name = :seq_name
+    """)
+
+    session = SessionLocal()
+    try:
+        result = session.execute(increment, params)
+        if result.rowcount == 0:
+            # 计数器尚不存在，并发初始化时只有一条 INSERT 生效
+            session.execute(text(f"""
+                INSERT IGNORE INTO user_sequences (user_id, seq_name, last_value)
+                SELECT :user_id, :seq_name, ({SEQUENCE_SEED_QUERIES[seq_name]})
+            """), params)
+            session.execute(increment, params)
+
+        # LAST_INSERT_ID(expr) 的值按连接保存，不受其他连接影响
+        last_value = session.execute(text("SELECT LAST_INSERT_ID()")).scalar()
+        session.commit()
+        return range(last_value - count + 1, last_value + 1)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,245 @@
+"""
+内容寻址存储
+文件按内容 SHA-256 存放在 static/blobs/<前两位>/<哈希><扩展名>，
+相同内容只保存一份，blobs 表记录引用计数，images / generated_images 的 file_path 指向这里
+"""
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 计算文件哈希时每次读取的字节数
+
+# 按探测到的图片格式确定扩展名，同一内容总是得到同一路径
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+}
+
+
+def blob_extension(image_format: Optional[str], filename: Optional[str] = None) -> str:
+    """根据图片格式（优先）或原始文件名得到规范化的扩展名"""
+    if image_format and image_format.upper() in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[image_format.upper()]
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ".jpg" if ext in ("", ".jpeg") else ext
+
+
+def hash_file(file_path: str) -> tuple[str, int]:
+    """计算文件的 SHA-256 和大小"""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            hasher.update(chunk)
+    return hasher.hexdigest(), size
+
+
+class BlobStore:
+    """内容寻址的文件存储，引用计数保存在数据库 blobs 表中"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, content_hash: str, ext: str) -> str:
+        """内容哈希对应的存储路径"""
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}{ext}")
+
+    def materialize(self, temp_path: str, content_hash: str, ext: str) -> str:
+        """把已计算哈希的临时文件放入存储；内容已存在时直接丢弃临时文件
+
+        应在引用计数提交之后调用，这样并发的垃圾回收不会删掉刚被引用的文件。
+        """
+        path = self.blob_path(content_hash, ext)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        return path
+
+    def import_file(self, file_path: str, ext: Optional[str] = None) -> tuple[str, str, int]:
+        """把存储之外的已有文件纳入存储（优先硬链接，不移动原文件），返回 (哈希, 路径, 大小)"""
+        content_hash, size = hash_file(file_path)
+        ext = ext or blob_extension(None, file_path)
+        path = self.blob_path(content_hash, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.link(file_path, temp_path)
+            except OSError:
+                shutil.copy2(file_path, temp_path)
+            os.replace(temp_path, path)
+        return content_hash, path, size
+
+    @staticmethod
+    def acquire(db: Session, content_hash: str, file_path: str, file_size: int, count: int = 1) -> None:
+        """增加引用计数（与引用它的记录在同一事务中执行）"""
+        db.execute(text("""
+            INSERT INTO blobs (content_hash, file_path, file_size, ref_count)
+            VALUES (:content_hash, :file_path, :file_size, :count)
+            ON DUPLICATE KEY UPDATE ref_count = ref_count + VALUES(ref_count)
+        """), {
+            "content_hash": content_hash,
+            "file_path": file_path,
+            "file_size": file_size,
+            "count": count,
+        })
+
+    @staticmethod
+    def release(db: Session, content_hash: str, count: int = 1) -> None:
+        """减少引用计数，文件在 collect_garbage 中删除"""
+        db.execute(text("""
+            UPDATE blobs SET ref_count = GREATEST(ref_count - :count, 0)
+            WHERE content_hash = :content_hash
+        """), {"content_hash": content_hash, "count": count})
+
+    @staticmethod
+    def collect_garbage(db: Session) -> int:
+        """删除引用计数为0的文件，返回删除数量"""
+        orphans = db.execute(text("""
+            SELECT content_hash, file_path FROM blobs WHERE ref_count = 0
+        """)).fetchall()
+
+        removed = 0
+        for content_hash, file_path in orphans:
+            # 持有行锁删除文件：并发的 acquire 会等待本事务提交，
+            # 之后插入新记录，并在 materialize 时发现文件缺失而重新放入
+            locked = db.execute(text("""
+                SELECT ref_count FROM blobs WHERE content_hash = :content_hash FOR UPDATE
+            """), {"content_hash": content_hash}).fetchone()
+            if locked is None or locked[0] != 0:
+                db.rollback()
+                continue
+            try:
+                os.remove(file_path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ 无法删除存储文件 {file_path}: {e}")
+                db.rollback()
+                continue
+            db.execute(text("""
+                DELETE FROM blobs WHERE content_hash = :content_hash
+            """), {"content_hash": content_hash})
+            db.commit()
+        return removed
+
+
+class DiskLRUCache:
+    """磁盘上的派生文件缓存，总大小超过预算时按最近最少使用淘汰
+
+    索引只保存在内存中，首次使用时扫描目录重建（按修改时间近似访问顺序）；
+    多个进程共享同一目录时各自淘汰，读取前总会确认文件仍然存在。
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # 相对路径 -> 字节数
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def path_for(self, key: str) -> str:
+        """缓存键（形如 <哈希>_<参数>.<扩展名>）对应的文件路径"""
+        return os.path.join(self.root, key[:2], key)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        found = []
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.endswith(".tmp"):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(dirpath, name))
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+        self._loaded = True
+
+    def get(self, key: str) -> Optional[str]:
+        """命中时返回文件路径并标记为最近使用"""
+        path = self.path_for(key)
+        with self._lock:
+            self._load()
+            if not os.path.exists(path):
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total -= size
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                size = os.path.getsize(path)
+                self._entries[key] = size
+                self._total += size
+        return path
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """命中时打开缓存文件并标记为最近使用；打开后文件即使被淘汰删除，也能从句柄完整读出"""
+        with self._lock:
+            self._load()
+            try:
+                file = open(self.path_for(key), "rb")
+            except FileNotFoundError:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total -= size
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                size = os.fstat(file.fileno()).st_size
+                self._entries[key] = size
+                self._total += size
+        return file
+
+    def put(self, key: str, size: int) -> None:
+        """登记新写入的缓存文件，并淘汰最久未用的文件直到回到预算内"""
+        evicted = []
+        with self._lock:
+            self._load()
+            self._total -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total += size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path_for(old_key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"⚠️ 无法删除缓存文件 {old_key}: {e}")
+
+
+# 全局存储实例
+blob_store = BlobStore(os.path.join(settings.UPLOAD_DIR, "blobs"))
@@ -7,6 +7,15 @@ from app.modules.generate.api import router as generate_router
 from app.modules.score.api import router as score_router
 from app.modules.result.api import router as result_router
 from app.modules.user.api import router as user_router
+from app.modules.derivative.api import router as derivative_router
+from app.modules.upload.phash_index import demo_reference_index
+from app.modules.upload.services import UploadService
+from app.core.config import settings
+from app.core.executors import shutdown_executors
+from app.core.scheduler import pipeline_scheduler
+from app.modules.score.scorers import close_scorer, load_scorer
+from app.modules.score.cache import score_cache
+import asyncio
 import os
 
 # 创建FastAPI应用实例
@@ -37,12 +46,46 @@ if os.path.exists("output"):
 if os.path.exists("input"):
     app.mount("/input", StaticFiles(directory="input"), name="input")
 
+@app.on_event("startup")
+def build_reference_index():
+    """启动时预先计算示例参考图的感知哈希索引"""
+    demo_reference_index.refresh(force=True)
+
+@app.on_event("startup")
+def load_score_model():
+    """启动时加载并预热评分模型，所有请求共用同一个推理会话；删除其他评分版本的缓存"""
+    scorer = load_scorer()
+    score_cache.prune_versions(scorer.version)
+
+@app.on_event("startup")
+async def start_upload_sweeper():
+    """启动定期清理过期上传会话和回收存储文件的后台任务"""
+    app.state.upload_sweeper = asyncio.create_task(UploadService.sweep_upload_storage())
+
+@app.on_event("shutdown")
+def stop_upload_sweeper():
+    app.state.upload_sweeper.cancel()
+
+def drain_and_close() -> None:
+    drained = pipeline_scheduler.shutdown(timeout=settings.SCHEDULER_SHUTDOWN_TIMEOUT)
+    if not drained:
+        print(f"⚠️ {settings.SCHEDULER_SHUTDOWN_TIMEOUT} 秒内仍有未完成的生成/评分任务，取消排队中的任务")
+    close_scorer()
+    shutdown_executors(wait=drained)
+    score_cache.close()
+
+@app.on_event("shutdown")
+async def stop_executors():
+    """等待排队和进行中的生成/评分任务完成（有时限），再关闭图像进程池和IO线程池；在线程中等待，不阻塞事件循环"""
+    await asyncio.to_thread(drain_and_close)
+
 # 注册API路由
 app.include_router(user_router, prefix="/api/auth", tags=["auth"])
 app.include_router(upload_router, prefix="/api", tags=["upload"])
 app.include_router(generate_router, prefix="/api", tags=["generate"])
 app.include_router(score_router, prefix="/api", tags=["score"])
 app.include_router(result_router, prefix="/api", tags=["result"])
+app.include_router(derivative_router, prefix="/api", tags=["derivative"])
 
 @app.get("/")
 async def root():
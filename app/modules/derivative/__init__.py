@@ -0,0 +1,4 @@
+"""
+缩略图模块
+为原图、生成图和示例图按固定尺寸生成 WebP / JPEG 缩略图
+"""
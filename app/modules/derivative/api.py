@@ -0,0 +1,32 @@
+"""
+缩略图API路由
+"""
+from fastapi import APIRouter
+
+from app.modules.derivative.services import (
+    DERIVATIVE_MEDIA_TYPES,
+    get_derivative,
+    is_immutable_source,
+    open_file_response,
+)
+
+router = APIRouter(prefix="/derivatives", tags=["derivative"])
+
+
+@router.get("/{size}.{fmt}/{source:path}")
+async def get_derivative_image(size: int, fmt: str, source: str):
+    """
+    获取图片的缩略图
+    size 为长边像素（256 / 768 / 1600），fmt 为 webp 或 jpg，
+    source 为原图路径，如 static/blobs/ab/<哈希>.jpg、output/1/1/cropped_1.jpg
+    """
+    file = await get_derivative(source, size, fmt)
+    if is_immutable_source(source):
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = "public, max-age=3600"
+    return open_file_response(
+        file,
+        media_type=DERIVATIVE_MEDIA_TYPES[fmt],
+        headers={"Cache-Control": cache_control},
+    )
@@ -0,0 +1,161 @@
+"""
+缩略图服务
+URL 形如 /api/derivatives/{尺寸}.{格式}/{源文件路径}，首次请求时在进程池中生成，
+之后从磁盘 LRU 缓存直接返回；上传完成时预先生成最常用的卡片尺寸
+"""
+import asyncio
+import hashlib
+import os
+import re
+from concurrent.futures import Future
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.executors import image_executor, run_in_thread
+from app.core.imaging import render_derivative
+from app.core.storage import DiskLRUCache
+
+DERIVATIVE_SIZES = (256, 768, 1600)  # 长边像素
+DERIVATIVE_MEDIA_TYPES = {
+    "webp": "image/webp",
+    "jpg": "image/jpeg",
+}
+DEFAULT_THUMBNAIL_SIZE = 256
+DEFAULT_THUMBNAIL_FORMAT = "webp"
+
+# 允许作为源文件的目录，与 main.py 中挂载的静态目录一致
+SOURCE_ROOTS = ("static", "output", "input")
+BLOB_NAME_PATTERN = re.compile(r"[0-9a-f]{64}")
+CACHE_OPEN_ATTEMPTS = 3  # 生成后的文件在打开前被淘汰时重新生成的次数上限
+FILE_CHUNK_SIZE = 64 * 1024
+
+derivative_cache = DiskLRUCache(
+    os.path.join(settings.UPLOAD_DIR, "derivatives"), settings.DERIVATIVE_CACHE_MAX_BYTES
+)
+
+# 同一缩略图的并发请求共用一次生成
+_inflight: dict[str, "asyncio.Future[str]"] = {}
+
+
+def derivative_url(
+    file_path: Optional[str],
+    size: int = DEFAULT_THUMBNAIL_SIZE,
+    fmt: str = DEFAULT_THUMBNAIL_FORMAT,
+) -> Optional[str]:
+    """源文件路径（如 static/blobs/..、/output/..）对应的缩略图 URL"""
+    if not file_path:
+        return None
+    source = file_path.replace("\\", "/").lstrip("/")
+    return f"/api/derivatives/{size}.{fmt}/{source}"
+
+
+def resolve_source(source: str) -> str:
+    """把 URL 中的源路径解析为磁盘路径，只允许静态目录内的图片文件"""
+    real_path = os.path.realpath(source)
+    cache_root = os.path.realpath(derivative_cache.root)
+    for root in SOURCE_ROOTS:
+        real_root = os.path.realpath(root)
+        if os.path.commonpath([real_path, real_root]) != real_root:
+            continue
+        if os.path.commonpath([real_path, cache_root]) == cache_root:
+            break
+        if os.path.isfile(real_path):
+            return real_path
+        break
+    raise HTTPException(status_code=404, detail="图片不存在")
+
+
+def is_immutable_source(source_path: str) -> bool:
+    """内容寻址存储中的文件内容永不改变，缩略图可以长期缓存"""
+    return BLOB_NAME_PATTERN.fullmatch(os.path.splitext(os.path.basename(source_path))[0]) is not None
+
+
+def cache_key(source_path: str, size: int, fmt: str) -> str:
+    """缩略图缓存键：存储文件用内容哈希，其他文件用 路径+修改时间+大小 的哈希"""
+    if is_immutable_source(source_path):
+        ident = os.path.splitext(os.path.basename(source_path))[0]
+    else:
+        stat = os.stat(source_path)
+        ident = hashlib.sha1(f"{source_path}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+    return f"{ident}_{size}.{fmt}"
+
+
+def validate_variant(size: int, fmt: str) -> None:
+    if size not in DERIVATIVE_SIZES or fmt not in DERIVATIVE_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="不支持的缩略图规格")
+
+
+def _submit_render(source_path: str, key: str, size: int, fmt: str) -> Future:
+    """提交生成任务，完成后登记到缓存"""
+    def register(future: Future) -> None:
+        if future.exception() is None:
+            derivative_cache.put(key, future.result())
+
+    future = image_executor.submit(render_derivative, source_path, derivative_cache.path_for(key), size, fmt)
+    future.add_done_callback(register)
+    return future
+
+
+def locate_derivative(source: str, size: int, fmt: str) -> tuple[str, str]:
+    """解析源文件并计算缓存键，返回 (源文件路径, 缓存键)；需要读取文件信息，在线程中调用"""
+    source_path = resolve_source(source)
+    return source_path, cache_key(source_path, size, fmt)
+
+
+async def get_derivative(source: str, size: int, fmt: str) -> BinaryIO:
+    """返回已打开的缩略图文件，缓存未命中时生成；文件检查和打开在线程中执行，不阻塞事件循环"""
+    validate_variant(size, fmt)
+    source_path, key = await run_in_thread(locate_derivative, source, size, fmt)
+
+    for _ in range(CACHE_OPEN_ATTEMPTS):
+        file = await run_in_thread(derivative_cache.open, key)
+        if file is not None:
+            return file
+
+        # 未命中，或刚生成的文件在打开前已被其他写入淘汰，重新生成
+        pending = _inflight.get(key)
+        if pending is None:
+            pending = asyncio.wrap_future(_submit_render(source_path, key, size, fmt))
+            _inflight[key] = pending
+            pending.add_done_callback(lambda _: _inflight.pop(key, None))
+        try:
+            await asyncio.shield(pending)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"无法生成缩略图: {str(e)}")
+    raise HTTPException(status_code=503, detail="缩略图缓存繁忙，请稍后重试")
+
+
+def open_file_response(file: BinaryIO, media_type: str, headers: dict) -> StreamingResponse:
+    """用已打开的缓存文件构造响应，发送期间文件被淘汰删除不影响本次响应"""
+    def chunks():
+        with file:
+            while True:
+                chunk = file.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    headers = {**headers, "Content-Length": str(os.fstat(file.fileno()).st_size)}
+    return StreamingResponse(chunks(), media_type=media_type, headers=headers)
+
+
+def prewarm_derivative(
+    file_path: str,
+    size: int = DEFAULT_THUMBNAIL_SIZE,
+    fmt: str = DEFAULT_THUMBNAIL_FORMAT,
+) -> None:
+    """在后台预先生成缩略图，进程池繁忙时跳过，之后首次请求时再生成"""
+    try:
+        source_path = resolve_source(file_path)
+        key = cache_key(source_path, size, fmt)
+        if derivative_cache.get(key) is None:
+            _submit_render(source_path, key, size, fmt)
+    except HTTPException:
+        pass
+    except Exception as e:
+        print(f"⚠️ 预生成缩略图失败 {file_path}: {e}")
@@ -1,37 +1,159 @@
 """
 生成API
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from app.core.database import get_db
-from app.core.security import get_current_active_user
+from app.core.security import get_current_active_user, get_stream_user
+from app.core.events import image_topic, job_topic
 from app.core.models import User
+from app.core.executors import run_in_thread
 from app.modules.generate.services import (
-    create_generation, 
+    submit_generation_job,
+    create_generation_bulk,
+    get_generation_job,
+    generation_jobs,
+    check_image_owner,
+    stream_events,
+    get_generation_cache_stats,
+    get_scheduler_stats,
     get_generated_images
 )
-from app.modules.generate.schemas import GenerationRequest, GenerationResponse, GeneratedImageInfo
+from app.modules.generate.render import encode_stats, render_generated_image
+from app.modules.derivative.services import DERIVATIVE_MEDIA_TYPES, open_file_response
+from app.modules.generate.schemas import (
+    GenerationRequest,
+    BulkGenerationRequest,
+    BulkGenerationResponse,
+    GenerationJobResponse,
+    GenerationJobStatus,
+    GenerationCacheStats,
+    EncodeStatsResponse,
+    SchedulerStats,
+    GeneratedImageInfo,
+)
 
 router = APIRouter()
 
-@router.post("/generate", response_model=GenerationResponse)
-def create_generation_task(
+@router.post("/generate", response_model=GenerationJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_generation_task(
     request: GenerationRequest, 
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """创建生成任务"""
+    """
+    创建生成任务
+    立即返回任务ID，生成和评分在后台按用户公平排队执行，通过 /generate/jobs/{job_id} 查询进度；
+    排队已满时返回 429
+    """
+    return submit_generation_job(current_user.id, request)
+
+@router.post("/generate/bulk", response_model=BulkGenerationResponse)
+async def create_bulk_generation(
+    request: BulkGenerationRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    为多张原图批量生成
+    与其他生成、评分任务一起按用户公平排队，该用户排队已满时返回 429；
+    各原图的候选裁剪搜索在进程池中并行执行，返回总耗时、吞吐量和每张原图的结果
+    """
+    return await create_generation_bulk(current_user.id, request)
+
+@router.get("/generate/jobs/{job_id}", response_model=GenerationJobStatus)
+async def get_generation_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """查询生成任务状态"""
+    try:
+        return await run_in_thread(get_generation_job, job_id, current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/generate/cache/stats", response_model=GenerationCacheStats)
+async def get_generation_cache_status(current_user: User = Depends(get_current_active_user)):
+    """查询生成缓存的条目数与命中率"""
+    return get_generation_cache_stats()
+
+@router.get("/generate/scheduler/stats", response_model=SchedulerStats)
+async def get_scheduler_status(current_user: User = Depends(get_current_active_user)):
+    """查询生成/评分任务的排队数与排队等待时间"""
+    return get_scheduler_stats()
+
+@router.get("/generate/encode/stats", response_model=EncodeStatsResponse)
+async def get_encode_status(current_user: User = Depends(get_current_active_user)):
+    """查询生成图编码的累计字节数与耗时"""
+    return EncodeStatsResponse(**encode_stats.snapshot())
+
+def _event_stream_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _last_event_id(value: Optional[str]) -> Optional[int]:
+    return int(value) if value and value.isdigit() else None
+
+@router.get("/generate/events/images/{original_image_id}")
+async def stream_image_events(
+    original_image_id: int,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_stream_user)
+):
+    """
+    原图的进度事件流（SSE）
+    推送该原图下生成任务的阶段变化（job 事件）和每张新评分的候选图（candidate 事件），替代轮询；
+    EventSource 无法设置请求头，可用 access_token 查询参数认证
+    """
     try:
-        return create_generation(db, request)
+        await run_in_thread(check_image_owner, original_image_id, current_user.id)
     except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=404, detail=str(e))
+    return _event_stream_response(stream_events(
+        image_topic(original_image_id), request.is_disconnected, _last_event_id(last_event_id)
+    ))
+
+@router.get("/generate/events/jobs/{job_id}")
+async def stream_job_events(
+    job_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_stream_user)
+):
+    """生成任务的进度事件流（SSE），先推送当前状态，任务完成或失败后结束"""
+    job = await run_in_thread(generation_jobs.get, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="生成任务不存在")
+    return _event_stream_response(stream_events(
+        job_topic(job_id), request.is_disconnected, _last_event_id(last_event_id), job
+    ))
 
 @router.get("/generate/images/{original_image_id}", response_model=List[GeneratedImageInfo])
-def get_generated_images_list(
+async def get_generated_images_list(
     original_image_id: int, 
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """获取生成图片列表"""
-    return get_generated_images(db, original_image_id)
\ No newline at end of file
+    return await run_in_thread(get_generated_images, db, original_image_id)
+
+@router.get("/generate/render/{filename}")
+async def render_generated(filename: str, size: Optional[int] = None, fmt: str = "jpg"):
+    """
+    获取生成图片
+    按记录的裁剪参数从源图渲染，size 为长边像素（256 / 768 / 1600，不传为原始裁剪尺寸），
+    fmt 为 jpg 或 webp；裁剪参数不会改变，结果可长期缓存。
+    本次请求触发编码时通过 X-Encoded-Bytes 和 Server-Timing 返回写入字节数与编码耗时
+    """
+    file, encoded = await render_generated_image(filename, size, fmt)
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    if encoded is not None:
+        headers["X-Encoded-Bytes"] = str(encoded.bytes_written)
+        headers["Server-Timing"] = (
+            f'encode;dur={encoded.encode_seconds * 1000:.1f};desc="{"lossless" if encoded.lossless else "reencode"}"'
+        )
+    return open_file_response(file, media_type=DERIVATIVE_MEDIA_TYPES[fmt], headers=headers)
@@ -0,0 +1,76 @@
+"""
+生成结果缓存
+候选裁剪只取决于源图内容、规范化后的请求参数和算法版本，按三者的哈希缓存裁剪结果；
+同一张照片（或重新上传后得到同一工作副本的照片）以相同视角再次生成时直接复用，
+只写入新的生成记录，生成图的内容标识不变，因此渲染缓存中的文件也一并复用
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+from app.modules.generate.proposals import PROPOSAL_VERSION
+
+Crop = tuple[str, tuple[float, float, float, float], float]  # (裁剪类型, 相对裁剪框, 分数)
+
+
+def generation_cache_key(source_hash: str, view_angles: Optional[list[str]], count: int) -> str:
+    """由源图内容哈希、规范化的请求参数和算法版本得到缓存键，视角的顺序与重复不影响结果"""
+    payload = json.dumps({
+        "source": source_hash,
+        "view_angles": sorted(set(view_angles or [])),
+        "count": count,
+        "version": PROPOSAL_VERSION,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class GenerationCache:
+    """候选裁剪结果的内存 LRU 缓存，记录命中与未命中次数"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[Crop, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[list[Crop]]:
+        """命中时返回裁剪列表并标记为最近使用"""
+        with self._lock:
+            crops = self._entries.get(key)
+            if crops is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(crops)
+
+    def put(self, key: str, crops: list[Crop]) -> None:
+        """保存一次搜索结果，超出容量时淘汰最久未使用的条目"""
+        if not crops:
+            return
+        with self._lock:
+            self._entries[key] = tuple(crops)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+generation_cache = GenerationCache(settings.GENERATION_CACHE_SIZE)
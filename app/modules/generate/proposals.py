@@ -0,0 +1,243 @@
+"""
+候选裁剪搜索
+在缩小后的工作副本上计算边缘图和显著性图（谱残差），用积分图在 O(1) 时间内
+得到任意窗口内的显著性、三分点附近的显著性和边框处的边缘强度，一次向量化地为
+数千个不同比例、尺寸、位置的窗口打分，按所选视角调整偏好后做非极大值抑制，取前 N 个
+函数保持为模块级以便在进程池中执行
+"""
+from typing import Optional
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+PROPOSAL_VERSION = "saliency-1"  # 打分或枚举方式变化时修改，使生成缓存失效
+ANALYSIS_EDGE = 320  # 分析图长边像素
+SALIENCY_EDGE = 64  # 谱残差显著性在该尺寸上计算
+ASPECT_RATIOS = (1.0, 4 / 3, 3 / 4, 3 / 2, 2 / 3, 16 / 9, 9 / 16)  # 宽/高，另外总会加入原图比例
+WINDOW_SCALES = (0.5, 0.6, 0.7, 0.8, 0.9, 1.0)  # 相对该比例下最大窗口的边长
+POSITION_STEPS = 17  # 每个方向上的窗口位置数
+NMS_IOU_THRESHOLD = 0.5
+MIN_WINDOW_EDGE = 16
+CONTENT_SATURATION = 0.85  # 保留这一比例以上的显著内容即视为完整，不再偏向更大的窗口
+
+# 打分权重
+WEIGHT_CONTENT = 0.35  # 保留的显著内容比例
+WEIGHT_DENSITY = 0.25  # 显著内容密度（裁掉空白区域）
+WEIGHT_THIRDS = 0.25  # 显著内容落在三分点附近
+WEIGHT_BORDER = 0.20  # 边框切过强边缘（切断主体）的惩罚
+WEIGHT_VIEW = 1.5  # 与视角偏好位置的距离惩罚
+
+# 视角 -> 窗口中心的偏好位置（水平, 垂直），None 表示该方向不限
+VIEW_ANGLE_TARGETS = {
+    "俯视": (None, 0.62),
+    "仰视": (None, 0.38),
+    "平视": (None, 0.5),
+    "右前方": (0.62, None),
+    "左前方": (0.38, None),
+}
+
+
+def _integral(values: np.ndarray) -> np.ndarray:
+    """积分图，左上补一行一列 0，窗口和 = ii[y1,x1] - ii[y0,x1] - ii[y1,x0] + ii[y0,x0]"""
+    ii = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    ii[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+    return ii
+
+
+def _box_sum(ii: np.ndarray, x0, y0, x1, y1):
+    return ii[y1, x1] - ii[y0, x1] - ii[y1, x0] + ii[y0, x0]
+
+
+def _box_filter(values: np.ndarray, radius: int) -> np.ndarray:
+    """均值滤波（边缘复制填充），借助积分图与半径无关"""
+    size = 2 * radius + 1
+    padded = np.pad(values, radius, mode="edge")
+    ii = _integral(padded)
+    h, w = values.shape
+    return (ii[size:size + h, size:size + w] - ii[:h, size:size + w]
+            - ii[size:size + h, :w] + ii[:h, :w]) / (size * size)
+
+
+def spectral_residual_saliency(gray: np.ndarray) -> np.ndarray:
+    """谱残差显著性图，取值归一化到 0-1"""
+    spectrum = np.fft.fft2(gray)
+    log_amplitude = np.log(np.abs(spectrum) + 1e-8)
+    phase = np.angle(spectrum)
+    residual = log_amplitude - _box_filter(log_amplitude, 1)
+    saliency = np.abs(np.fft.ifft2(np.exp(residual + 1j * phase))) ** 2
+    saliency = _box_filter(saliency, 2)
+    saliency -= saliency.min()
+    peak = saliency.max()
+    return saliency / peak if peak > 0 else saliency
+
+
+def load_analysis_image(file_path: str) -> np.ndarray:
+    """读取并缩小为长边 ANALYSIS_EDGE 的灰度图（0-1 浮点数组）"""
+    with PILImage.open(file_path) as image:
+        image.draft("L", (ANALYSIS_EDGE, ANALYSIS_EDGE))
+        image = ImageOps.exif_transpose(image).convert("L")
+        image.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE), PILImage.BILINEAR)
+        return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def feature_maps(gray: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """返回与分析图同尺寸的 (边缘强度图, 显著性图)"""
+    h, w = gray.shape
+    edges = np.zeros_like(gray)
+    edges[:, 1:] += np.abs(np.diff(gray, axis=1))
+    edges[1:, :] += np.abs(np.diff(gray, axis=0))
+
+    small = PILImage.fromarray(gray, mode="F")
+    small.thumbnail((SALIENCY_EDGE, SALIENCY_EDGE), PILImage.BILINEAR)
+    saliency = spectral_residual_saliency(np.asarray(small, dtype=np.float64))
+    saliency = np.asarray(
+        PILImage.fromarray(saliency.astype(np.float32), mode="F").resize((w, h), PILImage.BILINEAR),
+        dtype=np.float64,
+    )
+    return edges, np.clip(saliency, 0.0, None)
+
+
+def candidate_windows(width: int, height: int) -> np.ndarray:
+    """枚举候选窗口，返回 (N, 4) 的 [x0, y0, w, h] 整数数组；图片过小或过于狭长时 N 为 0"""
+    ratios = set(ASPECT_RATIOS) | {width / height}
+    windows = []
+    for ratio in ratios:
+        if width / height > ratio:
+            max_w, max_h = height * ratio, height
+        else:
+            max_w, max_h = width, width / ratio
+        for scale in WINDOW_SCALES:
+            w = int(round(max_w * scale))
+            h = int(round(max_h * scale))
+            if w < MIN_WINDOW_EDGE or h < MIN_WINDOW_EDGE:
+                continue
+            if w >= width and h >= height:
+                continue  # 整张原图不算裁剪
+            xs = np.unique(np.linspace(0, width - w, POSITION_STEPS).round().astype(np.int64))
+            ys = np.unique(np.linspace(0, height - h, POSITION_STEPS).round().astype(np.int64))
+            grid_x, grid_y = np.meshgrid(xs, ys)
+            count = grid_x.size
+            windows.append(np.stack([
+                grid_x.ravel(), grid_y.ravel(), np.full(count, w), np.full(count, h)
+            ], axis=1))
+    if not windows:
+        return np.empty((0, 4), dtype=np.int64)
+    return np.concatenate(windows, axis=0)
+
+
+def score_windows(
+    windows: np.ndarray,
+    edges: np.ndarray,
+    saliency: np.ndarray,
+    view_angles: Optional[list[str]] = None,
+) -> np.ndarray:
+    """为所有窗口一次性打分，每个窗口只做常数次积分图查询"""
+    height, width = saliency.shape
+    x0, y0, w, h = (windows[:, i] for i in range(4))
+    x1, y1 = x0 + w, y0 + h
+    sal_ii = _integral(saliency)
+    edge_ii = _integral(edges)
+    sal_total = sal_ii[-1, -1] + 1e-8
+    edge_mean = edge_ii[-1, -1] / (width * height) + 1e-8
+
+    # 显著内容：保留比例和密度
+    sal_in = _box_sum(sal_ii, x0, y0, x1, y1)
+    area = (w * h).astype(np.float64)
+    content = np.clip(sal_in / sal_total / CONTENT_SATURATION, 0.0, 1.0)
+    density = (sal_in / area) / (sal_total / (width * height))
+    density = np.clip(density / 3.0, 0.0, 1.0)
+
+    # 三分点：四个交点附近小方框内的显著性占窗口内显著性的比例，相对其面积占比
+    radius = np.maximum(1, np.round(np.minimum(w, h) * 0.08)).astype(np.int64)
+    thirds_mass = np.zeros_like(sal_in)
+    for fx in (1 / 3, 2 / 3):
+        for fy in (1 / 3, 2 / 3):
+            cx = np.round(x0 + w * fx).astype(np.int64)
+            cy = np.round(y0 + h * fy).astype(np.int64)
+            thirds_mass += _box_sum(
+                sal_ii,
+                np.clip(cx - radius, 0, width), np.clip(cy - radius, 0, height),
+                np.clip(cx + radius, 0, width), np.clip(cy + radius, 0, height),
+            )
+    thirds_area = 4 * (2 * radius) ** 2 / area
+    thirds = np.clip((thirds_mass / (sal_in + 1e-8)) / thirds_area / 3.0, 0.0, 1.0)
+
+    # 边框：窗口减去内缩窗口得到边框环带的平均边缘强度，原图边界不算切断
+    band = np.maximum(1, np.round(np.minimum(w, h) * 0.03)).astype(np.int64)
+    inner = _box_sum(edge_ii, x0 + band, y0 + band, x1 - band, y1 - band)
+    ring_edges = _box_sum(edge_ii, x0, y0, x1, y1) - inner
+    ring_area = area - (w - 2 * band) * (h - 2 * band)
+    inner_sides = ((x0 > 0).astype(np.float64) + (y0 > 0) + (x1 < width) + (y1 < height)) / 4.0
+    border = np.clip((ring_edges / ring_area) / edge_mean / 3.0, 0.0, 1.0) * inner_sides
+
+    scores = (WEIGHT_CONTENT * content + WEIGHT_DENSITY * density
+              + WEIGHT_THIRDS * thirds - WEIGHT_BORDER * border)
+
+    # 视角偏好：多个视角时取与最近偏好位置的距离
+    targets = [VIEW_ANGLE_TARGETS[a] for a in (view_angles or []) if a in VIEW_ANGLE_TARGETS]
+    if targets:
+        cx = (x0 + w / 2) / width
+        cy = (y0 + h / 2) / height
+        distances = []
+        for tx, ty in targets:
+            d = np.zeros_like(scores)
+            if tx is not None:
+                d += (cx - tx) ** 2
+            if ty is not None:
+                d += (cy - ty) ** 2
+            distances.append(d)
+        scores -= WEIGHT_VIEW * np.min(distances, axis=0)
+    return scores
+
+
+def non_max_suppression(windows: np.ndarray, scores: np.ndarray, count: int) -> list[int]:
+    """按分数从高到低选取与已选窗口 IoU 不超过阈值的窗口，不足时逐步放宽阈值"""
+    order = np.argsort(-scores)
+    x0 = windows[:, 0].astype(np.float64)
+    y0 = windows[:, 1].astype(np.float64)
+    x1 = x0 + windows[:, 2]
+    y1 = y0 + windows[:, 3]
+    area = windows[:, 2].astype(np.float64) * windows[:, 3]
+
+    selected: list[int] = []
+    threshold = NMS_IOU_THRESHOLD
+    while len(selected) < count and threshold <= 1.0:
+        for idx in order:
+            if len(selected) >= count:
+                break
+            if idx in selected:
+                continue
+            if selected:
+                chosen = np.asarray(selected)
+                iw = np.clip(np.minimum(x1[idx], x1[chosen]) - np.maximum(x0[idx], x0[chosen]), 0, None)
+                ih = np.clip(np.minimum(y1[idx], y1[chosen]) - np.maximum(y0[idx], y0[chosen]), 0, None)
+                inter = iw * ih
+                iou = inter / (area[idx] + area[chosen] - inter)
+                if iou.max() > threshold:
+                    continue
+            selected.append(int(idx))
+        threshold += 0.15
+    return selected
+
+
+def propose_crops(
+    file_path: str,
+    view_angles: Optional[list[str]] = None,
+    count: int = 10,
+) -> list[tuple[str, tuple[float, float, float, float], float]]:
+    """返回得分最高且互不重叠的 count 个裁剪：(裁剪类型, 相对裁剪框, 分数)，没有可用窗口时返回空列表"""
+    gray = load_analysis_image(file_path)
+    height, width = gray.shape
+    windows = candidate_windows(width, height)
+    if len(windows) == 0:
+        return []
+    edges, saliency = feature_maps(gray)
+    scores = score_windows(windows, edges, saliency, view_angles)
+
+    crops = []
+    for idx in non_max_suppression(windows, scores, count):
+        x0, y0, w, h = (int(v) for v in windows[idx])
+        box = (x0 / width, y0 / height, (x0 + w) / width, (y0 + h) / height)
+        crops.append(("saliency", box, float(scores[idx])))
+    return crops
@@ -0,0 +1,195 @@
+"""
+生成图按需渲染
+generated_images 只保存裁剪参数（源图与相对裁剪框），像素在客户端第一次请求时才裁剪编码，
+渲染结果放入磁盘 LRU 缓存；生成后只预渲染得分最高的几张，从未被查看的候选图不占用编码时间和磁盘空间。
+编码在单独的编码进程池中执行，原尺寸 JPEG 在可能时用 jpegtran 无损裁剪，不重新编码
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import BinaryIO, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.executors import encode_executor, run_in_thread
+from app.core.imaging import EncodeResult, render_crop
+from app.core.storage import DiskLRUCache
+from app.modules.derivative.services import CACHE_OPEN_ATTEMPTS, DERIVATIVE_MEDIA_TYPES, DERIVATIVE_SIZES
+
+RENDER_URL_PREFIX = "/api/generate/render/"
+
+render_cache = DiskLRUCache(os.path.join(settings.UPLOAD_DIR, "renders"), settings.RENDER_CACHE_MAX_BYTES)
+
+# 同一渲染结果的并发请求共用一次渲染
+_inflight: dict[str, "asyncio.Future[EncodeResult]"] = {}
+
+# 生成图 JPEG 编码参数，WebP 使用缩略图的默认参数
+RENDER_ENCODER_OPTIONS = {
+    "jpg": {
+        "quality": settings.RENDER_JPEG_QUALITY,
+        "progressive": settings.RENDER_JPEG_PROGRESSIVE,
+        "optimize": settings.RENDER_JPEG_OPTIMIZE,
+    },
+}
+
+
+class EncodeStats:
+    """本进程生成图编码的累计统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.lossless_count = 0
+        self.bytes_written = 0
+        self.encode_seconds = 0.0
+
+    def record(self, result: EncodeResult) -> None:
+        with self._lock:
+            self.count += 1
+            self.lossless_count += int(result.lossless)
+            self.bytes_written += result.bytes_written
+            self.encode_seconds += result.encode_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "encoded_count": self.count,
+                "lossless_count": self.lossless_count,
+                "bytes_written": self.bytes_written,
+                "encode_seconds": round(self.encode_seconds, 3),
+                "average_encode_ms": round(self.encode_seconds * 1000 / self.count, 2) if self.count else 0.0,
+            }
+
+
+encode_stats = EncodeStats()
+
+
+def render_url(filename: str) -> str:
+    """生成图的访问地址，保存在 generated_images.file_path 中"""
+    return f"{RENDER_URL_PREFIX}{filename}"
+
+
+def is_render_url(file_path: Optional[str]) -> bool:
+    return bool(file_path) and file_path.startswith(RENDER_URL_PREFIX)
+
+
+def sized_render_url(file_path: str, size: int, fmt: str = "webp") -> str:
+    """生成图指定尺寸和格式的地址"""
+    return f"{file_path}?size={size}&fmt={fmt}"
+
+
+def normalize_render_params(source_path: str, box: tuple[float, float, float, float], **extra) -> dict:
+    """规范化渲染参数：裁剪框保留4位小数，保证同一裁剪总是得到同一内容标识"""
+    return {
+        "source": source_path,
+        "box": [round(float(value), 4) for value in box],
+        **extra,
+    }
+
+
+def render_content_hash(source_hash: str, params: dict) -> str:
+    """生成图的内容标识：由源图内容哈希和裁剪框决定，与源图存放位置无关"""
+    payload = json.dumps({"source": source_hash, "box": params["box"]}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_render_target(filename: str) -> tuple[str, dict]:
+    """按文件名查询生成图的内容标识和渲染参数"""
+    session = SessionLocal()
+    try:
+        row = session.execute(text("""
+            SELECT content_hash, render_params FROM generated_images WHERE filename = :filename
+        """), {"filename": filename}).fetchone()
+    finally:
+        session.close()
+    if row is None or not row[1]:
+        raise HTTPException(status_code=404, detail="生成图片不存在")
+    return row[0], json.loads(row[1])
+
+
+def render_cache_key(content_hash: str, size: Optional[int], fmt: str) -> str:
+    return f"{content_hash}_{size or 'full'}.{fmt}"
+
+
+def _submit_render(params: dict, key: str, fmt: str, size: Optional[int]) -> Future:
+    def register(future: Future) -> None:
+        if future.exception() is None:
+            result = future.result()
+            render_cache.put(key, result.bytes_written)
+            encode_stats.record(result)
+            print(
+                f"生成图编码 {key}: {result.bytes_written} 字节, {result.encode_seconds * 1000:.1f} ms"
+                f"{'（无损裁剪）' if result.lossless else ''}"
+            )
+
+    future = encode_executor.submit(
+        render_crop, params["source"], tuple(params["box"]), render_cache.path_for(key), fmt, size,
+        RENDER_ENCODER_OPTIONS.get(fmt)
+    )
+    future.add_done_callback(register)
+    return future
+
+
+def submit_generated_render(row: dict) -> Optional[Future]:
+    """把一条生成记录的原尺寸 JPEG 提交到编码进程池；已有缓存时返回 None，编码池已满时抛出 503"""
+    key = render_cache_key(row["content_hash"], None, "jpg")
+    if render_cache.get(key) is not None:
+        return None
+    return _submit_render(json.loads(row["render_params"]), key, "jpg", None)
+
+
+def prewarm_generated_renders(rows: list[dict]) -> None:
+    """生成记录写入后，把每张原图得分最高的 RENDER_PREWARM_COUNT 张候选图的原尺寸 JPEG 提交到编码进程池
+
+    rows 中同一原图的记录按得分从高到低排列；其余候选图以及池满时未提交的，留到首次请求时渲染。
+    """
+    submitted: dict[int, int] = {}
+    for row in rows:
+        original_image_id = row["original_image_id"]
+        if submitted.get(original_image_id, 0) >= settings.RENDER_PREWARM_COUNT:
+            continue
+        submitted[original_image_id] = submitted.get(original_image_id, 0) + 1
+        try:
+            submit_generated_render(row)
+        except HTTPException:
+            return
+        except Exception as e:
+            print(f"⚠️ 预渲染生成图失败 {row.get('filename')}: {e}")
+
+
+async def render_generated_image(
+    filename: str, size: Optional[int] = None, fmt: str = "jpg"
+) -> tuple[BinaryIO, Optional[EncodeResult]]:
+    """返回已打开的生成图渲染结果，缓存未命中时裁剪编码并一并返回编码结果；文件检查和打开在线程中执行"""
+    if fmt not in DERIVATIVE_MEDIA_TYPES or (size is not None and size not in DERIVATIVE_SIZES):
+        raise HTTPException(status_code=404, detail="不支持的图片规格")
+
+    content_hash, params = await run_in_thread(load_render_target, filename)
+    key = render_cache_key(content_hash, size, fmt)
+    result = None
+    for _ in range(CACHE_OPEN_ATTEMPTS):
+        file = await run_in_thread(render_cache.open, key)
+        if file is not None:
+            return file, result
+
+        # 未命中，或刚渲染的文件在打开前已被其他写入淘汰，重新渲染
+        if not await run_in_thread(os.path.exists, params["source"]):
+            raise HTTPException(status_code=404, detail="生成图片的源图不存在")
+        pending = _inflight.get(key)
+        if pending is None:
+            pending = asyncio.wrap_future(_submit_render(params, key, fmt, size))
+            _inflight[key] = pending
+            pending.add_done_callback(lambda _: _inflight.pop(key, None))
+        try:
+            result = await asyncio.shield(pending)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"无法渲染生成图片: {str(e)}")
+    raise HTTPException(status_code=503, detail="渲染缓存繁忙，请稍后重试")
@@ -1,7 +1,7 @@
 """
 生成模块数据模式
 """
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, List
 
@@ -16,6 +16,79 @@ class GenerationResponse(BaseModel):
     generated_count: int
     message: str
 
+class BulkGenerationRequest(BaseModel):
+    """批量生成请求"""
+    original_image_ids: List[int] = Field(..., min_length=1)
+    view_angles: Optional[List[str]] = None  # 视角大方向列表，应用于所有原图
+
+class BulkGenerationItem(BaseModel):
+    """批量生成中单张原图的结果"""
+    original_image_id: int
+    success: bool
+    generated_count: int = 0
+    message: str
+
+class BulkGenerationResponse(BaseModel):
+    """批量生成响应"""
+    success: bool  # 全部原图均生成成功
+    message: str
+    total_count: int
+    success_count: int
+    failed_count: int
+    generated_count: int  # 生成图总数
+    elapsed_seconds: float
+    images_per_second: float  # 每秒完成的原图数
+    results: List[BulkGenerationItem]
+
+class GenerationJobResponse(BaseModel):
+    """生成任务提交响应"""
+    job_id: str
+    original_image_id: int
+    status: str  # pending
+    message: str
+
+class GenerationJobStatus(BaseModel):
+    """生成任务状态"""
+    job_id: str
+    status: str  # pending, processing, completed, failed
+    stage: Optional[str] = None  # generating, generated, scored
+    progress: int = 0  # 0-100
+    message: Optional[str] = None
+    original_image_id: Optional[int] = None
+    generated_count: Optional[int] = None
+    scored_count: Optional[int] = None
+
+class GenerationCacheStats(BaseModel):
+    """生成缓存统计"""
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+class SchedulerStats(BaseModel):
+    """生成/评分调度器统计，等待时间单位为秒"""
+    queued: int
+    running: int
+    max_queued: int
+    max_running: int
+    active_users: int
+    dispatched: int
+    rejected: int  # 因排队已满返回 429 的次数
+    wait_avg: float
+    wait_p50: float
+    wait_p95: float
+    wait_max: float
+
+class EncodeStatsResponse(BaseModel):
+    """生成图编码统计"""
+    encoded_count: int
+    lossless_count: int  # 用 jpegtran 无损裁剪的数量
+    bytes_written: int
+    encode_seconds: float
+    average_encode_ms: float
+
 class GeneratedImageInfo(BaseModel):
     """生成图片信息"""
     id: int
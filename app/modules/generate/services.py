@@ -2,15 +2,188 @@
 生成服务
 """
 import os
-import shutil
-from typing import List
+import json
+import time
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
+from app.core.config import settings
+from app.core.database import SessionLocal, insert_many, insert_rows
+from app.core.storage import hash_file
+from app.core.imaging import snap_boxes_to_jpeg_grid
+from app.core.sequences import allocate_sequence_block
+from app.core.events import event_bus, image_topic, job_topic
+from app.core.jobs import JOB_COMPLETED, JOB_FAILED, JobRegistry, JobState
+from app.core.pipeline import StreamingPipeline
+from app.core.executors import image_executor
+from app.core.scheduler import pipeline_scheduler
+from app.modules.generate.render import (
+    normalize_render_params,
+    prewarm_generated_renders,
+    render_content_hash,
+    render_url,
+    submit_generated_render,
+)
+from app.modules.generate.proposals import propose_crops
+from app.modules.generate.cache import generation_cache, generation_cache_key
 # 生成服务 - 处理图片生成逻辑
-from app.modules.generate.schemas import GenerationRequest, GenerationResponse, GeneratedImageInfo
+from app.modules.generate.schemas import (
+    GenerationRequest,
+    GenerationResponse,
+    BulkGenerationRequest,
+    BulkGenerationItem,
+    BulkGenerationResponse,
+    GenerationJobResponse,
+    GenerationJobStatus,
+    GenerationCacheStats,
+    SchedulerStats,
+    GeneratedImageInfo,
+)
 
-def create_generation(db: Session, request: GenerationRequest) -> GenerationResponse:
-    """创建生成任务"""
+# 生成任务各阶段及对应进度
+GENERATION_JOB_STAGES = {
+    "generating": 10,
+    "generated": 60,
+    "scored": 100,
+}
+generation_jobs = JobRegistry("generate", GENERATION_JOB_STAGES)
+
+def publish_job_event(job: JobState) -> None:
+    """生成任务状态每次变化都发布到任务和原图两个主题，SSE 客户端据此更新进度"""
+    topics = [job_topic(job.job_id)]
+    if job.result.get("original_image_id") is not None:
+        topics.append(image_topic(job.result["original_image_id"]))
+    event_bus.publish_many(topics, "job", {
+        "job_id": job.job_id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "message": job.message,
+        **job.result,
+    })
+
+generation_jobs.add_listener(publish_job_event)
+
+GENERATION_CANDIDATES = 10  # 每次生成的候选图数量
+MAX_BULK_IMAGES = 50  # 批量生成单次最多原图数
+BULK_WRITE_BATCH = 10  # 批量生成时每个事务写入的原图数
+
+# 候选裁剪搜索失败时使用的固定裁剪框（相对源图的 左, 上, 右, 下），裁剪类型与 output/ 示例数据一致
+CROP_PRESETS = [
+    ("default_center", (0.05, 0.05, 0.95, 0.95)),
+    ("default_center", (0.125, 0.125, 0.875, 0.875)),
+    ("default", (0.0, 0.0, 0.6667, 1.0)),
+    ("default", (0.3333, 0.0, 1.0, 1.0)),
+    ("default", (0.0, 0.0, 1.0, 0.6667)),
+    ("default", (0.0, 0.3333, 1.0, 1.0)),
+    ("default_supplement", (0.0, 0.0, 0.75, 0.75)),
+    ("default_supplement", (0.25, 0.0, 1.0, 0.75)),
+    ("default_supplement", (0.0, 0.25, 0.75, 1.0)),
+    ("default_supplement", (0.25, 0.25, 1.0, 1.0)),
+]
+
+def resolve_generation_source(
+    file_path: str,
+    content_hash: Optional[str],
+    working_path: Optional[str],
+    working_hash: Optional[str],
+) -> tuple[str, str]:
+    """返回生成使用的 (源图路径, 源图内容哈希)
+
+    优先使用上传时生成的工作副本（已摆正方向、转为 sRGB 并限制分辨率），旧数据回退到原图。
+    """
+    if working_hash:
+        source_path, source_hash = working_path, working_hash
+    else:
+        source_path, source_hash = file_path, content_hash
+    
+    if not os.path.exists(source_path):
+        raise ValueError(f"原始图片文件不存在: {source_path}")
+    
+    if not source_hash:
+        # 旧数据没有记录内容哈希，现场计算，用作生成图的内容标识
+        source_hash, _ = hash_file(source_path)
+    return source_path, source_hash
+
+def build_generated_rows(
+    original_image_id: int,
+    user_id: int,
+    source_path: str,
+    source_hash: str,
+    crops: list[tuple[str, tuple]],
+    sequences: range,
+    timestamp: int,
+) -> list[dict]:
+    """按候选裁剪构造 generated_images 记录，只保存渲染参数
+
+    裁剪框先对齐到源图的 MCU 网格，记录的即是实际输出的范围，渲染时可以无损裁剪。
+    """
+    rows = []
+    boxes = snap_boxes_to_jpeg_grid(source_path, [box for _, box in crops])
+    for i, (image_sequence, (crop_type, _), box) in enumerate(zip(sequences, crops, boxes), start=1):
+        # 文件命名规则：user{user_id}_img_{序号}_{时间戳}_generated_{i}.jpg
+        new_filename = f"user{user_id}_img_{image_sequence:03d}_{timestamp}_generated_{i}.jpg"
+        params = normalize_render_params(source_path, box, crop_type=crop_type)
+        rows.append({
+            "original_image_id": original_image_id,
+            "filename": new_filename,
+            "file_path": render_url(new_filename),
+            "content_hash": render_content_hash(source_hash, params),
+            "render_params": json.dumps(params, ensure_ascii=False)
+        })
+    return rows
+
+def find_crops_many(sources: list[tuple[str, str]], view_angles: list[str]) -> list[list[tuple[str, tuple]]]:
+    """为多张源图 (源图路径, 源图内容哈希) 返回按得分从高到低排列的候选裁剪 (裁剪类型, 相对裁剪框)
+
+    同一源图内容以相同参数生成过时直接复用裁剪结果；未命中的在进程池中并行搜索，
+    同时在途的搜索数不超过进程数；搜索失败时使用默认裁剪。
+    """
+    proposals: list[Optional[list]] = [None] * len(sources)
+    pending: dict[Future, tuple[int, str]] = {}
+    
+    def collect(done) -> None:
+        for future in done:
+            index, cache_key = pending.pop(future)
+            try:
+                proposals[index] = future.result()
+                generation_cache.put(cache_key, proposals[index])
+            except Exception as e:
+                print(f"候选裁剪搜索失败，使用默认裁剪: {e}")
+                proposals[index] = []
+    
+    for index, (source_path, source_hash) in enumerate(sources):
+        cache_key = generation_cache_key(source_hash, view_angles, GENERATION_CANDIDATES)
+        cached = generation_cache.get(cache_key)
+        if cached is not None:
+            print(f"命中生成缓存，复用 {len(cached)} 个候选裁剪")
+            proposals[index] = cached
+            continue
+        if len(pending) >= image_executor.max_workers:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        try:
+            future = image_executor.submit(propose_crops, source_path, view_angles, GENERATION_CANDIDATES)
+        except Exception as e:
+            print(f"候选裁剪搜索失败，使用默认裁剪: {e}")
+            proposals[index] = []
+            continue
+        pending[future] = (index, cache_key)
+    collect(wait(pending).done)
+    return [
+        [(crop_type, box) for crop_type, box, _ in found] or CROP_PRESETS[:GENERATION_CANDIDATES]
+        for found in proposals
+    ]
+
+def find_crops(source_path: str, source_hash: str, view_angles: list[str]) -> list[tuple[str, tuple]]:
+    """返回单张源图按得分从高到低排列的候选裁剪 (裁剪类型, 相对裁剪框)，见 find_crops_many"""
+    return find_crops_many([(source_path, source_hash)], view_angles)[0]
+
+def create_generation(db: Session, request: GenerationRequest, auto_score: bool = True) -> GenerationResponse:
+    """执行生成，auto_score 为 True 时随后为生成图评分"""
     
     try:
         # 处理视角参数
@@ -22,7 +195,8 @@ def create_generation(db: Session, request: GenerationRequest) -> GenerationResp
         
         # 获取原始图片信息和用户ID
         result = db.execute(text("""
-            SELECT i.id, i.filename, i.file_path, i.user_id, u.username 
+            SELECT i.id, i.filename, i.file_path, i.user_id, u.username, i.content_hash, i.file_size,
+                   i.working_path, i.working_hash
             FROM images i 
             JOIN users u ON i.user_id = u.id 
             WHERE i.id = :image_id
@@ -31,58 +205,36 @@ def create_generation(db: Session, request: GenerationRequest) -> GenerationResp
         if not result:
             raise ValueError("原始图片不存在")
         
-        original_file_path = result[2]
         user_id = result[3]
         username = result[4]
+        original_file_path, content_hash = resolve_generation_source(result[2], result[5], result[7], result[8])
         
-        if not os.path.exists(original_file_path):
-            raise ValueError(f"原始图片文件不存在: {original_file_path}")
-        
-        # 创建用户目录结构
-        from app.modules.upload.services import UploadService
-        dirs = UploadService.create_user_directories(user_id)
-        results_dir = dirs["results_dir"]
-        
-        generated_count = 0
-        
+        # 生成图只记录裁剪参数，像素在首次请求时由 /generate/render 渲染
+        crops = find_crops(original_file_path, content_hash, view_angles)
         # 生成唯一的时间戳前缀
-        import time
         timestamp = int(time.time() * 1000)  # 毫秒时间戳
         
-        # 获取该用户已生成的图片数量，用于序号
-        existing_count = db.execute(text("""
-            SELECT COUNT(*) FROM generated_images gi
-            JOIN images i ON gi.original_image_id = i.id
-            WHERE i.user_id = :user_id
-        """), {"user_id": user_id}).fetchone()[0]
+        # 从用户序号计数器一次取得本批次的序号
+        sequences = allocate_sequence_block(user_id, "generated_images", len(crops))
+        rows = build_generated_rows(
+            result[0], user_id, original_file_path, content_hash, crops, sequences, timestamp
+        )
         
-        for i in range(1, 11):
-            try:
-                # 文件命名规则：user{user_id}_img_{序号}_{时间戳}_generated_{i}.jpg
-                image_sequence = existing_count + i
-                new_filename = f"user{user_id}_img_{image_sequence:03d}_{timestamp}_generated_{i}.jpg"
-                new_file_path = os.path.join(results_dir, new_filename)
-                
-                shutil.copy2(original_file_path, new_file_path)
-                
-                db.execute(text("""
-                    INSERT INTO generated_images (original_image_id, filename, file_path, created_at)
-                    VALUES (:original_image_id, :filename, :file_path, NOW())
-                """), {
-                    "original_image_id": result[0],
-                    "filename": new_filename,
-                    "file_path": new_file_path
-                })
-                generated_count += 1
-                
-            except Exception as e:
-                print(f"生成第{i}张图片失败: {e}")
-                continue
+        # 整批记录一次写入
+        generated_count = insert_many(db, "generated_images", rows)
         
         if generated_count == 0:
             raise ValueError("没有成功生成任何图片")
         
         db.commit()
+        prewarm_generated_renders(rows)
+        
+        if not auto_score:
+            return GenerationResponse(
+                original_image_id=result[0],
+                generated_count=generated_count,
+                message=f"成功为用户 {username} 生成 {generated_count} 张图片"
+            )
         
         # 自动为刚生成的图片进行评分
         try:
@@ -108,6 +260,372 @@ def create_generation(db: Session, request: GenerationRequest) -> GenerationResp
         print(f"生成任务失败: {e}")
         raise ValueError(f"生成失败: {str(e)}")
 
+def load_generation_sources(user_id: int, image_ids: list[int]) -> dict[int, tuple[str, str]]:
+    """一次查询用户的多张原图，返回 原图ID -> (源图路径, 源图内容哈希)，失败的原图对应错误信息"""
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            text("""
+                SELECT id, file_path, content_hash, working_path, working_hash
+                FROM images WHERE user_id = :user_id AND id IN :ids
+            """).bindparams(bindparam("ids", expanding=True)),
+            {"user_id": user_id, "ids": image_ids}
+        ).fetchall()
+    finally:
+        db.close()
+    
+    sources = {}
+    for row in rows:
+        try:
+            sources[row[0]] = resolve_generation_source(row[1], row[2], row[3], row[4])
+        except Exception as e:
+            sources[row[0]] = str(e)
+    return sources
+
+def write_generated_batch(user_id: int, batch: list[tuple[int, str, str, list]]) -> dict[int, int]:
+    """在一个事务中写入多张原图的生成记录并评分，batch 为 (原图ID, 源图路径, 源图哈希, 裁剪列表)
+
+    返回 原图ID -> 生成数量。
+    """
+    from app.modules.score.services import score_unscored_images
+    
+    timestamp = int(time.time() * 1000)
+    # 整批一次取得序号，再按原图依次切分
+    sequences = allocate_sequence_block(user_id, "generated_images", sum(len(item[3]) for item in batch))
+    rows = []
+    counts = {}
+    offset = 0
+    for original_image_id, source_path, source_hash, crops in batch:
+        rows.extend(build_generated_rows(
+            original_image_id, user_id, source_path, source_hash, crops,
+            sequences[offset:offset + len(crops)], timestamp
+        ))
+        offset += len(crops)
+        counts[original_image_id] = len(crops)
+    
+    db = SessionLocal()
+    try:
+        insert_many(db, "generated_images", rows)
+        db.commit()
+        prewarm_generated_renders(rows)
+        
+        # 整批原图一次评分，评分失败不影响生成结果
+        try:
+            score_unscored_images(db, list(counts))
+            db.commit()
+        except Exception as score_error:
+            db.rollback()
+            print(f"自动评分失败: {score_error}")
+        return counts
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def run_generation_bulk(user_id: int, image_ids: list[int], view_angles: list[str]) -> dict[int, BulkGenerationItem]:
+    """在调度器的工作线程中执行批量生成：各原图的候选裁剪搜索分散到进程池并行执行，结果按批在事务中写入"""
+    sources = load_generation_sources(user_id, image_ids)
+    results: dict[int, BulkGenerationItem] = {}
+    for image_id in image_ids:
+        source = sources.get(image_id)
+        if source is None:
+            results[image_id] = BulkGenerationItem(original_image_id=image_id, success=False, message="原始图片不存在")
+        elif isinstance(source, str):
+            results[image_id] = BulkGenerationItem(original_image_id=image_id, success=False, message=source)
+    
+    # 与单张生成相同：复用生成缓存，搜索失败时退回默认裁剪
+    pending_ids = [image_id for image_id in image_ids if image_id not in results]
+    searched = find_crops_many([sources[image_id] for image_id in pending_ids], view_angles)
+    ready = [
+        (image_id, sources[image_id][0], sources[image_id][1], crops)
+        for image_id, crops in zip(pending_ids, searched)
+    ]
+    
+    # 分批写入，一批失败不影响其他批次
+    for start in range(0, len(ready), BULK_WRITE_BATCH):
+        batch = ready[start:start + BULK_WRITE_BATCH]
+        try:
+            counts = write_generated_batch(user_id, batch)
+            for image_id, count in counts.items():
+                results[image_id] = BulkGenerationItem(
+                    original_image_id=image_id, success=True, generated_count=count,
+                    message=f"成功生成 {count} 张图片"
+                )
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            for image_id, *_ in batch:
+                results[image_id] = BulkGenerationItem(
+                    original_image_id=image_id, success=False, message=f"生成失败: {detail}"
+                )
+    return results
+
+async def create_generation_bulk(user_id: int, request: BulkGenerationRequest) -> BulkGenerationResponse:
+    """批量生成：与其他生成、评分任务一起按用户公平排队，按原图数计入该用户的份额，排队已满时返回 429"""
+    started = time.perf_counter()
+    image_ids = list(dict.fromkeys(request.original_image_ids))
+    if not image_ids:
+        raise HTTPException(status_code=400, detail="请至少选择一张原图")
+    if len(image_ids) > MAX_BULK_IMAGES:
+        raise HTTPException(status_code=400, detail=f"单次最多为 {MAX_BULK_IMAGES} 张原图生成")
+    
+    results = await pipeline_scheduler.run(
+        user_id, run_generation_bulk, user_id, image_ids, request.view_angles or [], cost=len(image_ids)
+    )
+    
+    elapsed = time.perf_counter() - started
+    items = [results[image_id] for image_id in image_ids]
+    success_count = sum(1 for item in items if item.success)
+    generated_count = sum(item.generated_count for item in items)
+    return BulkGenerationResponse(
+        success=success_count == len(items),
+        message=f"成功为 {success_count}/{len(items)} 张原图生成",
+        total_count=len(items),
+        success_count=success_count,
+        failed_count=len(items) - success_count,
+        generated_count=generated_count,
+        elapsed_seconds=round(elapsed, 3),
+        images_per_second=round(success_count / elapsed, 2) if elapsed > 0 else 0.0,
+        results=items,
+    )
+
+def run_streaming_generation(job_id: str, request: GenerationRequest) -> None:
+    """流式执行一个生成任务：候选裁剪按得分从高到低分成小批，依次经过 编码 -> 评分 -> 入库 三个阶段
+
+    阶段之间用有界队列连接，每批一起评分（源图只解码一次）并与评分在同一事务中批量写入，
+    /api/result/original/{id} 在最后一张完成前就能查到已完成的、按评分排序的结果。
+    """
+    from app.modules.score.services import candidate_payload, evaluate_generated
+    
+    generation_jobs.advance(job_id, "generating")
+    db = SessionLocal()
+    try:
+        result = db.execute(text("""
+            SELECT id, user_id, file_path, content_hash, working_path, working_hash
+            FROM images WHERE id = :image_id
+        """), {"image_id": request.original_image_id}).fetchone()
+    finally:
+        db.close()
+    if not result:
+        generation_jobs.fail(job_id, "生成失败: 原始图片不存在")
+        return
+    
+    original_image_id, user_id = result[0], result[1]
+    try:
+        source_path, source_hash = resolve_generation_source(result[2], result[3], result[4], result[5])
+    except ValueError as e:
+        generation_jobs.fail(job_id, f"生成失败: {str(e)}")
+        return
+    
+    crops = find_crops(source_path, source_hash, request.view_angles or [])
+    sequences = allocate_sequence_block(user_id, "generated_images", len(crops))
+    rows = build_generated_rows(
+        original_image_id, user_id, source_path, source_hash, crops, sequences, int(time.time() * 1000)
+    )
+    
+    # 只预渲染得分最高的几张，其余候选图在首次请求时渲染
+    prewarm = {row["filename"] for row in rows[:settings.RENDER_PREWARM_COUNT]}
+    
+    def render_done(filename: str, future) -> None:
+        if future.exception() is not None:
+            print(f"⚠️ 预渲染生成图失败 {filename}: {future.exception()}")
+    
+    def encode(batch: list[dict]) -> list[dict]:
+        # 评分只读取源图和裁剪框，不等待编码完成；编码池已满时不等待，留到首次请求时渲染
+        for row in batch:
+            if row["filename"] not in prewarm:
+                continue
+            try:
+                pending = submit_generated_render(row)
+            except HTTPException:
+                continue
+            if pending is not None:
+                pending.add_done_callback(partial(render_done, row["filename"]))
+        return batch
+    
+    def score(batch: list[dict]) -> list[tuple[dict, Optional[dict]]]:
+        try:
+            evaluations = evaluate_generated(
+                [(row["content_hash"], row["file_path"], row["render_params"]) for row in batch]
+            )
+        except Exception as score_error:
+            print(f"自动评分失败: {score_error}")
+            evaluations = [None] * len(batch)
+        return list(zip(batch, evaluations))
+    
+    counts = {"generated_count": 0, "scored_count": 0}
+    session = SessionLocal()
+    
+    def store(scored: list[tuple[dict, Optional[dict]]]) -> None:
+        # 整批生成图用一条多行 INSERT 写入，评分再用一次批量写入，每批一个事务
+        try:
+            inserted = insert_rows(session, "generated_images", [row for row, _ in scored], key_column="filename")
+            insert_many(session, "image_evaluations", [
+                {"generated_image_id": generated_image_id, **evaluation}
+                for (generated_image_id, _), (_, evaluation) in zip(inserted, scored)
+                if evaluation is not None
+            ])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        for (generated_image_id, _), (row, evaluation) in zip(inserted, scored):
+            event_bus.publish_many(
+                [job_topic(job_id), image_topic(original_image_id)], "candidate",
+                candidate_payload(generated_image_id, row["filename"], row["file_path"], evaluation)
+            )
+        counts["generated_count"] += len(scored)
+        counts["scored_count"] += sum(evaluation is not None for _, evaluation in scored)
+        # 进度在 generating 与 100 之间按已入库张数推进，全部完成后由 advance 标记为 100
+        start = GENERATION_JOB_STAGES["generating"]
+        generation_jobs.report(job_id, start + (99 - start) * counts["generated_count"] // len(rows), **counts)
+    
+    # 按得分顺序分成小批，每批一起评分，得分最高的一批最先入库
+    step = max(settings.GENERATION_SCORE_BATCH, 1)
+    batches = [rows[index:index + step] for index in range(0, len(rows), step)]
+    try:
+        StreamingPipeline(
+            "visionmorph-generate", [encode, score, store], settings.GENERATION_PIPELINE_QUEUE_SIZE
+        ).run(batches)
+    except Exception as e:
+        print(f"生成任务 {job_id} 异常: {e}")
+        generation_jobs.fail(job_id, f"生成失败: {str(e)}")
+        return
+    finally:
+        session.close()
+    generation_jobs.advance(job_id, "scored", **counts)
+
+def run_generation_job(job_id: str, request: GenerationRequest) -> None:
+    """后台执行一个生成任务：生成 -> 评分，每个阶段更新任务状态"""
+    from app.modules.score.services import create_scores
+    from app.modules.score.schemas import ScoreRequest
+    
+    if settings.GENERATION_STREAMING:
+        try:
+            run_streaming_generation(job_id, request)
+        except Exception as e:
+            print(f"生成任务 {job_id} 异常: {e}")
+            generation_jobs.fail(job_id, f"生成失败: {str(e)}")
+        return
+    
+    db = SessionLocal()
+    try:
+        generation_jobs.advance(job_id, "generating")
+        try:
+            generation = create_generation(db, request, auto_score=False)
+        except Exception as e:
+            generation_jobs.fail(job_id, str(e))
+            return
+        generation_jobs.advance(job_id, "generated", generated_count=generation.generated_count)
+        
+        # 评分失败不影响生成结果
+        scored_count = 0
+        try:
+            score_response = create_scores(db, ScoreRequest(original_image_id=request.original_image_id))
+            scored_count = score_response.scored_count
+            print(f"自动评分完成，共评分 {scored_count} 张生成图片")
+        except Exception as score_error:
+            print(f"自动评分失败: {score_error}")
+        generation_jobs.advance(job_id, "scored", scored_count=scored_count)
+    except Exception as e:
+        print(f"生成任务 {job_id} 异常: {e}")
+        generation_jobs.fail(job_id, f"生成失败: {str(e)}")
+    finally:
+        db.close()
+
+def submit_generation_job(user_id: int, request: GenerationRequest) -> GenerationJobResponse:
+    """登记生成任务并交给公平调度器，排队已满时返回 429"""
+    job = generation_jobs.create(user_id, original_image_id=request.original_image_id)
+    try:
+        pipeline_scheduler.submit(user_id, run_generation_job, job.job_id, request)
+    except Exception as e:
+        generation_jobs.fail(job.job_id, getattr(e, "detail", str(e)))
+        raise
+    
+    return GenerationJobResponse(
+        job_id=job.job_id,
+        original_image_id=request.original_image_id,
+        status=job.status,
+        message="生成任务已提交"
+    )
+
+def get_generation_job(job_id: str, user_id: int) -> GenerationJobStatus:
+    """查询生成任务状态，只能查询自己的任务"""
+    job = generation_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        raise ValueError("生成任务不存在")
+    
+    return GenerationJobStatus(
+        job_id=job.job_id,
+        status=job.status,
+        stage=job.stage,
+        progress=job.progress,
+        message=job.message,
+        original_image_id=job.result.get("original_image_id"),
+        generated_count=job.result.get("generated_count"),
+        scored_count=job.result.get("scored_count"),
+    )
+
+def check_image_owner(original_image_id: int, user_id: int) -> None:
+    """确认原图属于该用户，否则按不存在处理"""
+    db = SessionLocal()
+    try:
+        owner = db.execute(text("SELECT user_id FROM images WHERE id = :image_id"),
+                           {"image_id": original_image_id}).scalar()
+    finally:
+        db.close()
+    if owner != user_id:
+        raise ValueError("原始图片不存在")
+
+def _job_snapshot_event(job: JobState) -> str:
+    """任务当前状态的 SSE 消息，不带事件ID，不影响客户端的 Last-Event-ID"""
+    payload = json.dumps({
+        "job_id": job.job_id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "message": job.message,
+        **job.result,
+    }, ensure_ascii=False, default=str)
+    return f"event: job\ndata: {payload}\n\n"
+
+async def stream_events(
+    topic: str,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    last_event_id: Optional[int] = None,
+    job: Optional[JobState] = None,
+) -> AsyncIterator[str]:
+    """SSE 事件流：补发并持续推送主题上的事件，定期发送心跳；
+    订阅任务时先推送任务当前状态，任务结束后关闭；超过 EVENT_STREAM_TIMEOUT 后关闭，由客户端重连续传
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.EVENT_STREAM_TIMEOUT
+    yield "retry: 3000\n\n"
+    if job is not None:
+        yield _job_snapshot_event(job)
+        if job.finished:
+            return
+    
+    async for event in event_bus.subscribe(topic, last_event_id, keepalive=settings.EVENT_STREAM_KEEPALIVE):
+        if await is_disconnected():
+            return
+        if event is None:
+            yield ": keepalive\n\n"
+        else:
+            yield event.to_sse()
+            if job is not None and event.event == "job" and event.data.get("status") in (JOB_COMPLETED, JOB_FAILED):
+                return
+        if loop.time() >= deadline:
+            return
+
+def get_generation_cache_stats() -> GenerationCacheStats:
+    """生成缓存的容量与命中统计（本进程）"""
+    return GenerationCacheStats(**generation_cache.stats())
+
+def get_scheduler_stats() -> SchedulerStats:
+    """生成/评分调度器的排队与等待时间统计（本进程）"""
+    return SchedulerStats(**pipeline_scheduler.stats())
+
 def get_generated_images(db: Session, original_image_id: int) -> List[GeneratedImageInfo]:
     """获取生成的图片列表"""
     results = db.execute(text("""
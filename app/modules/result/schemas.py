@@ -12,6 +12,7 @@ class ResultImageInfo(BaseModel):
     file_path: str
     overall_score: int = Field(..., ge=1, le=100, description="总体评分1-100")
     highlights: Optional[str] = None
+    thumbnail_url: Optional[str] = None  # 768px WebP 缩略图地址
     created_at: datetime
 
 class ResultDetailInfo(BaseModel):
@@ -42,6 +43,7 @@ class StaticImageResult(BaseModel):
     image_name: str
     filename: str
     relative_path: str
+    thumbnail_url: Optional[str] = None  # 768px WebP 缩略图地址
     overall_score: float
     shooting_guidance: Optional[str] = None
     viewpoint_feature: Optional[str] = Field(
@@ -72,6 +74,7 @@ class ShowcaseEvolutionItem(BaseModel):
         default=None,
         description="原图 URL 路径，如 /input/1.jpg",
     )
+    original_thumbnail_url: Optional[str] = None
     best_result: Optional[StaticImageResult] = None
 
 
@@ -10,6 +10,8 @@ from sqlalchemy import text
 from openpyxl import load_workbook
 
 from app.core.config import settings
+from app.modules.derivative.services import derivative_url
+from app.modules.generate.render import is_render_url, sized_render_url
 from app.modules.result.schemas import (
     ResultListResponse,
     ResultDetailResponse,
@@ -26,6 +28,7 @@ INPUT_BASE_DIR = os.path.join(settings.BASE_DIR, "input")
 EXCEL_FILENAME = "构图分析报告.xlsx"
 IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
 SHOWCASE_INPUT_KEYS = ("1", "2", "3")
+RESULT_THUMBNAIL_SIZE = 768  # 结果卡片使用的缩略图长边
 
 
 def _sort_numeric_key(value: str) -> tuple[int, str]:
@@ -36,6 +39,13 @@ def _sort_numeric_key(value: str) -> tuple[int, str]:
         return (1, value.lower())
 
 
+def _thumbnail_url(file_path: Optional[str]) -> Optional[str]:
+    """结果卡片缩略图地址：按需渲染的生成图直接请求对应尺寸，其他文件走缩略图服务"""
+    if is_render_url(file_path):
+        return sized_render_url(file_path, RESULT_THUMBNAIL_SIZE)
+    return derivative_url(file_path, RESULT_THUMBNAIL_SIZE)
+
+
 def _list_available_input_keys() -> List[str]:
     """列出可用的输入示例目录"""
     if not os.path.isdir(OUTPUT_BASE_DIR):
@@ -156,6 +166,7 @@ def _build_static_results_for_group(input_key: str, group: str) -> List[StaticIm
                 image_name=image_name,
                 filename=filename,
                 relative_path=relative_path,
+                thumbnail_url=derivative_url(relative_path, RESULT_THUMBNAIL_SIZE),
                 overall_score=score,
                 viewpoint_feature=_excel_cell_str(row.get("一句话概括优势特征")),
                 composition_highlights=_excel_cell_str(row.get("推荐视角优点")),
@@ -203,6 +214,7 @@ def get_showcase_evolution() -> ShowcaseEvolutionResponse:
             ShowcaseEvolutionItem(
                 input_key=key,
                 original_relative_path=original,
+                original_thumbnail_url=derivative_url(original, RESULT_THUMBNAIL_SIZE),
                 best_result=best,
             )
         )
@@ -266,6 +278,7 @@ def get_results_by_original_image(db: Session, original_image_id: int) -> Result
                 file_path=row[2],
                 overall_score=row[3],
                 highlights=row[4],
+                thumbnail_url=_thumbnail_url(row[2]),
                 created_at=row[5]
             ))
         
@@ -6,16 +6,20 @@ from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.security import get_current_active_user
 from app.core.models import User
+from app.core.executors import run_in_thread
+from app.core.scheduler import pipeline_scheduler
 from app.modules.score.schemas import (
     ScoreRequest, 
     ScoreResponse, 
     ScoreInfo, 
-    GeneratedImageScore
+    GeneratedImageScore,
+    ScoreCacheStats
 )
 from app.modules.score.services import (
-    create_scores,
+    run_scoring_job,
     get_scores_by_original_image,
-    get_score_details
+    get_score_details,
+    get_score_cache_stats
 )
 
 router = APIRouter(prefix="/score", tags=["score"])
@@ -23,19 +27,26 @@ router = APIRouter(prefix="/score", tags=["score"])
 @router.post("/create", response_model=ScoreResponse)
 async def create_image_scores(
     request: ScoreRequest,
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     为原始图片对应的所有生成图片创建评分
+    与生成任务一起按用户公平排队，排队已满时返回 429
     """
     try:
-        return create_scores(db, request)
+        return await pipeline_scheduler.run(current_user.id, run_scoring_job, request)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
+@router.get("/cache/stats", response_model=ScoreCacheStats)
+async def get_score_cache_status(current_user: User = Depends(get_current_active_user)):
+    """查询评分缓存的命中率和节省的字节数"""
+    return await run_in_thread(get_score_cache_stats)
+
 @router.get("/original/{original_image_id}", response_model=list[GeneratedImageScore])
 async def get_scores_for_original_image(
     original_image_id: int,
@@ -46,7 +57,9 @@ async def get_scores_for_original_image(
     获取原始图片对应的所有生成图片的评分
     """
     try:
-        return get_scores_by_original_image(db, original_image_id)
+        return await run_in_thread(get_scores_by_original_image, db, original_image_id)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
@@ -60,8 +73,10 @@ async def get_score_detail(
     获取特定生成图片的详细评分信息
     """
     try:
-        return get_score_details(db, generated_image_id)
+        return await run_in_thread(get_score_details, db, generated_image_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
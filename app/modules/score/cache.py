@@ -0,0 +1,205 @@
+"""
+评分结果缓存
+按 生成图内容哈希 + 评分后端版本 缓存评分结果：内存中保留最近使用的条目（LRU），
+所有条目同时写入本地 SQLite 文件，重启或内存淘汰后从磁盘读回；
+磁盘条目数超过上限时删除最久未使用的，启动时删除其他评分后端版本的条目。
+用户重新生成同一裁剪、示例图重复评分时都不再解码和计算
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+
+SQLITE_IN_CHUNK = 500  # 单条 IN 查询的参数个数，低于旧版 SQLite 的 999 上限
+PRUNE_TARGET_RATIO = 0.9  # 超出上限时删到上限的该比例，避免之后每次写入都触发清理
+
+
+class ScoreCache:
+    """两级评分缓存，记录各级命中次数和因命中而免去读取解码的源图字节数
+
+    每条记录附带评分时该图片分摊到的源图字节数（同一源图的多个裁剪平分源图文件大小），
+    命中时累计到 bytes_saved。
+    """
+
+    def __init__(self, db_path: str, memory_entries: int, max_rows: int):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.max_rows = max_rows
+        self._disk_rows = 0  # 磁盘条目数的上界估计，超过上限时才实际计数
+        self._memory: "OrderedDict[str, tuple[dict, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def key(content_hash: str, scorer_version: str) -> str:
+        return f"{scorer_version}:{content_hash}"
+
+    def _connect(self) -> sqlite3.Connection:
+        """在持有锁时调用，首次使用时打开数据库文件"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS score_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    input_bytes INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_score_cache_last_used ON score_cache (last_used)")
+            connection.commit()
+            self._disk_rows = connection.execute("SELECT COUNT(*) FROM score_cache").fetchone()[0]
+            self._connection = connection
+        return self._connection
+
+    def _remember(self, key: str, evaluation: dict, input_bytes: int) -> None:
+        self._memory[key] = (evaluation, input_bytes)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        """批量查询，先查内存再批量查磁盘，返回命中的 键 -> 评分字段"""
+        found: dict[str, dict] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is None:
+                    missing.append(key)
+                    continue
+                self._memory.move_to_end(key)
+                found[key] = dict(entry[0])
+                self.memory_hits += 1
+                self.bytes_saved += entry[1]
+
+            if missing:
+                try:
+                    connection = self._connect()
+                    rows = []
+                    for start in range(0, len(missing), SQLITE_IN_CHUNK):
+                        chunk = missing[start:start + SQLITE_IN_CHUNK]
+                        rows.extend(connection.execute(
+                            f"SELECT cache_key, payload, input_bytes FROM score_cache "
+                            f"WHERE cache_key IN ({', '.join('?' * len(chunk))})",
+                            chunk,
+                        ).fetchall())
+                    if rows:
+                        # 磁盘命中的条目记为最近使用，清理时最后删除
+                        connection.executemany(
+                            "UPDATE score_cache SET last_used = ? WHERE cache_key = ?",
+                            [(time.time(), row[0]) for row in rows],
+                        )
+                        connection.commit()
+                except sqlite3.Error as e:
+                    print(f"⚠️ 读取评分缓存失败: {e}")
+                    rows = []
+                for key, payload, input_bytes in rows:
+                    evaluation = json.loads(payload)
+                    self._remember(key, evaluation, input_bytes)
+                    found[key] = dict(evaluation)
+                    self.disk_hits += 1
+                    self.bytes_saved += input_bytes
+                self.misses += len(missing) - len(rows)
+        return found
+
+    def put_many(self, entries: list[tuple[str, dict, int]]) -> None:
+        """写入 (键, 评分字段, 分摊的源图字节数)，磁盘写入失败只影响之后的命中率"""
+        if not entries:
+            return
+        with self._lock:
+            for key, evaluation, input_bytes in entries:
+                self._remember(key, evaluation, input_bytes)
+            try:
+                connection = self._connect()
+                now = time.time()
+                connection.executemany(
+                    "INSERT OR REPLACE INTO score_cache (cache_key, payload, input_bytes, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(key, json.dumps(evaluation, ensure_ascii=False), input_bytes, now, now)
+                     for key, evaluation, input_bytes in entries],
+                )
+                connection.commit()
+                self._disk_rows += len(entries)
+                if self._disk_rows > self.max_rows:
+                    self._prune(connection)
+            except sqlite3.Error as e:
+                print(f"⚠️ 写入评分缓存失败: {e}")
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        """在持有锁时调用，条目数超过上限时删除最久未使用的条目"""
+        count = connection.execute("SELECT COUNT(*) FROM score_cache").fetchone()[0]
+        if count > self.max_rows:
+            excess = count - int(self.max_rows * PRUNE_TARGET_RATIO)
+            connection.execute(
+                "DELETE FROM score_cache WHERE cache_key IN "
+                "(SELECT cache_key FROM score_cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            connection.commit()
+            count -= excess
+            print(f"✅ 评分缓存超过 {self.max_rows} 条，已删除 {excess} 条最久未使用的条目")
+        self._disk_rows = count
+
+    def prune_versions(self, scorer_version: str) -> None:
+        """删除其他评分后端版本的条目，这些条目在切换版本后不会再被命中"""
+        prefix = self.key("", scorer_version)
+        with self._lock:
+            for key in [key for key in self._memory if not key.startswith(prefix)]:
+                del self._memory[key]
+            try:
+                connection = self._connect()
+                deleted = connection.execute(
+                    "DELETE FROM score_cache WHERE substr(cache_key, 1, ?) != ?", (len(prefix), prefix)
+                ).rowcount
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ 清理评分缓存失败: {e}")
+                return
+            self._disk_rows -= deleted
+            if deleted:
+                print(f"✅ 已删除 {deleted} 条其他评分版本的评分缓存")
+
+    def stats(self) -> dict:
+        with self._lock:
+            try:
+                disk_entries = self._connect().execute("SELECT COUNT(*) FROM score_cache").fetchone()[0]
+            except sqlite3.Error:
+                disk_entries = 0
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+score_cache = ScoreCache(
+    settings.SCORE_CACHE_PATH or os.path.join(settings.UPLOAD_DIR, "cache", "scores.sqlite3"),
+    settings.SCORE_CACHE_MEMORY_ENTRIES,
+    settings.SCORE_CACHE_MAX_ROWS,
+)
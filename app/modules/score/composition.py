@@ -0,0 +1,226 @@
+"""
+构图评分
+把一批生成图缩小为同尺寸灰度数组，堆叠成 (N, S, S) 的张量，在整批上一次性计算
+三分法、对称性、地平线倾斜、视觉平衡和边缘杂乱度，得到确定的总分和结构化的亮点；
+同一源图的多个裁剪只解码一次。函数保持为模块级以便在进程池中执行
+
+基准测试: python -m app.modules.score.composition [图片路径]
+"""
+import json
+import math
+import time
+from typing import Optional
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+SCORER_VERSION = "composition-1"
+SCORE_EDGE = 96  # 每个裁剪缩放到的边长
+SOURCE_DECODE_EDGE = 768  # 源图解码长边，裁剪在此分辨率上截取
+
+# 各项指标的权重，合计为 1
+METRIC_WEIGHTS = {
+    "rule_of_thirds": 0.30,
+    "balance": 0.20,
+    "horizon": 0.20,
+    "clutter": 0.15,
+    "symmetry": 0.15,
+}
+HORIZON_TOLERANCE_DEG = 4.0  # 倾斜超过该角度后分数明显下降
+HORIZON_WINDOW_DEG = 20.0  # 只统计与水平方向夹角在此范围内的边缘
+EDGE_THRESHOLD = 0.08  # 梯度幅值超过该值视为边缘
+
+METRIC_LABELS = {
+    "rule_of_thirds": "三分法",
+    "balance": "视觉平衡",
+    "horizon": "水平线",
+    "clutter": "画面简洁",
+    "symmetry": "对称性",
+}
+METRIC_GUIDANCE = {
+    "rule_of_thirds": "拍摄时把主体放在画面三分线的交点附近",
+    "balance": "调整取景让画面左右、上下的视觉重量更均衡",
+    "horizon": "拍摄时保持相机水平，可借助网格线或水平仪",
+    "clutter": "靠近主体或换一个更简洁的背景，减少边缘处的杂物",
+    "symmetry": "对称场景可以把中轴线放在画面正中",
+}
+
+
+def _thirds_kernel(size: int) -> np.ndarray:
+    """四个三分点处的高斯权重图"""
+    axis = (np.arange(size) + 0.5) / size
+    sigma = 0.08
+    gx = sum(np.exp(-((axis - c) ** 2) / (2 * sigma ** 2)) for c in (1 / 3, 2 / 3))
+    return np.outer(gx, gx)
+
+
+THIRDS_KERNEL = _thirds_kernel(SCORE_EDGE)
+THIRDS_BASELINE = THIRDS_KERNEL.mean()  # 视觉重量均匀分布时的期望值
+BORDER_MASK = np.zeros((SCORE_EDGE, SCORE_EDGE), dtype=bool)
+BORDER_MASK[:SCORE_EDGE // 10, :] = BORDER_MASK[-SCORE_EDGE // 10:, :] = True
+BORDER_MASK[:, :SCORE_EDGE // 10] = BORDER_MASK[:, -SCORE_EDGE // 10:] = True
+
+
+def load_crop_tensor(items: list[tuple[str, tuple[float, float, float, float]]]) -> tuple[np.ndarray, np.ndarray]:
+    """读取一批 (源图路径, 相对裁剪框)，返回 (N, S, S) 的灰度张量（0-1）和每个裁剪的 (宽, 高) 像素数"""
+    tensor = np.empty((len(items), SCORE_EDGE, SCORE_EDGE), dtype=np.float32)
+    sizes = np.empty((len(items), 2), dtype=np.float32)
+    sources: dict[str, PILImage.Image] = {}
+    for index, (source_path, box) in enumerate(items):
+        source = sources.get(source_path)
+        if source is None:
+            with PILImage.open(source_path) as image:
+                image.draft("L", (SOURCE_DECODE_EDGE, SOURCE_DECODE_EDGE))
+                source = ImageOps.exif_transpose(image).convert("L")
+                source.thumbnail((SOURCE_DECODE_EDGE, SOURCE_DECODE_EDGE), PILImage.BILINEAR)
+            sources[source_path] = source
+        width, height = source.size
+        left, top, right, bottom = box
+        x0, y0 = round(left * width), round(top * height)
+        crop = source.crop((x0, y0, max(round(right * width), x0 + 1), max(round(bottom * height), y0 + 1)))
+        sizes[index] = crop.size
+        tensor[index] = np.asarray(crop.resize((SCORE_EDGE, SCORE_EDGE), PILImage.BILINEAR), dtype=np.float32)
+    tensor /= 255.0
+    return tensor, sizes
+
+
+def score_tensor(tensor: np.ndarray, sizes: np.ndarray) -> dict[str, np.ndarray]:
+    """在 (N, S, S) 张量上向量化计算各项指标，每项返回长度 N 的 0-1 数组，另附倾斜角度"""
+    size = tensor.shape[1]
+    # 缩放到正方形后按原宽高还原梯度比例，保证倾斜角度正确
+    scale_x = (size / sizes[:, 0])[:, None, None]
+    scale_y = (size / sizes[:, 1])[:, None, None]
+    gx = np.zeros_like(tensor)
+    gy = np.zeros_like(tensor)
+    gx[:, :, 1:-1] = (tensor[:, :, 2:] - tensor[:, :, :-2]) / 2
+    gy[:, 1:-1, :] = (tensor[:, 2:, :] - tensor[:, :-2, :]) / 2
+    magnitude = np.hypot(gx, gy)
+
+    # 视觉重量：边缘强度与偏离平均亮度的程度
+    mean = tensor.mean(axis=(1, 2), keepdims=True)
+    weight = magnitude / (magnitude.mean(axis=(1, 2), keepdims=True) + 1e-6) \
+        + np.abs(tensor - mean) / (np.abs(tensor - mean).mean(axis=(1, 2), keepdims=True) + 1e-6)
+    weight /= weight.sum(axis=(1, 2), keepdims=True)
+
+    # 三分法：视觉重量落在三分点附近的程度，相对均匀分布
+    thirds_ratio = (weight * THIRDS_KERNEL).sum(axis=(1, 2)) / THIRDS_BASELINE
+    rule_of_thirds = np.clip((thirds_ratio - 0.7) / 0.6, 0.0, 1.0)
+
+    # 视觉平衡：重心与画面中心的距离
+    coords = (np.arange(size, dtype=np.float32) + 0.5) / size - 0.5
+    center_x = (weight.sum(axis=1) * coords).sum(axis=1)
+    center_y = (weight.sum(axis=2) * coords).sum(axis=1)
+    balance = np.clip(1.0 - np.hypot(center_x, center_y) / 0.25, 0.0, 1.0)
+
+    # 对称性：与左右镜像的差异
+    symmetry = np.clip(1.0 - np.abs(tensor - tensor[:, :, ::-1]).mean(axis=(1, 2)) / 0.25, 0.0, 1.0)
+
+    # 地平线倾斜：接近水平的强边缘的加权平均角度
+    true_gx = gx * scale_x
+    true_gy = gy * scale_y
+    strength = np.hypot(true_gx, true_gy)
+    # 边缘方向与梯度垂直：水平边缘的梯度接近竖直，角度 = atan(gx/gy)
+    angle = np.degrees(np.arctan2(true_gx, np.abs(true_gy) + 1e-9)) * np.sign(true_gy + 1e-9)
+    near_horizontal = (np.abs(angle) < HORIZON_WINDOW_DEG) & (magnitude > EDGE_THRESHOLD)
+    line_weight = strength * near_horizontal
+    total_line_weight = line_weight.sum(axis=(1, 2))
+    tilt = np.abs((angle * line_weight).sum(axis=(1, 2)) / (total_line_weight + 1e-9))
+    has_lines = near_horizontal.mean(axis=(1, 2)) > 0.01
+    horizon = np.where(has_lines, np.exp(-(tilt / HORIZON_TOLERANCE_DEG) ** 2), 1.0)
+
+    # 杂乱度：整体边缘密度，边框处的边缘加倍计入
+    edges = magnitude > EDGE_THRESHOLD
+    density = edges.mean(axis=(1, 2))
+    border_density = edges[:, BORDER_MASK].mean(axis=1)
+    clutter = np.clip(1.0 - (0.5 * density + 0.5 * border_density) / 0.35, 0.0, 1.0)
+
+    return {
+        "rule_of_thirds": rule_of_thirds,
+        "balance": balance,
+        "horizon": horizon,
+        "clutter": clutter,
+        "symmetry": symmetry,
+        "tilt_degrees": np.where(has_lines, tilt, 0.0),
+    }
+
+
+def _evaluation_text(metrics: dict[str, float], overall: int, tilt: float) -> tuple[str, str, str]:
+    """由各项指标生成结构化亮点、评语和拍摄建议"""
+    ranked = sorted(METRIC_WEIGHTS, key=lambda name: metrics[name], reverse=True)
+    strengths = [name for name in ranked if metrics[name] >= 0.6][:2] or ranked[:1]
+    weakest = ranked[-1]
+    highlights = json.dumps({
+        "scorer": SCORER_VERSION,
+        "overall_score": overall,
+        "metrics": {name: round(metrics[name], 3) for name in METRIC_WEIGHTS},
+        "horizon_tilt_degrees": round(tilt, 1),
+        "strengths": [METRIC_LABELS[name] for name in strengths],
+        "weakness": METRIC_LABELS[weakest],
+    }, ensure_ascii=False)
+    ai_comment = (
+        f"构图评分 {overall} 分，{'、'.join(METRIC_LABELS[name] for name in strengths)}表现较好，"
+        f"{METRIC_LABELS[weakest]}有待改进"
+    )
+    return highlights, ai_comment, METRIC_GUIDANCE[weakest]
+
+
+def score_crops(items: list[tuple[str, tuple[float, float, float, float]]]) -> list[dict]:
+    """为一批 (源图路径, 相对裁剪框) 评分，返回与输入顺序一致的评分字段"""
+    if not items:
+        return []
+    tensor, sizes = load_crop_tensor(items)
+    metrics = score_tensor(tensor, sizes)
+    overall = sum(METRIC_WEIGHTS[name] * metrics[name] for name in METRIC_WEIGHTS)
+    overall = np.clip(np.round(overall * 100), 1, 100).astype(int)
+
+    evaluations = []
+    for index in range(len(items)):
+        values = {name: float(metrics[name][index]) for name in METRIC_WEIGHTS}
+        highlights, ai_comment, guidance = _evaluation_text(
+            values, int(overall[index]), float(metrics["tilt_degrees"][index])
+        )
+        evaluations.append({
+            "overall_score": int(overall[index]),
+            "highlights": highlights,
+            "ai_comment": ai_comment,
+            "shooting_guidance": guidance,
+        })
+    return evaluations
+
+
+def benchmark(image_path: Optional[str] = None, candidates: int = 10, rounds: int = 20) -> None:
+    """测量为 candidates 个候选裁剪评分的耗时（单进程单核）"""
+    import os
+    import tempfile
+    from app.modules.generate.proposals import propose_crops
+
+    if image_path is None:
+        rng = np.random.default_rng(0)
+        pixels = (rng.random((1536, 2048, 3)) * 64 + np.linspace(0, 160, 2048)[None, :, None]).astype(np.uint8)
+        image_path = os.path.join(tempfile.mkdtemp(), "benchmark.jpg")
+        PILImage.fromarray(pixels).save(image_path, quality=90)
+
+    boxes = [box for _, box, _ in propose_crops(image_path, None, candidates)]
+    boxes = (boxes * math.ceil(candidates / max(len(boxes), 1)))[:candidates]
+    items = [(image_path, box) for box in boxes]
+
+    score_crops(items)  # 预热
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        tensor, sizes = load_crop_tensor(items)
+        loaded = time.perf_counter()
+        score_tensor(tensor, sizes)
+        timings.append((loaded - started, time.perf_counter() - loaded))
+    load_ms = sorted(t[0] for t in timings)[rounds // 2] * 1000
+    score_ms = sorted(t[1] for t in timings)[rounds // 2] * 1000
+    print(f"{len(items)} 个候选裁剪: 解码裁剪 {load_ms:.1f} ms, 向量化评分 {score_ms:.1f} ms, "
+          f"合计 {load_ms + score_ms:.1f} ms（{rounds} 轮中位数）")
+    for item, evaluation in zip(items, score_crops(items)):
+        print(f"  {tuple(round(v, 3) for v in item[1])}: {evaluation['overall_score']}")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
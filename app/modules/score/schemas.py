@@ -25,6 +25,16 @@ class ScoreInfo(BaseModel):
     shooting_guidance: Optional[str] = None
     created_at: datetime
 
+class ScoreCacheStats(BaseModel):
+    """评分缓存统计"""
+    memory_entries: int
+    disk_entries: int
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    hit_rate: float
+    bytes_saved: int  # 因命中而免去读取解码的源图字节数
+
 class GeneratedImageScore(BaseModel):
     """生成图片评分信息"""
     generated_image_id: int
@@ -0,0 +1,252 @@
+"""
+评分后端
+评分服务通过 Scorer 接口调用评分后端：默认是启发式构图评分；配置了 SCORE_MODEL_PATH
+且安装了 onnxruntime 时，启动时加载一次模型并预热，之后所有请求共用同一个推理会话，
+各请求的图片由微批处理线程在最大等待时间内合并成动态大小的批次一起推理
+"""
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional, Protocol
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from app.core.config import settings
+from app.core.executors import image_executor
+from app.modules.score.composition import SCORER_VERSION, score_crops
+
+Item = tuple[str, tuple[float, float, float, float]]  # (源图路径, 相对裁剪框)
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+class Scorer(Protocol):
+    """评分后端接口"""
+    name: str
+    version: str  # 评分结果随版本变化，用于区分缓存
+
+    def warmup(self) -> None:
+        ...
+
+    def score(self, items: list[Item]) -> list[dict]:
+        """为一批生成图评分，返回与输入顺序一致的 overall_score / highlights / ai_comment / shooting_guidance"""
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class HeuristicScorer:
+    """启发式构图评分，整批在图像进程池中执行"""
+    name = "heuristic"
+    version = SCORER_VERSION
+
+    def warmup(self) -> None:
+        pass
+
+    def score(self, items: list[Item]) -> list[dict]:
+        if not items:
+            return []
+        return image_executor.submit(score_crops, items).result()
+
+    def close(self) -> None:
+        pass
+
+
+def load_model_inputs(items: list[Item], input_size: int) -> np.ndarray:
+    """把一批裁剪解码为 (N, 3, S, S) 的模型输入（ImageNet 归一化），同一源图只解码一次"""
+    batch = np.empty((len(items), 3, input_size, input_size), dtype=np.float32)
+    sources: dict[str, PILImage.Image] = {}
+    for index, (source_path, box) in enumerate(items):
+        source = sources.get(source_path)
+        if source is None:
+            with PILImage.open(source_path) as image:
+                image.draft("RGB", (input_size * 4, input_size * 4))
+                source = ImageOps.exif_transpose(image).convert("RGB")
+            sources[source_path] = source
+        width, height = source.size
+        left, top, right, bottom = box
+        x0, y0 = round(left * width), round(top * height)
+        crop = source.crop((x0, y0, max(round(right * width), x0 + 1), max(round(bottom * height), y0 + 1)))
+        pixels = np.asarray(crop.resize((input_size, input_size), PILImage.BILINEAR), dtype=np.float32) / 255.0
+        batch[index] = ((pixels - IMAGENET_MEAN) / IMAGENET_STD).transpose(2, 0, 1)
+    return batch
+
+
+def prepare_model_batch(items: list[Item], input_size: int) -> tuple[list[dict], np.ndarray]:
+    """在进程池中一次完成启发式评分（用于亮点和建议）和模型输入预处理"""
+    return score_crops(items), load_model_inputs(items, input_size)
+
+
+def model_scores(outputs: np.ndarray) -> np.ndarray:
+    """把模型输出换算为 0-100 分：(N, K) 视为 1..K 分的概率分布取期望，(N,) / (N, 1) 视为单一分数"""
+    outputs = np.asarray(outputs, dtype=np.float64)
+    if outputs.ndim == 2 and outputs.shape[1] > 1:
+        probabilities = outputs / np.clip(outputs.sum(axis=1, keepdims=True), 1e-9, None)
+        levels = np.arange(1, outputs.shape[1] + 1)
+        return (probabilities @ levels - 1) / (outputs.shape[1] - 1) * 100
+    outputs = outputs.reshape(-1)
+    if outputs.max(initial=0) <= 1.0:
+        return outputs * 100
+    if outputs.max(initial=0) <= 10.0:
+        return outputs * 10
+    return outputs
+
+
+class MicroBatcher:
+    """把多个请求的输入合并成批次交给同一个推理函数，批次满或等待超过 window 秒即执行"""
+
+    def __init__(self, infer, max_batch: int, window: float):
+        self.infer = infer
+        self.max_batch = max_batch
+        self.window = window
+        self._requests: "queue.Queue[Optional[tuple[np.ndarray, Future]]]" = queue.Queue()
+        self._carry: Optional[tuple[np.ndarray, Future]] = None
+        self._thread = threading.Thread(target=self._run, name="visionmorph-score-batch", daemon=True)
+        self._thread.start()
+
+    def submit(self, inputs: np.ndarray) -> Future:
+        future: Future = Future()
+        self._requests.put((inputs, future))
+        return future
+
+    def _collect(self) -> list[tuple[np.ndarray, Future]]:
+        first, self._carry = self._carry or self._requests.get(), None
+        if first is None:
+            return []
+        pending = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._requests.put(None)
+                break
+            if size + len(request[0]) > self.max_batch:
+                # 放不进本批次的请求留到下一批的开头
+                self._carry = request
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            if not pending:
+                return
+            try:
+                outputs = self.infer(np.concatenate([inputs for inputs, _ in pending]))
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for inputs, future in pending:
+                future.set_result(outputs[offset:offset + len(inputs)])
+                offset += len(inputs)
+
+    def close(self) -> None:
+        self._requests.put(None)
+        self._thread.join(timeout=5)
+
+
+class OnnxScorer:
+    """ONNX Runtime CPU 推理评分：单一共享会话，跨请求微批处理"""
+    name = "onnx"
+
+    def __init__(self, model_path: str):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = settings.SCORE_INTRA_OP_THREADS
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # 输入的批次维为固定值时按该大小分块推理
+        self.fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        self.input_size = settings.SCORE_MODEL_INPUT_SIZE
+        with open(model_path, "rb") as f:
+            self.version = f"onnx-{hashlib.sha256(f.read()).hexdigest()[:12]}"
+        self.batcher = MicroBatcher(
+            self._infer, settings.SCORE_BATCH_SIZE, settings.SCORE_BATCH_WINDOW_MS / 1000
+        )
+
+    def _infer(self, batch: np.ndarray) -> np.ndarray:
+        step = self.fixed_batch or len(batch)
+        outputs = []
+        for start in range(0, len(batch), step):
+            chunk = batch[start:start + step]
+            if self.fixed_batch and len(chunk) < step:
+                padding = np.zeros((step - len(chunk), *chunk.shape[1:]), dtype=chunk.dtype)
+                scores = model_scores(self.session.run(None, {self.input_name: np.concatenate([chunk, padding])})[0])
+                outputs.append(scores[:len(chunk)])
+            else:
+                outputs.append(model_scores(self.session.run(None, {self.input_name: chunk})[0]))
+        return np.concatenate(outputs)
+
+    def warmup(self) -> None:
+        """用一个批次的空输入跑一次推理，让首个真实请求不承担初始化开销"""
+        started = time.perf_counter()
+        size = self.fixed_batch or min(settings.SCORE_BATCH_SIZE, 8)
+        self._infer(np.zeros((size, 3, self.input_size, self.input_size), dtype=np.float32))
+        print(f"✅ 评分模型预热完成，用时 {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def score(self, items: list[Item]) -> list[dict]:
+        if not items:
+            return []
+        evaluations, inputs = image_executor.submit(prepare_model_batch, items, self.input_size).result()
+        scores = self.batcher.submit(inputs).result()
+        for evaluation, score in zip(evaluations, scores):
+            evaluation["overall_score"] = int(np.clip(round(float(score)), 1, 100))
+            evaluation["ai_comment"] = f"模型评分 {evaluation['overall_score']} 分；{evaluation['ai_comment']}"
+        return evaluations
+
+    def close(self) -> None:
+        self.batcher.close()
+
+
+_scorer: Scorer = HeuristicScorer()
+
+
+def load_scorer() -> Scorer:
+    """按配置加载评分后端并预热，没有模型或加载失败时使用启发式评分"""
+    global _scorer
+    model_path = settings.SCORE_MODEL_PATH
+    if model_path and os.path.isfile(model_path):
+        try:
+            scorer = OnnxScorer(model_path)
+            scorer.warmup()
+            _scorer = scorer
+            print(f"✅ 已加载评分模型 {model_path}（{scorer.version}）")
+            return _scorer
+        except ImportError:
+            print("⚠️ 未安装 onnxruntime，使用启发式构图评分")
+        except Exception as e:
+            print(f"⚠️ 评分模型加载失败，使用启发式构图评分: {e}")
+    elif model_path:
+        print(f"⚠️ 评分模型不存在 {model_path}，使用启发式构图评分")
+    _scorer = HeuristicScorer()
+    return _scorer
+
+
+def get_scorer() -> Scorer:
+    """当前使用的评分后端"""
+    return _scorer
+
+
+def close_scorer() -> None:
+    _scorer.close()
@@ -1,64 +1,135 @@
 """
 打分服务
 """
-import random
-from typing import List
+import os
+import json
+from typing import List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from app.modules.score.schemas import ScoreRequest, ScoreResponse, ScoreInfo, GeneratedImageScore
+from sqlalchemy import bindparam, text
+from app.core.database import SessionLocal, insert_many
+from app.core.events import image_topic, publish_after_commit
+from app.modules.derivative.services import derivative_url
+from app.modules.generate.render import is_render_url, sized_render_url
+from app.modules.score.scorers import Scorer, get_scorer
+from app.modules.score.cache import score_cache
+from app.modules.score.schemas import ScoreRequest, ScoreResponse, ScoreInfo, GeneratedImageScore, ScoreCacheStats
+
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+CANDIDATE_THUMBNAIL_SIZE = 768  # 进度事件中候选图缩略图的长边，与结果页一致
+
+def candidate_payload(generated_image_id: int, filename: str, file_path: str, evaluation: Optional[dict]) -> dict:
+    """新评分候选图的进度事件内容，客户端收到后无需再查询结果列表"""
+    return {
+        "generated_image_id": generated_image_id,
+        "filename": filename,
+        "file_path": file_path,
+        "thumbnail_url": (
+            sized_render_url(file_path, CANDIDATE_THUMBNAIL_SIZE) if is_render_url(file_path)
+            else derivative_url(file_path, CANDIDATE_THUMBNAIL_SIZE)
+        ),
+        "overall_score": evaluation["overall_score"] if evaluation else None,
+        "highlights": evaluation["highlights"] if evaluation else None,
+    }
+
+def _scoring_input(file_path: str, render_params: Optional[str]) -> Optional[tuple[str, tuple]]:
+    """生成图的评分输入 (源图路径, 相对裁剪框)；按需渲染的记录取裁剪参数，旧记录取生成图文件本身"""
+    if render_params:
+        params = json.loads(render_params)
+        source_path, box = params["source"], tuple(params["box"])
+    else:
+        source_path, box = file_path, FULL_FRAME
+    return (source_path, box) if os.path.exists(source_path) else None
+
+def evaluate_generated(entries: List[tuple[Optional[str], str, Optional[str]]]) -> List[Optional[dict]]:
+    """为一批生成图 (内容哈希, 文件路径, 渲染参数) 计算评分字段，源图不存在的项为 None
+
+    先按 内容哈希 + 评分后端版本 查评分缓存，未命中的整批交给当前评分后端（见 scorers）一次评分并写回缓存；
+    旧记录没有内容哈希，不经过缓存。
+    """
+    scorer: Scorer = get_scorer()
+    cache_keys = [score_cache.key(content_hash, scorer.version) if content_hash else None
+                  for content_hash, _, _ in entries]
+    cached = score_cache.get_many([key for key in cache_keys if key])
+    
+    evaluations: List[Optional[dict]] = [cached.get(key) if key else None for key in cache_keys]
+    pending, items = [], []
+    for index, (_, file_path, render_params) in enumerate(entries):
+        if evaluations[index] is not None:
+            continue
+        item = _scoring_input(file_path, render_params)
+        if item is None:
+            print(f"⚠️ 生成图片 {file_path} 的源图不存在，跳过评分")
+            continue
+        pending.append(index)
+        items.append(item)
+    
+    if items:
+        scored = scorer.score(items)
+        # 同一源图的多个裁剪平分源图文件大小，作为命中时节省的读取解码量
+        per_source = {}
+        for source_path, _ in items:
+            per_source[source_path] = per_source.get(source_path, 0) + 1
+        cache_entries = []
+        for index, evaluation, (source_path, _) in zip(pending, scored, items):
+            evaluations[index] = evaluation
+            if cache_keys[index]:
+                cache_entries.append(
+                    (cache_keys[index], evaluation, os.path.getsize(source_path) // per_source[source_path])
+                )
+        score_cache.put_many(cache_entries)
+    return evaluations
+
+def score_unscored_images(db: Session, original_image_ids: List[int]) -> int:
+    """为多张原图下尚未评分的生成图片评分（不提交事务），返回新增评分数
+
+    未评分的图片用一次加锁的反连接查询取得：并发评分同一原图时后到的事务等待先到的提交，
+    再读到最新的评分，只会取得真正未评分的图片；整批评分（见 evaluate_generated）后以一条多行 INSERT 写入，
+    generated_image_id 唯一键冲突的行被跳过作为兜底。事务提交后只为本次写入的候选图发布 candidate 进度事件。
+    """
+    if not original_image_ids:
+        return 0
+    unscored = db.execute(
+        text("""
+            SELECT gi.id, gi.content_hash, gi.file_path, gi.render_params, gi.original_image_id, gi.filename
+            FROM generated_images gi
+            LEFT JOIN image_evaluations ie ON ie.generated_image_id = gi.id
+            WHERE gi.original_image_id IN :original_image_ids AND ie.id IS NULL
+            FOR UPDATE
+        """).bindparams(bindparam("original_image_ids", expanding=True)),
+        {"original_image_ids": original_image_ids}
+    ).fetchall()
+    
+    evaluations = evaluate_generated([(row[1], row[2], row[3]) for row in unscored])
+    rows = [{"generated_image_id": row[0], **evaluation}
+            for row, evaluation in zip(unscored, evaluations) if evaluation is not None]
+    if not rows:
+        return 0
+    insert_many(db, "image_evaluations", rows, skip_duplicates=True)
+    for row, evaluation in zip(unscored, evaluations):
+        if evaluation is not None:
+            publish_after_commit(
+                db, [image_topic(row[4])], "candidate", candidate_payload(row[0], row[5], row[2], evaluation)
+            )
+    return len(rows)
 
 def create_scores(db: Session, request: ScoreRequest) -> ScoreResponse:
     """为生成的图片创建评分"""
     
     try:
-        # 获取原始图片对应的所有生成图片
-        generated_images = db.execute(text("""
-            SELECT gi.id, gi.filename, gi.file_path, gi.created_at, i.user_id, u.username
-            FROM generated_images gi
-            JOIN images i ON gi.original_image_id = i.id
+        # 确认存在生成图片，并取得用户名
+        owner = db.execute(text("""
+            SELECT u.username
+            FROM images i
             JOIN users u ON i.user_id = u.id
-            WHERE gi.original_image_id = :original_image_id
-            ORDER BY gi.created_at DESC
-        """), {"original_image_id": request.original_image_id}).fetchall()
+            WHERE i.id = :original_image_id
+            AND EXISTS (SELECT 1 FROM generated_images gi WHERE gi.original_image_id = i.id)
+        """), {"original_image_id": request.original_image_id}).fetchone()
         
-        if not generated_images:
+        if not owner:
             raise ValueError("未找到对应的生成图片")
         
-        user_id = generated_images[0][4]
-        username = generated_images[0][5]
-        
-        scored_count = 0
-        
-        for generated_image in generated_images:
-            generated_image_id = generated_image[0]
-            
-            # 检查是否已经评分过
-            existing_score = db.execute(text("""
-                SELECT id FROM image_evaluations 
-                WHERE generated_image_id = :generated_image_id
-            """), {"generated_image_id": generated_image_id}).fetchone()
-            
-            if existing_score:
-                # 如果已经评分过，跳过
-                continue
-            
-            # 生成1-100的随机分数
-            random_score = random.randint(1, 100)
-            
-            # 插入评分记录
-            db.execute(text("""
-                INSERT INTO image_evaluations 
-                (generated_image_id, overall_score, highlights, ai_comment, shooting_guidance, created_at)
-                VALUES (:generated_image_id, :overall_score, :highlights, :ai_comment, :shooting_guidance, NOW())
-            """), {
-                "generated_image_id": generated_image_id,
-                "overall_score": random_score,
-                "highlights": f"随机评分: {random_score}分",
-                "ai_comment": f"这是一张评分为{random_score}分的生成图片",
-                "shooting_guidance": f"基于{random_score}分的拍摄建议"
-            })
-            
-            scored_count += 1
+        username = owner[0]
+        scored_count = score_unscored_images(db, [request.original_image_id])
         
         if scored_count == 0:
             raise ValueError("所有图片都已评分过")
@@ -76,6 +147,14 @@ def create_scores(db: Session, request: ScoreRequest) -> ScoreResponse:
         print(f"评分失败: {e}")
         raise ValueError(f"评分失败: {str(e)}")
 
+def run_scoring_job(request: ScoreRequest) -> ScoreResponse:
+    """在调度器的工作线程中评分，使用该线程自己的数据库会话，不依赖请求的会话"""
+    db = SessionLocal()
+    try:
+        return create_scores(db, request)
+    finally:
+        db.close()
+
 def get_scores_by_original_image(db: Session, original_image_id: int) -> List[GeneratedImageScore]:
     """获取原始图片对应的所有生成图片的评分"""
     results = db.execute(text("""
@@ -128,3 +207,7 @@ def get_score_details(db: Session, generated_image_id: int) -> ScoreInfo:
         shooting_guidance=result[5],
         created_at=result[6]
     )
+
+def get_score_cache_stats() -> ScoreCacheStats:
+    """评分缓存的容量与命中统计（内存层为本进程）"""
+    return ScoreCacheStats(**score_cache.stats())
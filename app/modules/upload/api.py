@@ -1,8 +1,16 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Header, Request, status
 from app.modules.upload.services import UploadService
-from app.modules.upload.schemas import UploadResponse, UploadStatusResponse
+from app.modules.upload.schemas import (
+    UploadResponse,
+    UploadStatusResponse,
+    BatchUploadResponse,
+    UploadSessionCreateRequest,
+    UploadSessionResponse,
+)
 from app.core.security import get_current_active_user
 from app.core.models import User
+from app.core.executors import run_in_thread
 
 router = APIRouter()
 
@@ -14,7 +22,68 @@ async def upload_image(
     """上传图片接口"""
     return await UploadService.upload_image(file, current_user.id)
 
-@router.get("/upload/status/{file_id}", response_model=UploadStatusResponse)
-async def get_upload_status(file_id: str):
-    """获取上传状态"""
-    return UploadService.get_upload_status(file_id)
\ No newline at end of file
+@router.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_images_batch(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_active_user)
+):
+    """批量上传图片接口，逐个返回每张图片的结果"""
+    return await UploadService.upload_images_batch(files, current_user.id)
+
+@router.get("/upload/status/{upload_id}", response_model=UploadStatusResponse)
+async def get_upload_status(
+    upload_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """按上传任务ID获取处理状态和进度，只能查询自己的上传"""
+    return await run_in_thread(UploadService.get_upload_status, upload_id, current_user.id)
+
+@router.post("/upload/sessions", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+    request: UploadSessionCreateRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """创建断点续传会话"""
+    return await run_in_thread(
+        UploadService.create_upload_session,
+        current_user.id,
+        request.filename,
+        request.file_size,
+        request.content_type,
+    )
+
+@router.get("/upload/sessions/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+    session_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """查询断点续传会话的当前偏移量"""
+    return await run_in_thread(UploadService.get_upload_session, current_user.id, session_id)
+
+@router.patch("/upload/sessions/{session_id}", response_model=UploadSessionResponse)
+async def append_upload_chunk(
+    session_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset", ge=0),
+    current_user: User = Depends(get_current_active_user)
+):
+    """从 Upload-Offset 指定的位置追加请求体中的数据"""
+    return await UploadService.append_upload_chunk(
+        current_user.id, session_id, upload_offset, request.stream()
+    )
+
+@router.post("/upload/sessions/{session_id}/complete", response_model=UploadResponse)
+async def complete_upload_session(
+    session_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """数据接收完整后完成上传"""
+    return await UploadService.complete_upload_session(current_user.id, session_id)
+
+@router.delete("/upload/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_upload_session(
+    session_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """放弃断点续传会话"""
+    await run_in_thread(UploadService.cancel_upload_session, current_user.id, session_id)
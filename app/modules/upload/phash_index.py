@@ -0,0 +1,152 @@
+"""
+示例参考图感知哈希索引
+启动时为 input/ 目录中的参考图计算一次 pHash，之后按文件 mtime 增量刷新；
+查询使用以汉明距离为度量的 BK 树，上传时无需再逐张打开、计算参考图
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.core.imaging import compute_phash
+
+REFERENCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+RELOAD_CHECK_INTERVAL = 5.0  # 两次检查参考目录变化的最小间隔（秒）
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个哈希之间的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+def _key_order(key: str) -> tuple[int, str]:
+    """示例编号排序：数字优先，距离相同时编号小的优先"""
+    try:
+        return (0, f"{int(key):08d}")
+    except ValueError:
+        return (1, key.lower())
+
+
+class BKTree:
+    """汉明距离 BK 树，节点结构为 [hash, keys, {距离: 子节点}]"""
+
+    def __init__(self):
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, hash_value: int, key: str) -> None:
+        """插入一个哈希及其示例编号"""
+        self.size += 1
+        if self._root is None:
+            self._root = [hash_value, [key], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [key], {}]
+                return
+            node = child
+
+    def search(self, hash_value: int, max_distance: int) -> list[tuple[int, str]]:
+        """返回距离不超过 max_distance 的所有 (距离, 编号)"""
+        if self._root is None:
+            return []
+        results: list[tuple[int, str]] = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, key) for key in node[1])
+            # 三角不等式剪枝：只有边长落在 [d-r, d+r] 的子树可能包含结果
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in node[2].items():
+                if low <= edge <= high:
+                    stack.append(child)
+        return results
+
+
+class PHashIndex:
+    """参考图感知哈希索引，文件新增、删除或 mtime 变化时自动刷新"""
+
+    def __init__(self, ref_dir: str):
+        self.ref_dir = ref_dir
+        self._entries: dict[str, tuple[float, int, str]] = {}  # 路径 -> (mtime, 哈希, 编号)
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    @property
+    def size(self) -> int:
+        return self._tree.size
+
+    def _scan_reference_files(self) -> dict[str, tuple[str, float]]:
+        """扫描参考目录，每个编号按扩展名优先级只取一个文件，返回 路径 -> (编号, mtime)"""
+        if not os.path.isdir(self.ref_dir):
+            return {}
+        candidates: dict[str, tuple[int, str, float]] = {}
+        with os.scandir(self.ref_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                key, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                if ext not in REFERENCE_EXTENSIONS:
+                    continue
+                priority = REFERENCE_EXTENSIONS.index(ext)
+                current = candidates.get(key)
+                if current is None or priority < current[0]:
+                    candidates[key] = (priority, entry.path, entry.stat().st_mtime)
+        return {path: (key, mtime) for key, (_, path, mtime) in candidates.items()}
+
+    def refresh(self, force: bool = False) -> None:
+        """检查参考目录变化，只为新增或修改过的文件重新计算哈希"""
+        now = time.monotonic()
+        if not force and now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if not force and now - self._last_check < RELOAD_CHECK_INTERVAL:
+                return
+            self._last_check = now
+
+            changed = False
+            entries: dict[str, tuple[float, int, str]] = {}
+            for path, (key, mtime) in self._scan_reference_files().items():
+                cached = self._entries.get(path)
+                if cached is not None and cached[0] == mtime and cached[2] == key:
+                    entries[path] = cached
+                    continue
+                try:
+                    entries[path] = (mtime, compute_phash(path), key)
+                    changed = True
+                except Exception as e:
+                    print(f"⚠️ 无法计算参考图哈希 {path}: {e}")
+
+            if not changed and entries.keys() == self._entries.keys():
+                return
+
+            # 构建新树后整体替换，查询线程始终读到完整的树
+            tree = BKTree()
+            for _, hash_value, key in entries.values():
+                tree.add(hash_value, key)
+            self._entries = entries
+            self._tree = tree
+            print(f"🔎 参考图哈希索引已刷新，共 {tree.size} 张")
+
+    def match(self, hash_value: int, max_distance: int) -> Optional[str]:
+        """返回距离最近且不超过 max_distance 的示例编号，没有则返回 None"""
+        self.refresh()
+        results = self._tree.search(hash_value, max_distance)
+        if not results:
+            return None
+        return min(results, key=lambda item: (item[0], _key_order(item[1])))[1]
+
+
+# 全局参考图索引实例
+demo_reference_index = PHashIndex(os.path.join(settings.BASE_DIR, "input"))
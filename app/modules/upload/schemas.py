@@ -1,8 +1,8 @@
 """
 上传模块的数据模型定义
 """
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, List
 from datetime import datetime
 
 class UploadResponse(BaseModel):
@@ -18,6 +18,26 @@ class UploadResponse(BaseModel):
     created_at: datetime
     # 与项目 input/1、2、3 参考图感知哈希比对结果，供前端拉取对应预置 output 数据（不展示给用户）
     demo_input_key: str = "1"
+    # 上传任务ID，可用于 /upload/status/{upload_id} 查询处理进度
+    upload_id: Optional[str] = None
+    # 256px WebP 缩略图地址，列表和卡片展示时使用
+    thumbnail_url: Optional[str] = None
+
+class BatchUploadItem(BaseModel):
+    """批量上传中单个文件的结果"""
+    original_filename: str
+    success: bool
+    message: str
+    result: Optional[UploadResponse] = None
+
+class BatchUploadResponse(BaseModel):
+    """批量上传响应模型"""
+    success: bool  # 全部文件均上传成功
+    message: str
+    total_count: int
+    success_count: int
+    failed_count: int
+    results: List[BatchUploadItem]
 
 class UploadErrorResponse(BaseModel):
     """上传错误响应模型"""
@@ -30,7 +50,22 @@ class UploadStatusResponse(BaseModel):
     success: bool
     message: str
     status: str  # pending, processing, completed, failed
+    stage: Optional[str] = None  # received, probed, indexed, stored
     progress: Optional[int] = None  # 0-100
     image_id: Optional[int] = None
     filename: Optional[str] = None
     file_path: Optional[str] = None
+
+class UploadSessionCreateRequest(BaseModel):
+    """断点续传会话创建请求"""
+    filename: str
+    file_size: int = Field(..., gt=0, description="文件总字节数")
+    content_type: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    """断点续传会话状态"""
+    session_id: str
+    filename: str
+    file_size: int
+    offset: int  # 服务器已接收的字节数，客户端从这里继续上传
+    expires_at: datetime
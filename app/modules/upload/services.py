@@ -1,25 +1,73 @@
 import os
+import re
+import json
 import uuid
+import asyncio
 import hashlib
 import time
-from io import BytesIO
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Optional
 from fastapi import UploadFile, HTTPException
-import imagehash
-from PIL import Image as PILImage
 from app.core.config import settings
-from app.core.database import get_db
+from app.core.database import get_db, insert_row, insert_rows
 from app.core.models import Image
-from app.modules.upload.schemas import UploadResponse, UploadErrorResponse, UploadStatusResponse
+from app.core.imaging import WorkingCopy, prepare_upload
+from app.core.executors import image_executor, run_in_process, run_in_thread
+from app.core.storage import blob_extension, blob_store, hash_file
+from app.core.sequences import allocate_sequence_block
+from app.core.jobs import JobRegistry
+from app.modules.upload.schemas import (
+    UploadResponse,
+    UploadErrorResponse,
+    UploadStatusResponse,
+    UploadSessionResponse,
+    BatchUploadItem,
+    BatchUploadResponse,
+)
+from app.modules.upload.phash_index import demo_reference_index
+from app.modules.derivative.services import derivative_url, prewarm_derivative
 
 # 配置
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 BASE_STATIC_DIR = "static"  # 基础静态文件目录
+UPLOAD_CHUNK_SIZE = 256 * 1024  # 流式写入时每次读取的字节数
+MAX_BATCH_FILES = 100  # 批量上传单次最多文件数
+UPLOAD_SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
 
-# 与项目根目录 input/1、2、3 参考图比对（手机重拍/压缩后仍应接近）
-DEMO_INPUT_KEYS = ("1", "2", "3")
+# 同一会话的追加与完成操作串行执行：会话ID -> [锁, 持有或等待该锁的协程数]
+_session_locks: dict[str, list] = {}
+
+# 与项目根目录 input/ 参考图比对（手机重拍/压缩后仍应接近）
+DEFAULT_DEMO_INPUT_KEY = "1"
 PHASH_MAX_DISTANCE = 14
 
+# 上传任务各阶段及对应进度：接收完成 -> 探测完成 -> 记录入库 -> 文件入存储
+UPLOAD_JOB_STAGES = {
+    "received": 25,
+    "probed": 50,
+    "indexed": 75,
+    "stored": 100,
+}
+upload_jobs = JobRegistry("upload", UPLOAD_JOB_STAGES)
+
+
+@asynccontextmanager
+async def session_lock(session_id: str):
+    """持有会话锁；最后一个持有或等待者退出时才移除，等待中的协程与新来的协程总是使用同一把锁"""
+    entry = _session_locks.get(session_id)
+    if entry is None:
+        entry = _session_locks[session_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _session_locks.get(session_id) is entry:
+            del _session_locks[session_id]
+
 
 class UploadService:
     """上传服务类"""
@@ -31,7 +79,6 @@ class UploadService:
         return {
             "user_dir": user_dir,
             "avatar_dir": os.path.join(user_dir, "avatar"),
-            "original_dir": os.path.join(user_dir, "original"),
             "temp_dir": os.path.join(user_dir, "temp"),
             "results_dir": os.path.join(user_dir, "results")
         }
@@ -64,116 +111,332 @@ class UploadService:
             
             # 如果没有默认用户，创建一个
             password_hash = hashlib.sha256('admin123'.encode()).hexdigest()
-            result = session.execute(text("""
-                INSERT INTO users (username, email, password_hash) 
-                VALUES ('admin', 'admin@visionmorph.com', :password_hash)
-            """), {'password_hash': password_hash})
+            user_id, _ = insert_row(session, "users", {
+                'username': 'admin',
+                'email': 'admin@visionmorph.com',
+                'password_hash': password_hash
+            })
             
             session.commit()
-            return result.lastrowid
+            return user_id
         finally:
             session.close()
     
     @staticmethod
     def validate_image(file: UploadFile) -> bool:
         """验证图片文件"""
-        if not file.filename:
+        return UploadService.is_allowed_filename(file.filename)
+    
+    @staticmethod
+    def is_allowed_filename(filename: Optional[str]) -> bool:
+        """检查文件扩展名是否为支持的图片格式"""
+        if not filename:
             return False
         
         # 检查文件扩展名
-        ext = os.path.splitext(file.filename)[1].lower()
+        ext = os.path.splitext(filename)[1].lower()
         return ext in ALLOWED_EXTENSIONS
     
     @staticmethod
-    def get_image_dimensions(content: bytes) -> tuple[int, int]:
-        """获取图片的宽度和高度"""
+    def match_demo_input_key(phash: Optional[int]) -> str:
+        """用上传图的感知哈希与 input/ 参考图比对，返回最接近的示例编号。"""
+        if phash is None:
+            return DEFAULT_DEMO_INPUT_KEY
         try:
-            # 使用PIL打开图片
-            image = PILImage.open(BytesIO(content))
-            return image.size  # 返回 (width, height)
-        except Exception as e:
-            # 如果无法获取尺寸，返回默认值
-            print(f"⚠️ 无法获取图片尺寸: {e}")
-            return (0, 0)
-
-    @staticmethod
-    def match_demo_input_key(content: bytes) -> str:
-        """与项目 input/1、2、3 参考图做感知哈希比对，返回最接近的示例编号。"""
-        try:
-            ref_dir = os.path.join(settings.BASE_DIR, "input")
-            ref_paths: list[tuple[str, str]] = []
-            for k in DEMO_INPUT_KEYS:
-                for ext in (".jpg", ".jpeg", ".png", ".webp"):
-                    p = os.path.join(ref_dir, f"{k}{ext}")
-                    if os.path.isfile(p):
-                        ref_paths.append((k, p))
-                        break
-            if not ref_paths:
-                return "1"
-            upload_img = PILImage.open(BytesIO(content))
-            if upload_img.mode not in ("RGB", "L"):
-                upload_img = upload_img.convert("RGB")
-            h_u = imagehash.phash(upload_img)
-            best_k, best_d = "1", 999
-            for k, path in ref_paths:
-                ref_img = PILImage.open(path)
-                if ref_img.mode not in ("RGB", "L"):
-                    ref_img = ref_img.convert("RGB")
-                h_r = imagehash.phash(ref_img)
-                d = h_u - h_r
-                if d < best_d:
-                    best_d, best_k = d, k
-            if best_d > PHASH_MAX_DISTANCE:
-                return "1"
-            return best_k
+            return demo_reference_index.match(phash, PHASH_MAX_DISTANCE) or DEFAULT_DEMO_INPUT_KEY
         except Exception as e:
             print(f"match_demo_input_key: {e}")
-            return "1"
+            return DEFAULT_DEMO_INPUT_KEY
     
     @staticmethod
     def generate_user_filename(user_id: int, original_filename: str) -> tuple[str, str]:
         """生成用户友好的文件名"""
-        # 获取文件扩展名
-        ext = os.path.splitext(original_filename)[1].lower()
+        return UploadService.generate_user_filenames(user_id, [original_filename])[0]
+    
+    @staticmethod
+    def generate_user_filenames(user_id: int, original_filenames: list[str]) -> list[tuple[str, str]]:
+        """为一批文件生成连续序号的用户友好文件名"""
+        # 从用户序号计数器一次取得整批序号
+        sequences = allocate_sequence_block(user_id, "images", len(original_filenames))
+        
+        # 生成新的文件名：user{id}_img_{序号}_{时间戳}{扩展名}
+        timestamp = int(time.time() * 1000)
+        names = []
+        for sequence, original_filename in zip(sequences, original_filenames):
+            ext = os.path.splitext(original_filename)[1].lower()
+            names.append((f"user{user_id}_img_{sequence:03d}_{timestamp}{ext}", str(sequence)))
+        
+        return names
+    
+    @staticmethod
+    def discard_temp_file(temp_path: str) -> None:
+        """删除残留的临时文件"""
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"⚠️ 无法删除临时文件 {temp_path}: {e}")
+    
+    @staticmethod
+    def is_retryable_error(error: BaseException) -> bool:
+        """客户端数据本身有问题（4xx）时重试无意义；服务繁忙、数据库或磁盘故障等错误可以重试"""
+        return not (isinstance(error, HTTPException) and error.status_code < 500)
+    
+    @staticmethod
+    def _open_for_write(path: str, mode: str):
+        """创建所在目录并打开文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, mode)
+    
+    @staticmethod
+    async def stream_to_temp(file: UploadFile, temp_dir: str) -> tuple[str, int, str]:
+        """分块写入临时文件，边写边统计大小并计算SHA-256，超过大小限制立即中止
+        
+        返回 (临时文件路径, 文件大小, 内容哈希)
+        """
+        temp_path = os.path.join(temp_dir, f"upload_{uuid.uuid4().hex}.part")
+        hasher = hashlib.sha256()
+        file_size = 0
         
-        # 获取用户已上传的图片数量
+        # 打开和写入文件放进IO线程池，事件循环只负责接收数据
+        buffer = await run_in_thread(UploadService._open_for_write, temp_path, "wb")
+        try:
+            try:
+                while True:
+                    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file_size += len(chunk)
+                    if file_size > MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="文件过大，请上传小于10MB的图片"
+                        )
+                    hasher.update(chunk)
+                    await run_in_thread(buffer.write, chunk)
+            finally:
+                buffer.close()
+        except BaseException:
+            UploadService.discard_temp_file(temp_path)
+            raise
+        
+        return temp_path, file_size, hasher.hexdigest()
+    
+    @staticmethod
+    def working_copy_fields(
+        working: Optional[WorkingCopy],
+        file_path: str,
+        content_hash: str,
+        file_size: int,
+    ) -> tuple[Optional[str], Optional[str], int]:
+        """工作副本的 (存储路径, 内容哈希, 大小)：原图无需处理时指向原图，无法生成时为空"""
+        if working is None:
+            return None, None, 0
+        if working.temp_path is None:
+            return file_path, content_hash, file_size
+        return blob_store.blob_path(working.content_hash, ".jpg"), working.content_hash, working.file_size
+    
+    @staticmethod
+    def acquire_blobs(session, refs: list[tuple[Optional[str], Optional[str], int]]) -> None:
+        """按 (内容哈希, 存储路径, 大小) 增加引用计数，相同内容合并为一次更新"""
+        counts: dict[str, list] = {}
+        for content_hash, file_path, file_size in refs:
+            if content_hash is None:
+                continue
+            counts.setdefault(content_hash, [file_path, file_size, 0])[2] += 1
+        for content_hash, (file_path, file_size, count) in counts.items():
+            blob_store.acquire(session, content_hash, file_path, file_size, count)
+    
+    @staticmethod
+    def insert_image_record(
+        user_id: int,
+        filename: str,
+        original_filename: str,
+        file_path: str,
+        file_size: int,
+        mime_type: str,
+        width: int,
+        height: int,
+        content_hash: str,
+        working_path: Optional[str] = None,
+        working_hash: Optional[str] = None,
+        working_size: int = 0,
+    ) -> tuple[int, datetime]:
+        """写入图片记录并增加原图和工作副本的引用计数，返回记录ID和创建时间"""
         from app.core.database import SessionLocal
-        from sqlalchemy import text
         
         session = SessionLocal()
         try:
-            result = session.execute(text("""
-                SELECT COUNT(*) FROM images WHERE user_id = :user_id
-            """), {'user_id': user_id})
-            count = result.fetchone()[0] or 0
+            image_id, created_at = insert_row(session, "images", {
+                'user_id': user_id,
+                'filename': filename,
+                'original_filename': original_filename,
+                'file_path': file_path,
+                'file_size': file_size,
+                'mime_type': mime_type,
+                'width': width,
+                'height': height,
+                'content_hash': content_hash,
+                'working_path': working_path,
+                'working_hash': working_hash
+            })
+            UploadService.acquire_blobs(session, [
+                (content_hash, file_path, file_size),
+                (working_hash, working_path, working_size),
+            ])
+            
+            session.commit()
+            return image_id, created_at
         finally:
             session.close()
-        
-        # 生成新的文件名：user{id}_img_{序号}_{时间戳}{扩展名}
-        timestamp = int(time.time() * 1000)
-        sequence = count + 1
-        filename = f"user{user_id}_img_{sequence:03d}_{timestamp}{ext}"
-        
-        return filename, str(sequence)
     
     @staticmethod
-    async def save_uploaded_file(file: UploadFile, user_id: int) -> tuple[str, str, str]:
-        """保存上传的文件并返回文件ID、路径和文件名"""
-        # 创建用户目录结构
-        dirs = UploadService.create_user_directories(user_id)
+    def insert_image_records(
+        user_id: int,
+        records: list[dict],
+        blob_refs: list[tuple[Optional[str], Optional[str], int]],
+    ) -> dict[str, tuple[int, datetime]]:
+        """在一个事务中批量写入图片记录并增加引用计数，返回 文件名 -> (记录ID, 创建时间)"""
+        from app.core.database import SessionLocal
         
-        # 生成用户友好的文件名
-        filename, sequence = UploadService.generate_user_filename(user_id, file.filename)
-        file_path = os.path.join(dirs["original_dir"], filename)
+        session = SessionLocal()
+        try:
+            # 多行 INSERT 一次写入整批记录
+            inserted = insert_rows(
+                session,
+                "images",
+                [{**record, 'user_id': user_id} for record in records],
+                key_column="filename",
+            )
+            
+            # 同一批中重复的内容只执行一次计数更新
+            UploadService.acquire_blobs(session, blob_refs)
+            
+            session.commit()
+            return {record['filename']: row for record, row in zip(records, inserted)}
+        finally:
+            session.close()
+    
+    @staticmethod
+    def remove_image_records(
+        image_ids: list[int],
+        blob_refs: list[tuple[Optional[str], Optional[str], int]],
+    ) -> None:
+        """撤销已提交但文件未能放入存储的图片记录，并在同一事务中释放对应的引用计数"""
+        from app.core.database import SessionLocal
+        from sqlalchemy import bindparam, text
         
-        # 读取文件内容
-        content = await file.read()
+        if not image_ids:
+            return
+        session = SessionLocal()
+        try:
+            session.execute(
+                text("DELETE FROM images WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": image_ids}
+            )
+            counts: dict[str, int] = {}
+            for content_hash, _, _ in blob_refs:
+                if content_hash is not None:
+                    counts[content_hash] = counts.get(content_hash, 0) + 1
+            for content_hash, count in counts.items():
+                blob_store.release(session, content_hash, count)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            print(f"⚠️ 撤销图片记录失败 {image_ids}: {e}")
+        finally:
+            session.close()
+    
+    @staticmethod
+    async def ingest_temp_file(
+        temp_path: str,
+        file_size: int,
+        content_hash: str,
+        user_id: int,
+        original_filename: str,
+        content_type: Optional[str] = None,
+        upload_id: Optional[str] = None,
+        keep_temp: bool = False,
+    ) -> UploadResponse:
+        """对已完整落盘的临时文件执行探测、命名、入库和存储（普通上传与断点续传共用）
         
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        keep_temp 为 True 时失败后保留临时文件，由调用方决定是否删除（断点续传会话可重试）
+        """
+        if upload_id is None:
+            upload_id = upload_jobs.create(user_id).job_id
+            upload_jobs.advance(upload_id, "received")
+        working = None
+        try:
+            # 在进程池中一次完成探测（尺寸、格式、EXIF方向、感知哈希）和工作副本生成
+            probe, working = await run_in_process(prepare_upload, temp_path, settings.WORKING_MAX_EDGE)
+            upload_jobs.advance(upload_id, "probed")
+            demo_input_key = await run_in_thread(UploadService.match_demo_input_key, probe.phash)
+            
+            # 生成用户友好的文件名；文件本身按内容哈希存放，相同内容只保存一份
+            filename, sequence = await run_in_thread(
+                UploadService.generate_user_filename, user_id, original_filename
+            )
+            ext = blob_extension(probe.format, original_filename)
+            file_path = blob_store.blob_path(content_hash, ext)
+            working_path, working_hash, working_size = UploadService.working_copy_fields(
+                working, file_path, content_hash, file_size
+            )
+            
+            # 保存到数据库（同一事务中增加引用计数）
+            image_id, created_at = await run_in_thread(
+                UploadService.insert_image_record,
+                user_id,
+                filename,
+                original_filename,
+                file_path,
+                file_size,
+                probe.mime_type or content_type or "image/jpeg",
+                probe.width,
+                probe.height,
+                content_hash,
+                working_path,
+                working_hash,
+                working_size,
+            )
+            upload_jobs.advance(upload_id, "indexed", image_id=image_id, filename=filename, file_path=file_path)
+            
+            # 引用已提交后再放入存储；放入失败时撤销记录和引用，不留下指向不存在文件的记录
+            try:
+                await run_in_thread(blob_store.materialize, temp_path, content_hash, ext)
+                if working is not None and working.temp_path is not None:
+                    await run_in_thread(blob_store.materialize, working.temp_path, working_hash, ".jpg")
+            except BaseException:
+                await run_in_thread(
+                    UploadService.remove_image_records,
+                    [image_id],
+                    [(content_hash, file_path, file_size), (working_hash, working_path, working_size)],
+                )
+                raise
+            upload_jobs.advance(upload_id, "stored")
+            prewarm_derivative(working_path or file_path)
+        except BaseException as e:
+            if not keep_temp:
+                UploadService.discard_temp_file(temp_path)
+            if working is not None and working.temp_path is not None:
+                UploadService.discard_temp_file(working.temp_path)
+            upload_jobs.fail(upload_id, e.detail if isinstance(e, HTTPException) else f"上传失败: {str(e)}")
+            raise
         
-        return sequence, file_path, filename
+        return UploadResponse(
+            success=True,
+            message="图片上传成功",
+            image_id=image_id,
+            filename=filename,
+            file_path=file_path,
+            file_size=file_size,
+            width=probe.width,
+            height=probe.height,
+            created_at=created_at,
+            demo_input_key=demo_input_key,
+            upload_id=upload_id,
+            thumbnail_url=derivative_url(working_path or file_path),
+        )
     
     @staticmethod
     async def upload_image(file: UploadFile, user_id: int = None) -> UploadResponse:
@@ -181,7 +444,7 @@ class UploadService:
         try:
             # 如果没有提供用户ID，获取或创建默认用户
             if user_id is None:
-                user_id = UploadService.get_or_create_default_user()
+                user_id = await run_in_thread(UploadService.get_or_create_default_user)
             # 验证文件
             if not UploadService.validate_image(file):
                 raise HTTPException(
@@ -189,73 +452,25 @@ class UploadService:
                     detail="不支持的文件格式，请上传 JPG、PNG 或 WebP 格式的图片"
                 )
             
-            # 检查文件大小
-            content = await file.read()
-            if len(content) > MAX_FILE_SIZE:
+            # 客户端声明的大小已超限时直接拒绝，无需读取内容
+            if file.size is not None and file.size > MAX_FILE_SIZE:
                 raise HTTPException(
                     status_code=400,
                     detail="文件过大，请上传小于10MB的图片"
                 )
             
-            # 获取图片尺寸
-            width, height = UploadService.get_image_dimensions(content)
-            demo_input_key = UploadService.match_demo_input_key(content)
-
-            # 重置文件指针
-            await file.seek(0)
-            
-            # 保存文件
-            sequence, file_path, filename = await UploadService.save_uploaded_file(file, user_id)
-            
-            # 保存到数据库
-            from app.core.database import SessionLocal
-            from sqlalchemy import text
-            
-            session = SessionLocal()
+            # 流式写入临时文件，同时得到大小和内容哈希
+            dirs = UploadService.create_user_directories(user_id)
+            upload_id = upload_jobs.create(user_id, original_filename=file.filename).job_id
             try:
-                # 使用原生SQL插入数据
-                result = session.execute(text("""
-                    INSERT INTO images (user_id, filename, original_filename, file_path, file_size, mime_type, width, height)
-                    VALUES (:user_id, :filename, :original_filename, :file_path, :file_size, :mime_type, :width, :height)
-                """), {
-                    'user_id': user_id,
-                    'filename': filename,
-                    'original_filename': file.filename,
-                    'file_path': file_path,
-                    'file_size': len(content),
-                    'mime_type': file.content_type or "image/jpeg",
-                    'width': width,
-                    'height': height
-                })
-                
-                session.commit()
-                
-                # 获取插入的记录ID
-                result = session.execute(text("""
-                    SELECT id, created_at FROM images 
-                    WHERE filename = :filename
-                """), {'filename': filename})
-                
-                record = result.fetchone()
-                if not record:
-                    raise HTTPException(status_code=500, detail="数据库记录创建失败")
-                
-                image_id = record[0]
-                created_at = record[1]
-            finally:
-                session.close()
+                temp_path, file_size, content_hash = await UploadService.stream_to_temp(file, dirs["temp_dir"])
+            except BaseException as e:
+                upload_jobs.fail(upload_id, e.detail if isinstance(e, HTTPException) else f"上传失败: {str(e)}")
+                raise
+            upload_jobs.advance(upload_id, "received")
             
-            return UploadResponse(
-                success=True,
-                message="图片上传成功",
-                image_id=image_id,
-                filename=filename,
-                file_path=file_path,
-                file_size=len(content),
-                width=width,
-                height=height,
-                created_at=created_at,
-                demo_input_key=demo_input_key,
+            return await UploadService.ingest_temp_file(
+                temp_path, file_size, content_hash, user_id, file.filename, file.content_type, upload_id
             )
             
         except HTTPException:
@@ -264,35 +479,441 @@ class UploadService:
             raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
     
     @staticmethod
-    def get_upload_status(file_id: str) -> UploadStatusResponse:
-        """获取上传状态"""
+    async def _receive_batch_file(
+        file: UploadFile, user_id: int, temp_dir: str, probe_slots: asyncio.Semaphore
+    ) -> dict:
+        """批量上传中单个文件的接收与探测，失败时返回带错误信息的结果"""
+        item = {'original_filename': file.filename or "", 'error': None, 'temp_path': None}
+        item['upload_id'] = upload_jobs.create(user_id, original_filename=file.filename).job_id
+        try:
+            await UploadService._receive_and_probe(file, temp_dir, probe_slots, item)
+        finally:
+            if item['error'] is not None:
+                upload_jobs.fail(item['upload_id'], item['error'])
+        return item
+    
+    @staticmethod
+    async def _receive_and_probe(file: UploadFile, temp_dir: str, probe_slots: asyncio.Semaphore, item: dict) -> None:
+        if not UploadService.validate_image(file):
+            item['error'] = "不支持的文件格式，请上传 JPG、PNG 或 WebP 格式的图片"
+            return
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            item['error'] = "文件过大，请上传小于10MB的图片"
+            return
+        try:
+            temp_path, file_size, content_hash = await UploadService.stream_to_temp(file, temp_dir)
+        except HTTPException as e:
+            item['error'] = e.detail
+            return
+        item.update(temp_path=temp_path, file_size=file_size, content_hash=content_hash,
+                    content_type=file.content_type)
+        upload_jobs.advance(item['upload_id'], "received")
+        try:
+            async with probe_slots:
+                item['probe'], item['working'] = await run_in_process(
+                    prepare_upload, temp_path, settings.WORKING_MAX_EDGE
+                )
+            item['demo_input_key'] = await run_in_thread(UploadService.match_demo_input_key, item['probe'].phash)
+            upload_jobs.advance(item['upload_id'], "probed")
+        except Exception as e:
+            UploadService.discard_temp_file(temp_path)
+            item.update(error=f"图片解析失败: {str(e)}", temp_path=None)
+    
+    @staticmethod
+    async def upload_images_batch(files: list[UploadFile], user_id: int) -> BatchUploadResponse:
+        """批量上传：并行探测，所有记录在一个事务中写入，逐个返回结果"""
+        if not files:
+            raise HTTPException(status_code=400, detail="请至少上传一张图片")
+        if len(files) > MAX_BATCH_FILES:
+            raise HTTPException(status_code=400, detail=f"单次最多上传 {MAX_BATCH_FILES} 张图片")
+        
+        dirs = UploadService.create_user_directories(user_id)
+        
+        # 并行探测，并发数与图像进程数一致，避免一次性塞满进程池队列
+        probe_slots = asyncio.Semaphore(image_executor.max_workers)
+        items = await asyncio.gather(*[
+            UploadService._receive_batch_file(file, user_id, dirs["temp_dir"], probe_slots) for file in files
+        ])
+        ready = [item for item in items if item['error'] is None]
+        
+        if ready:
+            inserted: dict[str, tuple[int, datetime]] = {}
+            try:
+                names = await run_in_thread(
+                    UploadService.generate_user_filenames,
+                    user_id,
+                    [item['original_filename'] for item in ready],
+                )
+                records = []
+                blob_refs = []
+                for item, (filename, _) in zip(ready, names):
+                    probe = item['probe']
+                    item['ext'] = blob_extension(probe.format, item['original_filename'])
+                    file_path = blob_store.blob_path(item['content_hash'], item['ext'])
+                    working_path, working_hash, working_size = UploadService.working_copy_fields(
+                        item['working'], file_path, item['content_hash'], item['file_size']
+                    )
+                    records.append({
+                        'filename': filename,
+                        'original_filename': item['original_filename'],
+                        'file_path': file_path,
+                        'file_size': item['file_size'],
+                        'mime_type': probe.mime_type or item['content_type'] or "image/jpeg",
+                        'width': probe.width,
+                        'height': probe.height,
+                        'content_hash': item['content_hash'],
+                        'working_path': working_path,
+                        'working_hash': working_hash,
+                    })
+                    item['blob_refs'] = [
+                        (item['content_hash'], file_path, item['file_size']),
+                        (working_hash, working_path, working_size),
+                    ]
+                    blob_refs.extend(item['blob_refs'])
+                    item['record'] = records[-1]
+                
+                inserted = await run_in_thread(UploadService.insert_image_records, user_id, records, blob_refs)
+                for item in ready:
+                    image_id, _ = inserted[item['record']['filename']]
+                    upload_jobs.advance(
+                        item['upload_id'], "indexed",
+                        image_id=image_id,
+                        filename=item['record']['filename'],
+                        file_path=item['record']['file_path'],
+                    )
+                
+                # 引用已提交后再放入存储
+                for item in ready:
+                    await run_in_thread(
+                        blob_store.materialize, item['temp_path'], item['content_hash'], item['ext']
+                    )
+                    item['temp_path'] = None
+                    working = item['working']
+                    if working is not None and working.temp_path is not None:
+                        await run_in_thread(
+                            blob_store.materialize, working.temp_path, working.content_hash, ".jpg"
+                        )
+                        working.temp_path = None
+                    upload_jobs.advance(item['upload_id'], "stored")
+                    prewarm_derivative(item['record']['working_path'] or item['record']['file_path'])
+                    image_id, created_at = inserted[item['record']['filename']]
+                    item['response'] = UploadResponse(
+                        success=True,
+                        message="图片上传成功",
+                        image_id=image_id,
+                        filename=item['record']['filename'],
+                        file_path=item['record']['file_path'],
+                        file_size=item['file_size'],
+                        width=item['probe'].width,
+                        height=item['probe'].height,
+                        created_at=created_at,
+                        demo_input_key=item['demo_input_key'],
+                        upload_id=item['upload_id'],
+                        thumbnail_url=derivative_url(item['record']['working_path'] or item['record']['file_path']),
+                    )
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                failed = [item for item in ready if item.get('response') is None]
+                # 已入库但文件未放入存储的记录一并撤销
+                inserted_failed = [item for item in failed if item.get('record', {}).get('filename') in inserted]
+                await run_in_thread(
+                    UploadService.remove_image_records,
+                    [inserted[item['record']['filename']][0] for item in inserted_failed],
+                    [ref for item in inserted_failed for ref in item['blob_refs']],
+                )
+                for item in failed:
+                    item['error'] = f"上传失败: {detail}"
+                    upload_jobs.fail(item['upload_id'], item['error'])
+            finally:
+                for item in ready:
+                    if item['temp_path']:
+                        UploadService.discard_temp_file(item['temp_path'])
+                    if item['working'] is not None and item['working'].temp_path:
+                        UploadService.discard_temp_file(item['working'].temp_path)
+        
+        results = [
+            BatchUploadItem(
+                original_filename=item['original_filename'],
+                success=item.get('response') is not None,
+                message="图片上传成功" if item.get('response') is not None else item['error'],
+                result=item.get('response'),
+            )
+            for item in items
+        ]
+        success_count = sum(1 for result in results if result.success)
+        return BatchUploadResponse(
+            success=success_count == len(results),
+            message=f"成功上传 {success_count}/{len(results)} 张图片",
+            total_count=len(results),
+            success_count=success_count,
+            failed_count=len(results) - success_count,
+            results=results,
+        )
+    
+    # ---------- 断点续传 ----------
+    # 会话状态保存在用户 temp_dir 中：{session_id}.part 为已接收的数据，{session_id}.json 为元数据
+    
+    @staticmethod
+    def _session_paths(user_id: int, session_id: str) -> tuple[str, str]:
+        """返回会话的数据文件和元数据文件路径"""
+        if not UPLOAD_SESSION_ID_PATTERN.fullmatch(session_id):
+            raise HTTPException(status_code=404, detail="上传会话不存在")
+        temp_dir = UploadService.get_user_directory_structure(user_id)["temp_dir"]
+        return (
+            os.path.join(temp_dir, f"{session_id}.part"),
+            os.path.join(temp_dir, f"{session_id}.json"),
+        )
+    
+    @staticmethod
+    def _write_session_meta(meta_path: str, meta: dict) -> None:
+        """原子地写入会话元数据"""
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+    
+    @staticmethod
+    def _discard_session_files(part_path: str, meta_path: str) -> None:
+        """删除会话的数据文件和元数据"""
+        UploadService.discard_temp_file(part_path)
+        UploadService.discard_temp_file(meta_path)
+    
+    @staticmethod
+    def _session_response(meta: dict, offset: int) -> UploadSessionResponse:
+        return UploadSessionResponse(
+            session_id=meta["session_id"],
+            filename=meta["filename"],
+            file_size=meta["file_size"],
+            offset=offset,
+            expires_at=datetime.fromtimestamp(meta["updated_at"] + settings.UPLOAD_SESSION_TTL),
+        )
+    
+    @staticmethod
+    def cleanup_expired_sessions(user_id: int) -> int:
+        """删除用户 temp_dir 中已过期的上传会话，返回删除数量"""
+        temp_dir = UploadService.get_user_directory_structure(user_id)["temp_dir"]
+        if not os.path.isdir(temp_dir):
+            return 0
+        
+        removed = 0
+        deadline = time.time() - settings.UPLOAD_SESSION_TTL
+        for name in os.listdir(temp_dir):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(temp_dir, name)
+            try:
+                if os.path.getmtime(meta_path) >= deadline:
+                    continue
+            except FileNotFoundError:
+                continue
+            session_id = name[:-len(".json")]
+            UploadService.discard_temp_file(os.path.join(temp_dir, f"{session_id}.part"))
+            UploadService.discard_temp_file(meta_path)
+            removed += 1
+        return removed
+    
+    @staticmethod
+    def cleanup_all_expired_sessions() -> int:
+        """删除所有用户已过期的上传会话，之后不再创建会话的用户也会被清理"""
+        if not os.path.isdir(BASE_STATIC_DIR):
+            return 0
+        removed = 0
+        for name in os.listdir(BASE_STATIC_DIR):
+            match = re.fullmatch(r"user(\d+)", name)
+            if match:
+                removed += UploadService.cleanup_expired_sessions(int(match.group(1)))
+        return removed
+    
+    @staticmethod
+    def collect_blob_garbage() -> int:
+        """删除引用计数已降为0的存储文件（删除的图片、写入后撤销的上传），返回删除数量"""
         from app.core.database import SessionLocal
-        from sqlalchemy import text
         
         session = SessionLocal()
         try:
-            # 查找匹配的图片记录
-            result = session.execute(text("""
-                SELECT id, filename, file_path, file_size, created_at FROM images 
-                WHERE filename LIKE :file_id_pattern
-            """), {'file_id_pattern': f"{file_id}%"})
+            return blob_store.collect_garbage(session)
+        finally:
+            session.close()
+    
+    @staticmethod
+    async def sweep_upload_storage() -> None:
+        """后台循环：每隔 UPLOAD_SESSION_SWEEP_INTERVAL 秒清理一次所有用户的过期上传会话和不再被引用的存储文件"""
+        while True:
+            try:
+                removed = await run_in_thread(UploadService.cleanup_all_expired_sessions)
+                if removed:
+                    print(f"✅ 已清理 {removed} 个过期的上传会话")
+            except Exception as e:
+                print(f"⚠️ 清理过期上传会话失败: {e}")
+            try:
+                removed = await run_in_thread(UploadService.collect_blob_garbage)
+                if removed:
+                    print(f"✅ 已删除 {removed} 个不再被引用的存储文件")
+            except Exception as e:
+                print(f"⚠️ 回收存储文件失败: {e}")
+            await asyncio.sleep(settings.UPLOAD_SESSION_SWEEP_INTERVAL)
+    
+    @staticmethod
+    def load_upload_session(user_id: int, session_id: str) -> tuple[dict, int]:
+        """读取会话元数据和当前偏移量，过期的会话会被删除"""
+        part_path, meta_path = UploadService._session_paths(user_id, session_id)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="上传会话不存在")
+        
+        if meta["updated_at"] + settings.UPLOAD_SESSION_TTL < time.time():
+            UploadService.discard_temp_file(part_path)
+            UploadService.discard_temp_file(meta_path)
+            raise HTTPException(status_code=404, detail="上传会话已过期")
+        
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return meta, offset
+    
+    @staticmethod
+    def create_upload_session(
+        user_id: int,
+        filename: str,
+        file_size: int,
+        content_type: Optional[str] = None,
+    ) -> UploadSessionResponse:
+        """创建断点续传会话"""
+        if not UploadService.is_allowed_filename(filename):
+            raise HTTPException(
+                status_code=400,
+                detail="不支持的文件格式，请上传 JPG、PNG 或 WebP 格式的图片"
+            )
+        if file_size > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail="文件过大，请上传小于10MB的图片"
+            )
+        
+        UploadService.create_user_directories(user_id)
+        UploadService.cleanup_expired_sessions(user_id)
+        
+        session_id = uuid.uuid4().hex
+        part_path, meta_path = UploadService._session_paths(user_id, session_id)
+        now = time.time()
+        meta = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "filename": filename,
+            "file_size": file_size,
+            "content_type": content_type,
+            "created_at": now,
+            "updated_at": now,
+        }
+        open(part_path, "wb").close()
+        UploadService._write_session_meta(meta_path, meta)
+        # 会话ID同时作为上传任务ID，接收数据期间状态为 pending
+        upload_jobs.create(user_id, job_id=session_id, original_filename=filename)
+        return UploadService._session_response(meta, 0)
+    
+    @staticmethod
+    def get_upload_session(user_id: int, session_id: str) -> UploadSessionResponse:
+        """查询会话当前已接收的偏移量"""
+        meta, offset = UploadService.load_upload_session(user_id, session_id)
+        return UploadService._session_response(meta, offset)
+    
+    @staticmethod
+    async def append_upload_chunk(
+        user_id: int,
+        session_id: str,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+    ) -> UploadSessionResponse:
+        """从指定偏移量追加一段数据，偏移量必须等于服务器当前已接收的字节数"""
+        async with session_lock(session_id):
+            meta, current = await run_in_thread(UploadService.load_upload_session, user_id, session_id)
+            if offset != current:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"偏移量不匹配，服务器当前偏移量为 {current}",
+                    headers={"Upload-Offset": str(current)},
+                )
             
-            record = result.fetchone()
+            part_path, meta_path = UploadService._session_paths(user_id, session_id)
+            written = current
+            buffer = await run_in_thread(UploadService._open_for_write, part_path, "ab")
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if written + len(chunk) > meta["file_size"]:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="上传数据超出声明的文件大小"
+                        )
+                    await run_in_thread(buffer.write, chunk)
+                    written += len(chunk)
+            finally:
+                # 连接中断时已写入的部分依然保留，客户端查询偏移量后可继续
+                buffer.close()
+                meta["updated_at"] = time.time()
+                await run_in_thread(UploadService._write_session_meta, meta_path, meta)
+            
+            return UploadService._session_response(meta, written)
+    
+    @staticmethod
+    async def complete_upload_session(user_id: int, session_id: str) -> UploadResponse:
+        """数据接收完整后执行正常的校验、探测与入库流程"""
+        async with session_lock(session_id):
+            meta, offset = await run_in_thread(UploadService.load_upload_session, user_id, session_id)
+            if offset != meta["file_size"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"数据尚未接收完整（{offset}/{meta['file_size']}）",
+                    headers={"Upload-Offset": str(offset)},
+                )
             
-            if not record:
-                return UploadStatusResponse(
-                    success=False,
-                    message="未找到指定的上传记录",
-                    status="not_found"
+            part_path, meta_path = UploadService._session_paths(user_id, session_id)
+            try:
+                content_hash, file_size = await run_in_thread(hash_file, part_path)
+                upload_jobs.advance(session_id, "received")
+                response = await UploadService.ingest_temp_file(
+                    part_path, file_size, content_hash, user_id, meta["filename"], meta.get("content_type"),
+                    session_id, keep_temp=True,
                 )
+            except Exception as e:
+                # 可重试的错误保留已接收的数据和会话，客户端稍后再次调用完成接口即可，无需重新上传
+                if UploadService.is_retryable_error(e) and await run_in_thread(os.path.exists, part_path):
+                    meta["updated_at"] = time.time()
+                    await run_in_thread(UploadService._write_session_meta, meta_path, meta)
+                else:
+                    await run_in_thread(UploadService._discard_session_files, part_path, meta_path)
+                if isinstance(e, HTTPException):
+                    raise
+                raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
             
-            return UploadStatusResponse(
-                success=True,
-                message="上传记录查询成功",
-                status="uploaded",
-                image_id=record[0],
-                filename=record[1],
-                file_path=record[2]
-            )
-        finally:
-            session.close()
\ No newline at end of file
+            # 数据已放入存储，只需删除会话元数据
+            await run_in_thread(UploadService.discard_temp_file, meta_path)
+            return response
+    
+    @staticmethod
+    def cancel_upload_session(user_id: int, session_id: str) -> None:
+        """放弃上传会话并删除已接收的数据"""
+        part_path, meta_path = UploadService._session_paths(user_id, session_id)
+        if not os.path.exists(meta_path):
+            raise HTTPException(status_code=404, detail="上传会话不存在")
+        UploadService._discard_session_files(part_path, meta_path)
+        upload_jobs.fail(session_id, "上传已取消")
+    
+    @staticmethod
+    def get_upload_status(upload_id: str, user_id: int) -> UploadStatusResponse:
+        """按上传任务ID查询处理状态，只能查询自己的任务：内存中的任务直接返回，否则按主键查 jobs 表"""
+        job = upload_jobs.get(upload_id)
+        if job is None or job.user_id != user_id:
+            raise HTTPException(status_code=404, detail="未找到指定的上传记录")
+        
+        return UploadStatusResponse(
+            success=job.status != "failed",
+            message=job.message or "上传记录查询成功",
+            status=job.status,
+            stage=job.stage,
+            progress=job.progress,
+            image_id=job.result.get("image_id"),
+            filename=job.result.get("filename"),
+            file_path=job.result.get("file_path"),
+        )
@@ -5,9 +5,10 @@ from sqlalchemy.orm import Session
 from sqlalchemy import text
 from fastapi import HTTPException, status
 from typing import Optional
-from datetime import datetime
 from app.core.security import get_password_hash, verify_password, create_access_token
 from app.core.models import User
+from app.core.database import insert_row
+from app.core.storage import blob_store
 from .schemas import UserCreate, UserLogin, UserResponse, UserUpdate
 
 def create_user(db: Session, user: UserCreate) -> UserResponse:
@@ -39,33 +40,21 @@ def create_user(db: Session, user: UserCreate) -> UserResponse:
     # 创建新用户
     hashed_password = get_password_hash(user.password)
     
-    result = db.execute(
-        text("""
-            INSERT INTO users (username, email, password_hash, created_at)
-            VALUES (:username, :email, :password_hash, :created_at)
-        """),
-        {
-            "username": user.username,
-            "email": user.email,
-            "password_hash": hashed_password,
-            "created_at": datetime.utcnow()
-        }
-    )
+    user_id, created_at = insert_row(db, "users", {
+        "username": user.username,
+        "email": user.email,
+        "password_hash": hashed_password
+    })
     
     db.commit()
     
-    # 获取新创建的用户
-    new_user = db.execute(
-        text("SELECT * FROM users WHERE id = :user_id"),
-        {"user_id": result.lastrowid}
-    ).fetchone()
-    
+    # 新用户的字段均已知，无需回查
     return UserResponse(
-        id=new_user.id,
-        username=new_user.username,
-        email=new_user.email,
-        avatar_path=new_user.avatar_path,
-        created_at=new_user.created_at
+        id=user_id,
+        username=user.username,
+        email=user.email,
+        avatar_path=None,
+        created_at=created_at
     )
 
 def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
@@ -187,6 +176,29 @@ def update_user(db: Session, user_id: int, user_update: UserUpdate) -> UserRespo
 
 def delete_user(db: Session, user_id: int) -> bool:
     """删除用户"""
+    # 级联删除图片记录前，先释放它们对存储文件的引用
+    # （按需渲染的生成图不持有存储文件，其 content_hash 只是内容标识）
+    blob_refs = db.execute(
+        text("""
+            SELECT content_hash, COUNT(*) FROM (
+                SELECT i.content_hash FROM images i
+                WHERE i.user_id = :user_id AND i.content_hash IS NOT NULL
+                UNION ALL
+                SELECT i.working_hash FROM images i
+                WHERE i.user_id = :user_id AND i.working_hash IS NOT NULL
+                UNION ALL
+                SELECT gi.content_hash FROM generated_images gi
+                JOIN images i ON gi.original_image_id = i.id
+                WHERE i.user_id = :user_id AND gi.content_hash IS NOT NULL
+                AND gi.render_params IS NULL
+            ) refs
+            GROUP BY content_hash
+        """),
+        {"user_id": user_id}
+    ).fetchall()
+    for content_hash, count in blob_refs:
+        blob_store.release(db, content_hash, count)
+    
     result = db.execute(
         text("DELETE FROM users WHERE id = :user_id"),
         {"user_id": user_id}
@@ -199,4 +211,7 @@ def delete_user(db: Session, user_id: int) -> bool:
         )
     
     db.commit()
+    
+    # 清理不再被引用的文件
+    blob_store.collect_garbage(db)
     return True